@@ -0,0 +1,185 @@
+import math
+import random
+import re
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+from database import content_hash
+
+JURISDICTION_COUNT = 109
+CYCLES = [2019, 2022, 2025]
+
+# Section number ranges loosely follow the California Building Code chapters
+CATEGORIES = {
+    'Structural': (1601, ['load', 'bearing', 'foundation', 'frame', 'steel', 'concrete', 'beam',
+                          'column', 'joist', 'truss', 'seismic', 'shear', 'lateral']),
+    'Electrical': (2701, ['voltage', 'circuit', 'wiring', 'conduit', 'grounding', 'breaker',
+                          'panel', 'lighting', 'power']),
+    'Plumbing': (2901, ['pipe', 'drainage', 'vent', 'fixture', 'water', 'valve', 'pressure',
+                        'supply', 'waste']),
+    'Fire Safety': (901, ['sprinkler', 'alarm', 'exit', 'rated', 'assembly', 'egress', 'smoke']),
+    'Accessibility': (1101, ['ramp', 'route', 'clearance', 'handrail', 'door', 'grab', 'parking'])
+}
+MODALS = ['shall', 'shall', 'shall', 'shall not', 'must', 'should', 'may', 'is permitted to']
+SUBJECTS = ['Every {term}', 'Each {term} assembly', 'The {term} system', 'Any exposed {term}',
+            'A {term} serving a dwelling unit', 'Required {term} elements']
+ACTIONS = ['be installed at least {measure} from the property line',
+           'provide a minimum clearance of {measure}',
+           'not exceed {measure} in any direction',
+           'be designed in accordance with {reference}',
+           'be inspected before concealment as required by {reference}',
+           'comply with {reference} and maintain {measure} of separation',
+           'be protected where located within {measure} of a {term}']
+MEASURES = ['{n} inches', '{n} feet', '{n} square feet', '{n}%', '{n}.5 inches']
+REFERENCES = ['Section {cited}', 'ASTM E{n}', 'NFPA {n}', 'IBC {section}', 'ANSI A{n}.1',
+              'code {section}']
+LOCAL_SENTENCES = ['Local amendment: {subject} {modal} {action}.',
+                   'Exception: in high fire hazard severity zones, {subject_lower} {modal} {action}.',
+                   'Within the city, {subject_lower} {modal} {action}.']
+
+def jurisdiction_names(count: int = JURISDICTION_COUNT) -> List[str]:
+    return [f"Jurisdiction {i:03d}" for i in range(1, count + 1)]
+
+class CorpusGenerator:
+    """Seeded generator for template-plus-amendment code corpora.
+
+    Every jurisdiction starts from one shared model-code template per cycle; a share of its
+    sections carry local amendments (changed measurements, added or dropped sentences, softer
+    or stricter modals), the structure that dominates real Bay Area codes.
+    """
+
+    def __init__(self, seed: int = 0, jurisdictions: int = JURISDICTION_COUNT,
+                 sections_per_category: int = 10, sentences: tuple = (3, 10),
+                 amendment_rate: float = 0.3):
+        self.random = random.Random(seed)
+        self.jurisdictions = jurisdiction_names(jurisdictions)
+        self.sections_per_category = sections_per_category
+        self.sentences = sentences
+        self.amendment_rate = amendment_rate
+
+    def _fill(self, template: str, terms: List[str], section: str) -> str:
+        r = self.random
+        return template.format(
+            term=r.choice(terms),
+            measure=r.choice(MEASURES).format(n=r.randint(1, 120)),
+            # Section references point at a sibling in the same chapter, as cross-references do
+            reference=r.choice(REFERENCES).format(n=r.randint(10, 999), section=section,
+                                                  cited=f"{section.split('.')[0]}.{r.randint(1, 10)}"),
+            section=section,
+            n=r.randint(1, 120)
+        )
+
+    def _sentence(self, terms: List[str], section: str) -> str:
+        r = self.random
+        subject = self._fill(r.choice(SUBJECTS), terms, section)
+        action = self._fill(r.choice(ACTIONS), terms, section)
+        return f"{subject} {r.choice(MODALS)} {action}."
+
+    def template(self) -> List[Dict]:
+        """One model-code section set shared by every jurisdiction"""
+        sections = []
+        for category, (chapter, terms) in CATEGORIES.items():
+            for i in range(1, self.sections_per_category + 1):
+                number = f"{chapter + i // 10}.{i % 10 + 1}"
+                sentences = [self._sentence(terms, number)
+                             for _ in range(self.random.randint(*self.sentences))]
+                sections.append({'category': category, 'section': number, 'content': ' '.join(sentences)})
+        return sections
+
+    def amend(self, content: str, category: str, section: str) -> str:
+        """Apply one random local amendment to a section's text"""
+        r = self.random
+        terms = CATEGORIES[category][1]
+        # Split on sentence ends only, so "12.5 inches" and "Section 1601.2" stay whole
+        sentences = [sentence for sentence in re.split(r'(?<=\.)\s+', content) if sentence]
+        kind = r.choice(['measure', 'add', 'drop', 'modal'])
+        if kind == 'add' or len(sentences) < 2:
+            subject = self._fill(r.choice(SUBJECTS), terms, section)
+            sentences.insert(r.randint(0, len(sentences)), r.choice(LOCAL_SENTENCES).format(
+                subject=subject, subject_lower=subject[0].lower() + subject[1:],
+                modal=r.choice(MODALS), action=self._fill(r.choice(ACTIONS), terms, section)
+            ))
+        elif kind == 'drop':
+            sentences.pop(r.randrange(len(sentences)))
+        elif kind == 'modal':
+            i = r.randrange(len(sentences))
+            for old, new in (('shall not', 'shall'), ('should', 'shall'), ('may', 'shall'), ('shall', 'should')):
+                if f" {old} " in sentences[i]:
+                    sentences[i] = sentences[i].replace(f" {old} ", f" {new} ", 1)
+                    break
+        else:
+            i = r.randrange(len(sentences))
+            words = sentences[i].split()
+            numbers = [k for k, word in enumerate(words) if word.isdigit()]
+            if numbers:
+                k = r.choice(numbers)
+                words[k] = str(max(1, int(int(words[k]) * r.choice([0.5, 0.75, 1.25, 1.5, 2]))))
+                sentences[i] = ' '.join(words)
+        return ' '.join(sentences)
+
+    def generate(self, cycles: Optional[List[int]] = None) -> Dict[str, List[Dict]]:
+        """Build current codes, version rows and update history for every jurisdiction.
+
+        Returns ``codes`` (building_codes-shaped rows with ``content_hash``), ``versions``
+        (code_versions rows) and ``updates`` (code_updates rows with both texts).
+        """
+        r = self.random
+        cycles = cycles or CYCLES
+        # Each jurisdiction has a habitual adoption lag around the statewide date
+        lags = {j: r.gauss(90, 120) for j in self.jurisdictions}
+        current = {j: {} for j in self.jurisdictions}
+        versions, updates = [], []
+
+        template = None
+        for cycle in cycles:
+            # Later editions revise a share of the previous edition's sections
+            template = self.template() if template is None else [
+                dict(record, content=self.amend(record['content'], record['category'], record['section']))
+                if r.random() < 0.4 else record
+                for record in template
+            ]
+            for jurisdiction in self.jurisdictions:
+                effective = date(cycle + 1, 1, 1) + timedelta(days=int(lags[jurisdiction] + r.gauss(0, 30)))
+                version_id = len(versions) + 1
+                versions.append({'id': version_id, 'jurisdiction': jurisdiction,
+                                 'version_number': f"{cycle} edition", 'effective_date': effective})
+                incoming = {}
+                for record in template:
+                    content = record['content']
+                    if r.random() < self.amendment_rate:
+                        content = self.amend(content, record['category'], record['section'])
+                    incoming[(record['category'], record['section'])] = content
+                for key, content in incoming.items():
+                    previous = current[jurisdiction].get(key)
+                    if previous != content:
+                        updates.append({
+                            'id': len(updates) + 1, 'code_version_id': version_id,
+                            'jurisdiction': jurisdiction, 'category': key[0], 'section': key[1],
+                            'previous_content': previous, 'new_content': content,
+                            'change_type': 'ADD' if previous is None else 'MODIFY',
+                            'update_date': effective
+                        })
+                current[jurisdiction] = incoming
+
+        codes = []
+        for jurisdiction, sections in current.items():
+            for (category, section), content in sections.items():
+                codes.append({'id': len(codes) + 1, 'jurisdiction': jurisdiction, 'category': category,
+                              'section': section, 'content': content, 'content_hash': content_hash(content)})
+        return {'codes': codes, 'versions': versions, 'updates': updates}
+
+def generate_corpus(seed: int = 0, jurisdictions: int = JURISDICTION_COUNT,
+                    sections_per_category: int = 10, **options) -> Dict[str, List[Dict]]:
+    return CorpusGenerator(seed, jurisdictions, sections_per_category, **options).generate()
+
+def neighbour_pairs(jurisdictions: List[str]) -> List[tuple]:
+    """Adjacency of jurisdictions laid out on a triangulated grid, about 3 neighbours per jurisdiction
+    like municipal boundaries (a planar map has at most 3n - 6 borders)"""
+    width = max(1, math.ceil(math.sqrt(len(jurisdictions))))
+    pairs = []
+    for i, jurisdiction in enumerate(jurisdictions):
+        row, column = divmod(i, width)
+        for neighbour in (i + 1 if column + 1 < width else None, i + width,
+                          i + width + 1 if column + 1 < width else None):
+            if neighbour is not None and neighbour < len(jurisdictions):
+                pairs.append((jurisdiction, jurisdictions[neighbour]))
+    return pairs
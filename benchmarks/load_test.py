@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+from benchmarks.corpus import CATEGORIES, generate_corpus, jurisdiction_names
+from benchmarks.startup import MAIN_SCRIPT
+
+# Tabs whose render functions a simulated session drives: render_search and render_code_comparison,
+# render_visualizations and render_update_tracker
+DEFAULT_TABS = ["Code Search & Compare", "Visualizations", "Updates"]
+# Seconds between samples of the open Postgres connections
+SAMPLE_INTERVAL = 0.05
+SEARCH_TERMS = sorted({term for _, terms in CATEGORIES.values() for term in terms})
+
+def load_corpus(code_tracker, jurisdictions: int, sections: int, seed: int = 0) -> Dict:
+    """Replay a synthetic corpus into Postgres version by version, so updates and history are real"""
+    corpus = generate_corpus(seed, jurisdictions, sections)
+    updates: Dict[int, List[Dict]] = {}
+    for update in corpus['updates']:
+        updates.setdefault(update['code_version_id'], []).append(update)
+    current: Dict[str, Dict[tuple, str]] = {}
+    for version in corpus['versions']:
+        sections_now = current.setdefault(version['jurisdiction'], {})
+        for update in updates.get(version['id'], []):
+            key = (update['category'], update['section'])
+            if update['new_content'] is None:
+                sections_now.pop(key, None)
+            else:
+                sections_now[key] = update['new_content']
+        code_tracker.ingest_code_version(
+            version['jurisdiction'], version['version_number'], version['effective_date'].isoformat(),
+            [{'jurisdiction': version['jurisdiction'], 'category': category, 'section': section, 'content': content}
+             for (category, section), content in sections_now.items()]
+        )
+    return {'jurisdictions': jurisdictions, 'versions': len(corpus['versions']), 'codes': len(corpus['codes'])}
+
+class ConnectionMonitor:
+    """Samples the connections open to the database, and counts those opened, from a thread of its own"""
+
+    def __init__(self, db, interval: float = SAMPLE_INTERVAL):
+        self.db = db
+        self.interval = interval
+        self.samples: List[int] = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._opened_before = None
+        self.opened = None
+
+    def _sessions(self, cur) -> Optional[int]:
+        # pg_stat_database.sessions needs Postgres 14 or later
+        cur.execute("SELECT to_jsonb(d) ->> 'sessions' FROM pg_stat_database d WHERE datname = current_database()")
+        value = cur.fetchone()[0]
+        return int(value) if value is not None else None
+
+    def _run(self):
+        with self.db.get_connection() as conn:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                self._opened_before = self._sessions(cur)
+                self._ready.set()
+                while not self._stop.wait(self.interval):
+                    cur.execute("""
+                        SELECT count(*) FROM pg_stat_activity
+                        WHERE datname = current_database() AND pid != pg_backend_pid()
+                    """)
+                    self.samples.append(cur.fetchone()[0])
+                after = self._sessions(cur)
+                if after is not None and self._opened_before is not None:
+                    self.opened = after - self._opened_before
+
+    def __enter__(self) -> 'ConnectionMonitor':
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="connection-monitor", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+    def summary(self) -> Dict:
+        return {
+            'opened': self.opened,
+            'peak_open': max(self.samples, default=0),
+            'mean_open': statistics.fmean(self.samples) if self.samples else 0.0
+        }
+
+def percentiles(latencies: List[float]) -> Dict:
+    """p50/p95/p99 and max of latencies in seconds, reported in milliseconds"""
+    if not latencies:
+        return {'count': 0, 'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'max_ms': None}
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {'count': len(latencies), 'p50_ms': cuts[49] * 1000, 'p95_ms': cuts[94] * 1000,
+            'p99_ms': cuts[98] * 1000, 'max_ms': max(latencies) * 1000}
+
+def run_session(index: int, jurisdictions: List[str], tabs: List[str], iterations: int, per_session: int,
+                think: float, seed: int, start: threading.Barrier, results: List[Dict]):
+    """One simulated user: pick jurisdictions and a search term, then cycle through the tabs"""
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(seed + index)
+    at = AppTest.from_file(MAIN_SCRIPT, default_timeout=600)
+    at.session_state['selected_jurisdictions'] = rng.sample(jurisdictions, min(per_session, len(jurisdictions)))
+    search_term = rng.choice(SEARCH_TERMS)
+    start.wait()
+    for iteration in range(iterations):
+        for tab in tabs:
+            at.session_state['active_tab'] = tab
+            if tab == DEFAULT_TABS[0] and at.text_input and not at.text_input[0].value:
+                at.text_input[0].set_value(search_term)
+            run_start = time.perf_counter()
+            try:
+                at.run()
+                errors = [exception.value for exception in at.exception]
+            except Exception as e:
+                errors = [repr(e)]
+            results.append({'session': index, 'iteration': iteration, 'tab': tab,
+                            'seconds': time.perf_counter() - run_start, 'errors': errors})
+            if think:
+                time.sleep(rng.uniform(0, 2 * think))
+
+def run(sessions: int, iterations: int, tabs: List[str], per_session: int = 3, think: float = 0.0,
+        seed: int = 0, jurisdictions: Optional[List[str]] = None) -> Dict:
+    """Drive ``sessions`` concurrent AppTest sessions of main.py against the configured Postgres.
+
+    Sessions run as threads of one process, as a Streamlit server runs them, so they share its
+    st.cache_resource services and per-process caches. Each session's first run warms its own
+    state; every run, warm or cold, is timed.
+    """
+    from database import Database
+    from benchmarks.run import _git_revision
+
+    db = Database()
+    available = set(db.get_jurisdictions())
+    jurisdictions = [name for name in (jurisdictions or jurisdiction_names()) if name in available]
+    if not jurisdictions:
+        raise SystemExit("No synthetic jurisdictions in this database; run with --load-corpus first")
+
+    results: List[Dict] = []
+    start = threading.Barrier(sessions + 1)
+    threads = [threading.Thread(target=run_session, name=f"session-{i}",
+                                args=(i, jurisdictions, tabs, iterations, per_session, think, seed, start, results))
+               for i in range(sessions)]
+    for thread in threads:
+        thread.start()
+    with ConnectionMonitor(db) as monitor:
+        start.wait()
+        wall_start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        wall_s = time.perf_counter() - wall_start
+
+    by_tab = {tab: percentiles([r['seconds'] for r in results if r['tab'] == tab]) for tab in tabs}
+    connections = monitor.summary()
+    connections['per_run'] = connections['opened'] / len(results) if connections['opened'] and results else None
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'revision': _git_revision(),
+            'sessions': sessions,
+            'iterations': iterations,
+            'tabs': tabs,
+            'jurisdictions_per_session': per_session,
+            'think_s': think
+        },
+        'wall_s': wall_s,
+        'runs': len(results),
+        'throughput_rps': len(results) / wall_s if wall_s else 0.0,
+        'errors': sum(1 for r in results if r['errors']),
+        'latency': percentiles([r['seconds'] for r in results]),
+        'tabs': by_tab,
+        'connections': connections,
+        'sample_errors': sorted({error.strip().splitlines()[-1] for r in results for error in r['errors']})[:10]
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load-test the Streamlit app with concurrent headless sessions")
+    parser.add_argument('--sessions', type=int, default=8, help="Concurrent simulated sessions")
+    parser.add_argument('--iterations', type=int, default=3, help="Passes over the tabs per session")
+    parser.add_argument('--tabs', default=','.join(DEFAULT_TABS), help="Comma-separated tab labels to cycle through")
+    parser.add_argument('--per-session', type=int, default=3, help="Jurisdictions each session selects")
+    parser.add_argument('--think', type=float, default=0.0, help="Mean seconds a user pauses between reruns")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--load-corpus', action='store_true',
+                        help="First replay a synthetic corpus into the configured Postgres")
+    parser.add_argument('--jurisdictions', type=int, default=20, help="Synthetic jurisdictions to load and use")
+    parser.add_argument('--sections', type=int, default=10, help="Sections per category for --load-corpus")
+    parser.add_argument('--output', help="JSON results path (default: .cache/benchmarks/load-<timestamp>.json)")
+    args = parser.parse_args()
+
+    if args.load_corpus:
+        from database import Database
+        from utils.code_tracker import CodeTracker
+        start = time.perf_counter()
+        loaded = load_corpus(CodeTracker(Database()), args.jurisdictions, args.sections, args.seed)
+        print(f"Loaded {loaded['codes']} sections in {loaded['versions']} versions "
+              f"in {time.perf_counter() - start:.1f}s")
+
+    from benchmarks.run import DEFAULT_OUTPUT_DIR
+    report = run(args.sessions, args.iterations, args.tabs.split(','), args.per_session, args.think,
+                 args.seed, jurisdiction_names(args.jurisdictions))
+    output = args.output or os.path.join(
+        DEFAULT_OUTPUT_DIR, f"load-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    def row(name: str, stats: Dict) -> str:
+        if not stats['count']:
+            return f"{name:>28}  no runs"
+        return (f"{name:>28}  {stats['count']:5d} runs  p50 {stats['p50_ms']:8.1f} ms  p95 {stats['p95_ms']:8.1f} ms  "
+                f"p99 {stats['p99_ms']:8.1f} ms")
+
+    print(f"{report['runs']} runs by {args.sessions} sessions in {report['wall_s']:.1f}s: "
+          f"{report['throughput_rps']:.2f} runs/s, {report['errors']} with errors")
+    for tab, stats in report['tabs'].items():
+        print(row(tab, stats))
+    print(row('all', report['latency']))
+    connections = report['connections']
+    per_run = f"{connections['per_run']:.1f}" if connections['per_run'] is not None else 'n/a'
+    print(f"Postgres connections: {connections['opened']} opened ({per_run} per run), "
+          f"peak {connections['peak_open']} open, mean {connections['mean_open']:.1f}")
+    for error in report['sample_errors']:
+        print(f"  error: {error}")
+    print(f"Results written to {output}")
@@ -0,0 +1,204 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from benchmarks.corpus import JURISDICTION_COUNT, generate_corpus, jurisdiction_names, neighbour_pairs
+from components.policy_recommendations import calculate_impact_score, generate_recommendations
+from utils import nlp_processor
+from utils.adjacency import AdjacencyGraph, edge_divergence
+from utils.category_classifier import CategoryClassifier
+from utils.data_processing import process_code_differences
+from utils.reference_graph import ReferenceGraph
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_OUTPUT_DIR = os.path.join(REPO_ROOT, '.cache', 'benchmarks')
+
+# Sections per category (five categories) and sampled items per benchmark for each size tier
+TIERS = {
+    'small': {'sections_per_category': 2, 'samples': 50},
+    'medium': {'sections_per_category': 10, 'samples': 200},
+    'large': {'sections_per_category': 40, 'samples': 500}
+}
+
+def _clear_caches():
+    nlp_processor._entity_cache.clear()
+    nlp_processor._analysis_cache.clear()
+
+def time_benchmark(name: str, tier: str, fn: Callable, items: List, repeats: int,
+                   setup: Optional[Callable] = None) -> Dict:
+    """Run ``fn`` over every item ``repeats`` times and summarize the wall-clock timings"""
+    timings = []
+    for _ in range(repeats):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        for item in items:
+            fn(item)
+        timings.append(time.perf_counter() - start)
+    median = statistics.median(timings)
+    return {
+        'benchmark': name,
+        'tier': tier,
+        'items': len(items),
+        'repeats': repeats,
+        'seconds': timings,
+        'median_s': median,
+        'min_s': min(timings),
+        'per_item_ms': median / max(len(items), 1) * 1000,
+        'items_per_s': len(items) / median if median else None
+    }
+
+def section_pairs(codes: List[Dict], count: int, rng: random.Random) -> List[tuple]:
+    """Sample (text1, text2) pairs of the same section in two different jurisdictions"""
+    by_section = {}
+    for code in codes:
+        by_section.setdefault((code['category'], code['section']), []).append(code['content'])
+    keys = sorted(by_section)
+    pairs = []
+    for _ in range(count):
+        texts = by_section[rng.choice(keys)]
+        pairs.append(tuple(rng.sample(texts, 2)))
+    return pairs
+
+def run_tier(tier: str, seed: int, jurisdictions: int, repeats: int,
+             sections_per_category: Optional[int] = None, samples: Optional[int] = None) -> List[Dict]:
+    config = dict(TIERS[tier])
+    if sections_per_category:
+        config['sections_per_category'] = sections_per_category
+    if samples:
+        config['samples'] = samples
+
+    start = time.perf_counter()
+    corpus = generate_corpus(seed, jurisdictions, config['sections_per_category'])
+    generation_s = time.perf_counter() - start
+    codes = corpus['codes']
+    rng = random.Random(seed)
+    pairs = section_pairs(codes, config['samples'], rng)
+    texts = [code['content'] for code in rng.sample(codes, min(config['samples'], len(codes)))]
+    nlp = nlp_processor.get_nlp()
+
+    references = {code['content_hash']: nlp.extract_citations(code['content']) for code in codes}
+    graph = ReferenceGraph(codes, references)
+    standards = sorted(graph.citers_of_standard)[:config['samples']]
+    neighbours = AdjacencyGraph(neighbour_pairs(jurisdiction_names(jurisdictions)))
+    contents = {code['content_hash']: code['content'] for code in codes}
+    by_category = {}
+    for code in codes:
+        by_category.setdefault(code['category'], []).append(code)
+    classifier = CategoryClassifier.train(codes, contents)
+
+    _clear_caches()
+    analyses = [nlp_processor.analyze_code_differences(text1, text2) for text1, text2 in pairs]
+    names = [(f"Jurisdiction {i % jurisdictions + 1:03d}", f"Jurisdiction {(i + 1) % jurisdictions + 1:03d}")
+             for i in range(len(analyses))]
+
+    results = [
+        time_benchmark('calculate_similarity', tier, lambda pair: nlp.calculate_similarity(*pair), pairs, repeats),
+        time_benchmark('extract_entities', tier, nlp.extract_entities, texts, repeats),
+        time_benchmark('analyze_code_differences', tier,
+                       lambda pair: nlp_processor.analyze_code_differences(*pair), pairs, repeats,
+                       setup=_clear_caches),
+        time_benchmark('analyze_code_differences_warm', tier,
+                       lambda pair: nlp_processor.analyze_code_differences(*pair), pairs, repeats),
+        time_benchmark('process_code_differences', tier, process_code_differences, [codes], repeats),
+        time_benchmark('calculate_impact_score', tier, calculate_impact_score, analyses, repeats),
+        time_benchmark('generate_recommendations', tier,
+                       lambda item: generate_recommendations(item[0], *item[1]),
+                       list(zip(analyses, names)), repeats),
+        time_benchmark('reference_graph_build', tier, lambda item: ReferenceGraph(*item),
+                       [(codes, references)], repeats),
+        time_benchmark('dependents_of_standard', tier, graph.dependents_of_standard, standards, repeats),
+        time_benchmark('neighbour_divergence', tier,
+                       lambda category_codes: edge_divergence(neighbours, category_codes, contents),
+                       list(by_category.values()), repeats),
+        time_benchmark('classify_sections', tier, classifier.predict, [texts], repeats)
+    ]
+    corpus_stats = {
+        'jurisdictions': jurisdictions,
+        'codes': len(codes),
+        'distinct_texts': len({code['content_hash'] for code in codes}),
+        'versions': len(corpus['versions']),
+        'updates': len(corpus['updates']),
+        'generation_s': generation_s
+    }
+    for result in results:
+        result['corpus'] = corpus_stats
+    return results
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(tiers: List[str], seed: int = 0, jurisdictions: int = JURISDICTION_COUNT, repeats: int = 3,
+        sections_per_category: Optional[int] = None, samples: Optional[int] = None) -> Dict:
+    results = []
+    for tier in tiers:
+        results.extend(run_tier(tier, seed, jurisdictions, repeats, sections_per_category, samples))
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'revision': _git_revision(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'seed': seed,
+            'repeats': repeats
+        },
+        'results': results
+    }
+
+def compare(baseline: Dict, current: Dict) -> List[Dict]:
+    """Median-time ratio (current / baseline) for every benchmark present in both runs"""
+    before = {(r['benchmark'], r['tier']): r for r in baseline['results']}
+    rows = []
+    for result in current['results']:
+        key = (result['benchmark'], result['tier'])
+        if key in before and before[key]['median_s']:
+            rows.append({
+                'benchmark': key[0],
+                'tier': key[1],
+                'baseline_ms': before[key]['per_item_ms'],
+                'current_ms': result['per_item_ms'],
+                'ratio': result['median_s'] / before[key]['median_s']
+            })
+    return rows
+
+def _print_table(rows: List[Dict], columns: List[str]):
+    print('  '.join(f"{column:>28}" for column in columns))
+    for row in rows:
+        print('  '.join(f"{row[c]:>28.4f}" if isinstance(row[c], float) else f"{row[c]:>28}" for c in columns))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the analysis hot paths on a synthetic corpus")
+    parser.add_argument('--tiers', default='small,medium', help=f"Comma-separated tiers from {', '.join(TIERS)}")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--jurisdictions', type=int, default=JURISDICTION_COUNT)
+    parser.add_argument('--sections', type=int, help="Sections per category, overriding the tier")
+    parser.add_argument('--samples', type=int, help="Pairs or texts per benchmark, overriding the tier")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', help="JSON results path (default: .cache/benchmarks/<timestamp>.json)")
+    parser.add_argument('--compare', metavar='BASELINE', help="Print ratios against a previous results file")
+    args = parser.parse_args()
+
+    report = run(args.tiers.split(','), args.seed, args.jurisdictions, args.repeats, args.sections, args.samples)
+    output = args.output or os.path.join(
+        DEFAULT_OUTPUT_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    _print_table(report['results'], ['benchmark', 'tier', 'items', 'per_item_ms'])
+    if args.compare:
+        with open(args.compare) as f:
+            _print_table(compare(json.load(f), report), ['benchmark', 'tier', 'baseline_ms', 'current_ms', 'ratio'])
+    print(f"Results written to {output}")
@@ -0,0 +1,144 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN_SCRIPT = os.path.join(REPO_ROOT, 'main.py')
+# Labels of the view selector (session_state["active_tab"]) in main.py, in display order
+TABS = ["Code Search & Compare", "Visualizations", "Analysis", "Updates", "Policy Recommendations"]
+# Dependencies worth keeping off the cold path; reported when a tab first pulls them in
+HEAVY_MODULES = ['pandas', 'plotly.express', 'plotly.graph_objects', 'sklearn', 'uagents']
+
+def profile_session(tabs: List[str], reruns: int) -> Dict:
+    """Open each tab once in a fresh AppTest session, then rerun it; runs in a clean interpreter"""
+    start = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    from utils import instrumentation
+    framework_s = time.perf_counter() - start
+
+    at = AppTest.from_file(MAIN_SCRIPT, default_timeout=300)
+    # The debug panel's page trace records an import.<module> span for every lazy import
+    at.session_state['debug_panel'] = True
+    results = []
+    cold_start_s = None
+    for tab in tabs:
+        at.session_state['active_tab'] = tab
+        before = set(sys.modules)
+        run_start = time.perf_counter()
+        at.run()
+        first_s = time.perf_counter() - run_start
+        if cold_start_s is None:
+            cold_start_s = time.perf_counter() - start
+        loaded = [module for module in HEAVY_MODULES if module in sys.modules and module not in before]
+        timings = []
+        for _ in range(reruns):
+            run_start = time.perf_counter()
+            at.run()
+            timings.append(time.perf_counter() - run_start)
+        results.append({
+            'tab': tab,
+            'first_run_s': first_s,
+            'rerun_median_s': statistics.median(timings) if timings else None,
+            'modules_loaded': loaded,
+            'exceptions': [exception.value for exception in at.exception]
+        })
+
+    stages = instrumentation.METRICS.snapshot()
+    imports = {
+        name[len('import.'):]: {'calls': stage['calls'], 'seconds': stage['seconds'],
+                                'per_call_ms': stage['seconds'] / stage['calls'] * 1000}
+        for name, stage in stages.items() if name.startswith('import.')
+    }
+    return {
+        'framework_import_s': framework_s,
+        'cold_start_s': cold_start_s,
+        'tabs': results,
+        'imports': imports,
+        'modules': len(sys.modules)
+    }
+
+def run(tabs: List[str], sessions: int = 3, reruns: int = 5) -> Dict:
+    """Profile ``sessions`` cold starts, each in its own interpreter so nothing is preloaded"""
+    # benchmarks.run loads scikit-learn, so only the parent process imports it
+    from benchmarks.run import _git_revision
+    profiles = []
+    for _ in range(sessions):
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+            path = f.name
+        try:
+            # The job queue may spawn a worker that inherits our streams, so don't capture them
+            subprocess.run(
+                [sys.executable, '-m', 'benchmarks.startup', '--child', path,
+                 '--tabs', ','.join(tabs), '--reruns', str(reruns)],
+                cwd=REPO_ROOT, check=True, stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            with open(path) as f:
+                profiles.append(json.load(f))
+        finally:
+            os.unlink(path)
+
+    summary = []
+    for index, tab in enumerate(tabs):
+        per_session = [profile['tabs'][index] for profile in profiles]
+        summary.append({
+            'tab': tab,
+            'first_run_ms': statistics.median(r['first_run_s'] for r in per_session) * 1000,
+            'rerun_ms': statistics.median(r['rerun_median_s'] or 0.0 for r in per_session) * 1000,
+            'modules_loaded': ','.join(per_session[0]['modules_loaded']) or '-'
+        })
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'revision': _git_revision(),
+            'python': sys.version.split()[0],
+            'sessions': sessions,
+            'reruns': reruns
+        },
+        'cold_start_ms': statistics.median(profile['cold_start_s'] for profile in profiles) * 1000,
+        'framework_import_ms': statistics.median(profile['framework_import_s'] for profile in profiles) * 1000,
+        'tabs': summary,
+        'sessions': profiles
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Profile cold start and per-rerun time of the Streamlit app")
+    parser.add_argument('--tabs', default=','.join(TABS), help="Comma-separated tab labels, opened in order")
+    parser.add_argument('--sessions', type=int, default=3, help="Cold starts to profile, one process each")
+    parser.add_argument('--reruns', type=int, default=5, help="Warm reruns timed after opening each tab")
+    parser.add_argument('--output', help="JSON results path (default: .cache/benchmarks/startup-<timestamp>.json)")
+    parser.add_argument('--child', metavar='PATH', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    tabs = args.tabs.split(',')
+
+    if args.child:
+        with open(args.child, 'w') as f:
+            json.dump(profile_session(tabs, args.reruns), f)
+        sys.exit(0)
+
+    from benchmarks.run import DEFAULT_OUTPUT_DIR
+    report = run(tabs, args.sessions, args.reruns)
+    output = args.output or os.path.join(
+        DEFAULT_OUTPUT_DIR, f"startup-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"Cold start (first page, fresh process): {report['cold_start_ms']:.0f} ms "
+          f"(Streamlit import {report['framework_import_ms']:.0f} ms)")
+    for row in report['tabs']:
+        print(f"{row['tab']:>28}  first {row['first_run_ms']:8.1f} ms  rerun {row['rerun_ms']:8.1f} ms  "
+              f"loads {row['modules_loaded']}")
+    imports = report['sessions'][0]['imports']
+    for module in sorted(imports, key=lambda name: -imports[name]['seconds']):
+        print(f"{'import ' + module:>40}  {imports[module]['calls']:4.0f} calls  "
+              f"{imports[module]['per_call_ms']:8.3f} ms/call")
+    print(f"Results written to {output}")
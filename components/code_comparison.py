@@ -1,109 +1,90 @@
+from datetime import date, timedelta
 from typing import Dict, List, Tuple
 import streamlit as st
-from uagents import Agent, Context, Model
-from uagents.query import query
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
+from utils.job_queue import get_job_queue, summarize_jobs
+from components.policy_recommendations import pair_results, render_job_progress, rerun_while_pending
+from utils.instrumentation import span
 
-class CodeComparisonModel(Model):
-    content1: str
-    content2: str
-    
-class ComparisonResult(Model):
-    similarity_score: float
-    differences: List[str]
-    technical_terms1: List[str]
-    technical_terms2: List[str]
-    common_terms: List[str]
-    
-class BuildingCodeAgent:
-    def __init__(self):
-        # Initialize fetch.ai agent with a specific name and secure key
-        self.agent = Agent(
-            name="building_code_analyzer",
-            seed="your-secure-seed-here"  # Replace with a secure seed
-        )
-        
-        @self.agent.on_query(model=CodeComparisonModel)
-        async def analyze_codes(ctx: Context, sender: str, msg: CodeComparisonModel) -> ComparisonResult:
-            # Implement the NLP analysis using fetch.ai's capabilities
-            from fetchai.uagents.nlp import similarity, extract_entities, text_differences
-            
-            # Calculate similarity score
-            similarity_score = await similarity(msg.content1, msg.content2)
-            
-            # Extract technical terms
-            terms1 = await extract_entities(msg.content1, entity_type="TECHNICAL")
-            terms2 = await extract_entities(msg.content2, entity_type="TECHNICAL")
-            
-            # Find common terms
-            common_terms = list(set(terms1).intersection(set(terms2)))
-            
-            # Analyze differences
-            differences = await text_differences(msg.content1, msg.content2)
-            
-            return ComparisonResult(
-                similarity_score=similarity_score,
-                differences=differences,
-                technical_terms1=terms1,
-                technical_terms2=terms2,
-                common_terms=common_terms
-            )
+def load_codes_across_dates(code_tracker, jurisdictions: List[str]) -> Tuple[List[str], List[Dict]]:
+    """Load one jurisdiction's codes as of two dates, labelled so they compare like jurisdictions"""
+    jurisdiction = st.selectbox("Jurisdiction", jurisdictions, key="comparison_date_jurisdiction")
+    col1, col2 = st.columns(2)
+    with col1:
+        before = st.date_input("Earlier date", value=date.today() - timedelta(days=365),
+                               key="comparison_date_before")
+    with col2:
+        after = st.date_input("Later date", value=date.today(), key="comparison_date_after")
 
-async def analyze_code_differences(code1: str, code2: str) -> Dict:
-    """
-    Analyze differences between two building codes using fetch.ai
-    """
-    agent = BuildingCodeAgent()
-    
-    # Create the comparison query
-    query = query(
-        model=CodeComparisonModel(
-            content1=code1,
-            content2=code2
-        )
-    )
-    
-    # Get the analysis result
-    result = await agent.agent.query(query)
-    
-    return {
-        'similarity_score': result.similarity_score,
-        'differences': result.differences,
-        'entities_code1': {
-            'technical_terms': [{'terms': result.technical_terms1}]
-        },
-        'entities_code2': {
-            'technical_terms': [{'terms': result.technical_terms2}]
-        },
-        'common_terms': result.common_terms
-    }
+    labels, codes = [], []
+    for as_of in (before, after):
+        label = f"{jurisdiction} @ {as_of.isoformat()}"
+        labels.append(label)
+        for code in code_tracker.get_codes_as_of(jurisdiction, as_of):
+            codes.append(dict(code, jurisdiction=label))
+    return labels, codes
 
-        
-        
-def render_code_comparison(db, selected_jurisdictions):
+def find_renumbered_section(db, df: pd.DataFrame, reference, jurisdiction: str) -> pd.DataFrame:
+    """The section of ``jurisdiction`` whose content matches ``reference``, under whatever number it has"""
     try:
-        if len(selected_jurisdictions) < 2:
-            st.warning("Please select at least two jurisdictions to compare")
-            return
+        # Imported here so scikit-learn only loads when a section number doesn't line up
+        from utils.semantic_index import get_semantic_index
+        with span('semantic.find_counterpart'):
+            match = get_semantic_index(db).counterpart(reference['content_hash'], jurisdiction, reference['category'])
+    except Exception as e:
+        st.warning(f"Could not match sections by content: {e}")
+        match = None
+    if match is None:
+        return df.iloc[0:0]
+    code, score = match
+    return df[df['id'] == code['id']].assign(alignment_score=score)
+
+def render_code_comparison(db, selected_jurisdictions, code_tracker=None):
+    summary = None
+    try:
+        mode = "Jurisdictions"
+        if code_tracker is not None:
+            mode = st.radio("Compare across", ["Jurisdictions", "Dates"], horizontal=True,
+                            key="comparison_mode")
 
-        # Get all codes for selected jurisdictions with proper error handling
         codes = []
-        try:
-            for jurisdiction in selected_jurisdictions:
-                jurisdiction_codes = db.get_building_codes(jurisdiction)
-                if jurisdiction_codes:
-                    codes.extend(jurisdiction_codes)
-        except Exception as e:
-            st.error(f"Error fetching building codes: {e}")
-            return
+        if mode == "Dates":
+            jurisdictions = selected_jurisdictions or db.get_jurisdictions()
+            if not jurisdictions:
+                st.warning("No jurisdictions available")
+                return
+            try:
+                selected_jurisdictions, codes = load_codes_across_dates(code_tracker, jurisdictions)
+            except Exception as e:
+                st.error(f"Error fetching building codes: {e}")
+                return
+            if selected_jurisdictions[0] == selected_jurisdictions[1]:
+                st.warning("Please select two different dates to compare")
+                return
+        else:
+            if len(selected_jurisdictions) < 2:
+                st.warning("Please select at least two jurisdictions to compare")
+                return
+
+            # Get all codes for selected jurisdictions with proper error handling
+            try:
+                for jurisdiction in selected_jurisdictions:
+                    jurisdiction_codes = db.get_building_codes(jurisdiction, with_content=True)
+                    if jurisdiction_codes:
+                        codes.extend(jurisdiction_codes)
+            except Exception as e:
+                st.error(f"Error fetching building codes: {e}")
+                return
 
         if not codes:
             st.warning("No building codes found for the selected jurisdictions")
             return
 
         # Create DataFrame
-        df = pd.DataFrame(codes)
+        with span('dataframe.build', rows=len(codes)):
+            df = pd.DataFrame(codes)
         
         # Add timeline analysis first
         with st.expander("📅 Code Timeline Analysis", expanded=True):
@@ -152,7 +133,8 @@ def render_code_comparison(db, selected_jurisdictions):
                     height=200,
                     margin=dict(t=30, b=0)
                 )
-                st.plotly_chart(fig)
+                with span('plotly.render', chart='code_timeline'):
+                    st.plotly_chart(fig)
 
                 # Display adoption statistics
                 st.markdown("### Adoption Statistics")
@@ -250,9 +232,14 @@ def render_code_comparison(db, selected_jurisdictions):
             comparison_codes = {}
             for jurisdiction in selected_jurisdictions:
                 jurisdiction_code = section_codes[section_codes['jurisdiction'] == jurisdiction]
+                if jurisdiction_code.empty and mode == "Jurisdictions" and not section_codes.empty:
+                    jurisdiction_code = find_renumbered_section(db, df, section_codes.iloc[0], jurisdiction)
                 if not jurisdiction_code.empty:
                     with st.expander(f"{jurisdiction} - Section {jurisdiction_code.iloc[0]['section']}", expanded=True):
                         code = jurisdiction_code.iloc[0]
+                        if code['section'] != selected_section:
+                            st.caption(f"Matched by content: Section {code['section']} "
+                                       f"(similarity {code['alignment_score']:.2f})")
                         st.markdown(f'<div class="citation-box">{code["content"]}</div>', unsafe_allow_html=True)
                         comparison_codes[jurisdiction] = {
                             'section': code['section'],
@@ -265,145 +252,168 @@ def render_code_comparison(db, selected_jurisdictions):
             if len(comparison_codes) >= 2:
                 jurisdictions = list(comparison_codes.keys())
                 
+                # Queue all pairs; identical requests reuse the persisted result
+                queue = get_job_queue()
+                pair_jobs = []
                 for i in range(len(jurisdictions)):
                     for j in range(i + 1, len(jurisdictions)):
                         jurisdiction1, jurisdiction2 = jurisdictions[i], jurisdictions[j]
+                        job_id = queue.submit('pair_analysis', {
+                            'code1': comparison_codes[jurisdiction1]['content'],
+                            'code2': comparison_codes[jurisdiction2]['content']
+                        })
+                        pair_jobs.append((jurisdiction1, jurisdiction2, job_id))
+                
+                jobs = queue.get_jobs([job_id for _, _, job_id in pair_jobs])
+                summary = summarize_jobs(jobs, [job_id for _, _, job_id in pair_jobs])
+                render_job_progress(summary, key="comparison_retry")
+                
+                for jurisdiction1, jurisdiction2, job_id in pair_jobs:
+                    job = jobs.get(job_id, {})
+                    
+                    try:
+                        st.markdown(f'<div class="comparison-header">{jurisdiction1} vs {jurisdiction2}</div>', 
+                                  unsafe_allow_html=True)
                         
-                        try:
-                            code1 = comparison_codes[jurisdiction1]['content']
-                            code2 = comparison_codes[jurisdiction2]['content']
-        
-                            # Use the new fetch.ai-based analysis
-                            import asyncio
-                            analysis = asyncio.run(analyze_code_differences(code1, code2))
-                            
-                            # Analyze differences
-                            analysis = analyze_code_differences(code1, code2)
-                            citation_analysis = analyze_citations(analysis, jurisdiction1, jurisdiction2)
-                            recommendations = generate_recommendations(analysis, jurisdiction1, jurisdiction2)
-
-                            st.markdown(f'<div class="comparison-header">{jurisdiction1} vs {jurisdiction2}</div>', 
-                                      unsafe_allow_html=True)
+                        if job.get('status') == 'failed':
+                            st.error(f"Error analyzing codes: {job['error'].strip().splitlines()[-1]}")
+                            continue
+                        if job.get('status') != 'done':
+                            st.info("Analysis queued...")
+                            continue
+                        
+                        result = pair_results(job['result'], jurisdiction1, jurisdiction2)
+                        analysis = result['analysis']
+                        citation_analysis = result['citation_analysis']
+                        recommendations = result['recommendations']
 
-                            # Technical Terms Analysis
-                            with st.expander("🔍 Technical Terms Analysis", expanded=True):
-                                terms1 = set()
-                                terms2 = set()
-                                for term_group in analysis['entities_code1']['technical_terms']:
-                                    terms1.update(term_group['terms'])
-                                for term_group in analysis['entities_code2']['technical_terms']:
-                                    terms2.update(term_group['terms'])
-                                
-                                common_terms = terms1.intersection(terms2)
-                                unique_terms1 = terms1 - terms2
-                                unique_terms2 = terms2 - terms1
-                                
-                                if common_terms:
-                                    st.markdown("**Common Technical Terms:**")
+                        # Technical Terms Analysis
+                        with st.expander("🔍 Technical Terms Analysis", expanded=True):
+                            terms1 = set()
+                            terms2 = set()
+                            for term_group in analysis['entities_code1']['technical_terms']:
+                                terms1.update(term_group['terms'])
+                            for term_group in analysis['entities_code2']['technical_terms']:
+                                terms2.update(term_group['terms'])
+                            
+                            common_terms = terms1.intersection(terms2)
+                            unique_terms1 = terms1 - terms2
+                            unique_terms2 = terms2 - terms1
+                            
+                            if common_terms:
+                                st.markdown("**Common Technical Terms:**")
+                                st.markdown(" ".join([
+                                    f'<span class="technical-term">{term}</span>'
+                                    for term in common_terms
+                                ]), unsafe_allow_html=True)
+                            
+                            col1, col2 = st.columns(2)
+                            with col1:
+                                if unique_terms1:
+                                    st.markdown(f"**Unique to {jurisdiction1}:**")
+                                    st.markdown(" ".join([
+                                        f'<span class="technical-term">{term}</span>'
+                                        for term in unique_terms1
+                                    ]), unsafe_allow_html=True)
+                            with col2:
+                                if unique_terms2:
+                                    st.markdown(f"**Unique to {jurisdiction2}:**")
                                     st.markdown(" ".join([
                                         f'<span class="technical-term">{term}</span>'
-                                        for term in common_terms
+                                        for term in unique_terms2
                                     ]), unsafe_allow_html=True)
-                                
-                                col1, col2 = st.columns(2)
-                                with col1:
-                                    if unique_terms1:
-                                        st.markdown(f"**Unique to {jurisdiction1}:**")
-                                        st.markdown(" ".join([
-                                            f'<span class="technical-term">{term}</span>'
-                                            for term in unique_terms1
-                                        ]), unsafe_allow_html=True)
-                                with col2:
-                                    if unique_terms2:
-                                        st.markdown(f"**Unique to {jurisdiction2}:**")
-                                        st.markdown(" ".join([
-                                            f'<span class="technical-term">{term}</span>'
-                                            for term in unique_terms2
-                                        ]), unsafe_allow_html=True)
 
-                            # Citation Analysis
-                            with st.expander("📚 Citation Analysis", expanded=True):
-                                if citation_analysis['common_references']:
-                                    st.markdown("**Common References:**")
-                                    for ref_text, ref_type in citation_analysis['common_references']:
+                        # Sentence-level differences from the comparison service
+                        if analysis.get('differences'):
+                            with st.expander("📝 Text Differences", expanded=False):
+                                st.code("\n".join(analysis['differences']), language="diff")
+
+                        # Citation Analysis
+                        with st.expander("📚 Citation Analysis", expanded=True):
+                            if citation_analysis['common_references']:
+                                st.markdown("**Common References:**")
+                                for ref_text, ref_type in citation_analysis['common_references']:
+                                    st.markdown(f'<div class="citation-box">{ref_text} ({ref_type})</div>', 
+                                              unsafe_allow_html=True)
+                            
+                            col1, col2 = st.columns(2)
+                            with col1:
+                                unique_refs1 = citation_analysis['unique_references'][jurisdiction1]
+                                if unique_refs1:
+                                    st.markdown(f"**Unique to {jurisdiction1}:**")
+                                    for ref_text, ref_type in unique_refs1:
+                                        st.markdown(f'<div class="citation-box">{ref_text} ({ref_type})</div>', 
+                                                  unsafe_allow_html=True)
+                            with col2:
+                                unique_refs2 = citation_analysis['unique_references'][jurisdiction2]
+                                if unique_refs2:
+                                    st.markdown(f"**Unique to {jurisdiction2}:**")
+                                    for ref_text, ref_type in unique_refs2:
                                         st.markdown(f'<div class="citation-box">{ref_text} ({ref_type})</div>', 
                                                   unsafe_allow_html=True)
-                                
-                                col1, col2 = st.columns(2)
-                                with col1:
-                                    unique_refs1 = citation_analysis['unique_references'][jurisdiction1]
-                                    if unique_refs1:
-                                        st.markdown(f"**Unique to {jurisdiction1}:**")
-                                        for ref_text, ref_type in unique_refs1:
-                                            st.markdown(f'<div class="citation-box">{ref_text} ({ref_type})</div>', 
-                                                      unsafe_allow_html=True)
-                                with col2:
-                                    unique_refs2 = citation_analysis['unique_references'][jurisdiction2]
-                                    if unique_refs2:
-                                        st.markdown(f"**Unique to {jurisdiction2}:**")
-                                        for ref_text, ref_type in unique_refs2:
-                                            st.markdown(f'<div class="citation-box">{ref_text} ({ref_type})</div>', 
-                                                      unsafe_allow_html=True)
 
-                            # Unification Recommendations
-                            with st.expander("🔄 Unification Recommendations", expanded=True):
-                                for rec in recommendations:
-                                    st.markdown(f'''
-                                        <div class="recommendation-box">
-                                            <h4>{rec['category']}</h4>
-                                            <p><strong>Impact:</strong> {rec['impact']}</p>
-                                            <p><strong>Benefit:</strong> {rec['benefit']}</p>
-                                            <hr>
-                                            <p>{rec['description']}</p>
-                                            <div class="evidence-section">
-                                                <h5>Supporting Evidence</h5>
-                                                {"<br>".join(rec['citations'])}
-                                                <h5>Detailed Analysis</h5>
-                                                {"<br>".join(rec['details'])}
-                                            </div>
+                        # Unification Recommendations
+                        with st.expander("🔄 Unification Recommendations", expanded=True):
+                            for rec in recommendations:
+                                st.markdown(f'''
+                                    <div class="recommendation-box">
+                                        <h4>{rec['category']}</h4>
+                                        <p><strong>Impact:</strong> {rec['impact']}</p>
+                                        <p><strong>Benefit:</strong> {rec['benefit']}</p>
+                                        <hr>
+                                        <p>{rec['description']}</p>
+                                        <div class="evidence-section">
+                                            <h5>Supporting Evidence</h5>
+                                            {"<br>".join(rec['citations'])}
+                                            <h5>Detailed Analysis</h5>
+                                            {"<br>".join(rec['details'])}
                                         </div>
-                                    ''', unsafe_allow_html=True)
+                                    </div>
+                                ''', unsafe_allow_html=True)
 
-                            # Impact Score and Similarity Gauge
-                            impact_score = calculate_impact_score(analysis)
-                            col1, col2 = st.columns(2)
-                            
-                            with col1:
-                                st.markdown(
-                                    f'<div class="impact-score">Impact Score<br>{impact_score:.1f}/100</div>', 
-                                    unsafe_allow_html=True
-                                )
-                            
-                            with col2:
-                                fig = go.Figure(go.Indicator(
-                                    mode="gauge+number",
-                                    value=analysis['similarity_score'] * 100,
-                                    domain={'x': [0, 1], 'y': [0, 1]},
-                                    title={'text': "Code Similarity"},
-                                    gauge={
-                                        'axis': {'range': [0, 100]},
-                                        'bar': {'color': "#0B5394"},
-                                        'steps': [
-                                            {'range': [0, 33], 'color': "#FFE0E0"},
-                                            {'range': [33, 66], 'color': "#FFF4E0"},
-                                            {'range': [66, 100], 'color': "#E0FFE0"}
-                                        ],
-                                        'threshold': {
-                                            'line': {'color': "#0B5394", 'width': 4},
-                                            'thickness': 0.75,
-                                            'value': analysis['similarity_score'] * 100
-                                        }
+                        # Impact Score and Similarity Gauge
+                        impact_score = result['impact_score']
+                        col1, col2 = st.columns(2)
+                        
+                        with col1:
+                            st.markdown(
+                                f'<div class="impact-score">Impact Score<br>{impact_score:.1f}/100</div>', 
+                                unsafe_allow_html=True
+                            )
+                        
+                        with col2:
+                            fig = go.Figure(go.Indicator(
+                                mode="gauge+number",
+                                value=analysis['similarity_score'] * 100,
+                                domain={'x': [0, 1], 'y': [0, 1]},
+                                title={'text': "Code Similarity"},
+                                gauge={
+                                    'axis': {'range': [0, 100]},
+                                    'bar': {'color': "#0B5394"},
+                                    'steps': [
+                                        {'range': [0, 33], 'color': "#FFE0E0"},
+                                        {'range': [33, 66], 'color': "#FFF4E0"},
+                                        {'range': [66, 100], 'color': "#E0FFE0"}
+                                    ],
+                                    'threshold': {
+                                        'line': {'color': "#0B5394", 'width': 4},
+                                        'thickness': 0.75,
+                                        'value': analysis['similarity_score'] * 100
                                     }
-                                ))
-                                fig.update_layout(height=200, margin=dict(t=30, b=0))
+                                }
+                            ))
+                            fig.update_layout(height=200, margin=dict(t=30, b=0))
+                            with span('plotly.render', chart='similarity_gauge'):
                                 st.plotly_chart(fig)
-                                
-                        except Exception as e:
-                            st.error(f"Error analyzing codes: {e}")
-                            continue
+                            
+                    except Exception as e:
+                        st.error(f"Error analyzing codes: {e}")
+                        continue
 
             st.markdown('</div>', unsafe_allow_html=True)
         st.markdown('</div>', unsafe_allow_html=True)
+        if summary is not None:
+            rerun_while_pending(summary)
             
     except Exception as e:
         st.error(f"An error occurred: {e}")
@@ -0,0 +1,46 @@
+import os
+import pandas as pd
+import streamlit as st
+from utils.adjacency import DEFAULT_NEIGHBOURS_PATH, AdjacencyGraph, get_hotspots, jurisdiction_hotspots
+
+@st.cache_resource
+def _load_graph(path: str, modified: float) -> AdjacencyGraph:
+    return AdjacencyGraph.from_file(path)
+
+def render_hotspots(db, path: str = DEFAULT_NEIGHBOURS_PATH):
+    """Rank divergence between neighbouring jurisdictions for one category at a time"""
+    st.subheader("Neighbouring Jurisdiction Hotspots")
+    if not os.path.exists(path):
+        st.info(f"Add a neighbour file at {path} (or set JURISDICTION_NEIGHBOURS) to compare adjacent jurisdictions")
+        return
+    try:
+        graph = _load_graph(path, os.path.getmtime(path))
+    except Exception as e:
+        st.error(f"Error loading neighbour file: {e}")
+        return
+
+    category = st.selectbox("Category", db.get_categories(), key="hotspot_category")
+    edges = get_hotspots(db, graph, category)
+    if not edges:
+        st.info("No neighbouring jurisdictions both have codes in this category")
+        return
+    st.caption(f"Compared {len(edges)} neighbouring pairs; divergence is 1 - text similarity, "
+               "averaged over the sections either neighbour has")
+
+    pairs_col, jurisdictions_col = st.columns([3, 2])
+    with pairs_col:
+        st.markdown("**Most divergent neighbours**")
+        st.dataframe(pd.DataFrame([{
+            'Jurisdictions': f"{edge['jurisdiction1']} / {edge['jurisdiction2']}",
+            'Divergence': round(edge['divergence'], 3),
+            'Differing Sections': f"{edge['differing']} of {edge['sections']}",
+            'Most Divergent': ', '.join(row['section'] for row in edge['top_sections'])
+        } for edge in edges[:25]]), hide_index=True)
+    with jurisdictions_col:
+        st.markdown("**Jurisdictions furthest from their neighbours**")
+        st.dataframe(pd.DataFrame([{
+            'Jurisdiction': row['jurisdiction'],
+            'Mean Divergence': round(row['divergence'], 3),
+            'Neighbours': row['neighbours'],
+            'Most Divergent Neighbour': row['most_divergent_neighbour']
+        } for row in jurisdiction_hotspots(edges)[:25]]), hide_index=True)
@@ -1,10 +1,16 @@
+import time
 import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from utils.nlp_processor import BuildingCodeNLP, analyze_code_differences
 from typing import List, Dict
+from utils.job_queue import get_job_queue, summarize_jobs
+from utils.instrumentation import span, traced
 
+# Seconds between reruns while queued analyses are still running
+JOB_POLL_SECONDS = 1.0
+
+@traced('analysis.calculate_impact_score')
 def calculate_impact_score(differences: Dict) -> float:
     try:
         score = 0
@@ -98,6 +104,7 @@ def get_secondary_action(differences: Dict, jurisdiction1: str, jurisdiction2: s
         return f"Standardize measurement specifications between {jurisdiction1} and {jurisdiction2}"
     return f"Align technical terminology and definitions between jurisdictions"
 
+@traced('analysis.generate_recommendations')
 def generate_recommendations(differences: Dict, jurisdiction1: str, jurisdiction2: str) -> List[Dict]:
     """Generate specific policy recommendations based on code differences"""
     try:
@@ -143,6 +150,46 @@ def generate_recommendations(differences: Dict, jurisdiction1: str, jurisdiction
         print(f"Error generating recommendations: {e}")
         return []
 
+def analyze_code_pair(code1: str, code2: str) -> Dict:
+    """Analyze two code texts independently of their jurisdictions (job queue handler)"""
+    # Scored by the process-wide comparison service, which batches the worker's concurrent pairs
+    from utils.comparison_service import CodeComparisonModel, compare_codes_sync
+    from utils.nlp_processor import analyze_code_differences
+    comparison = compare_codes_sync(CodeComparisonModel(content1=code1, content2=code2))
+    return dict(analyze_code_differences(code1, code2, similarity=comparison.similarity_score),
+                differences=comparison.differences)
+
+def pair_results(analysis: Dict, jurisdiction1: str, jurisdiction2: str) -> Dict:
+    """Citations, recommendations and impact score for an analyzed pair of jurisdictions"""
+    return {
+        'analysis': analysis,
+        'citation_analysis': analyze_citations(analysis, jurisdiction1, jurisdiction2),
+        'recommendations': generate_recommendations(analysis, jurisdiction1, jurisdiction2),
+        'impact_score': calculate_impact_score(analysis)
+    }
+
+def analyze_pair(code1: str, code2: str, jurisdiction1: str, jurisdiction2: str) -> Dict:
+    """Run the full pairwise analysis for two code sections"""
+    return pair_results(analyze_code_pair(code1, code2), jurisdiction1, jurisdiction2)
+
+def render_job_progress(summary: Dict, key: str):
+    """Show batch progress for queued analyses, with a retry for the ones that failed"""
+    if summary['done'] < summary['total']:
+        st.progress(summary['progress'], text=f"Analyzed {summary['done']} of {summary['total']} comparisons")
+    if summary['failed']:
+        st.warning(f"{summary['failed']} comparison(s) failed")
+        st.button("Retry failed comparisons", key=key,
+                  on_click=lambda: get_job_queue().retry(summary['failed_ids']))
+
+def rerun_while_pending(summary: Dict, interval: float = JOB_POLL_SECONDS):
+    """Rerun the page after a short pause while any job of the batch is still queued or running.
+
+    Call it after everything else is drawn, since the rerun ends this run of the script.
+    """
+    if summary['pending']:
+        time.sleep(interval)
+        st.rerun()
+
 def render_policy_recommendations(db, selected_jurisdictions):
     """Render the policy recommendations interface with enhanced comparisons and citations"""
     try:
@@ -158,7 +205,8 @@ def render_policy_recommendations(db, selected_jurisdictions):
             jurisdiction_codes = db.get_building_codes(jurisdiction)
             codes.extend(jurisdiction_codes)
         
-        df = pd.DataFrame(codes)
+        with span('dataframe.build', rows=len(codes)):
+            df = pd.DataFrame(codes)
         
         if df.empty:
             st.warning("No building codes found for the selected jurisdictions")
@@ -174,54 +222,69 @@ def render_policy_recommendations(db, selected_jurisdictions):
         # Analyze differences between jurisdictions
         st.subheader("Code Alignment Analysis")
         
+        # Queue every pair up front; the worker process runs them outside the rerun
+        queue = get_job_queue()
+        pairs = []
         for i, jurisdiction1 in enumerate(selected_jurisdictions[:-1]):
             for jurisdiction2 in selected_jurisdictions[i+1:]:
-                st.markdown(f"### {jurisdiction1} vs {jurisdiction2}")
+                codes1 = filtered_df[filtered_df['jurisdiction'] == jurisdiction1]
+                codes2 = filtered_df[filtered_df['jurisdiction'] == jurisdiction2]
                 
-                try:
-                    # Get codes for comparison
-                    codes1 = filtered_df[filtered_df['jurisdiction'] == jurisdiction1]
-                    codes2 = filtered_df[filtered_df['jurisdiction'] == jurisdiction2]
-                    
-                    if codes1.empty or codes2.empty:
-                        st.warning(f"Insufficient code content for comparison between {jurisdiction1} and {jurisdiction2}")
-                        continue
-                    
-                    code1 = codes1.iloc[0]['content']
-                    code2 = codes2.iloc[0]['content']
-                    
-                    if not code1 or not code2:
-                        st.warning("Insufficient code content for comparison")
-                        continue
-                    
-                    # Analyze differences
-                    differences = analyze_code_differences(code1, code2)
-                    
-                    # Generate recommendations
-                    recommendations = generate_recommendations(differences, jurisdiction1, jurisdiction2)
-                    
-                    # Display recommendations with citations
-                    if recommendations:
-                        st.markdown("#### Recommended Actions")
-                        for rec in recommendations:
-                            with st.expander(f"{rec['category']} - {rec['impact']} Impact"):
-                                st.markdown(f"**Description:** {rec['description']}")
-                                st.markdown(f"**Expected Benefit:** {rec['benefit']}")
-                                
-                                # Display details
-                                st.markdown("**Details:**")
-                                for detail in rec['details']:
-                                    st.markdown(detail)
-                                
-                                # Display citations
-                                if 'citations' in rec:
-                                    st.markdown("**Supporting Citations:**")
-                                    for citation in rec['citations']:
-                                        st.markdown(f"📌 {citation}")
-                                        
-                except Exception as e:
-                    st.error(f"Error analyzing codes: {e}")
+                if codes1.empty or codes2.empty:
+                    pairs.append((jurisdiction1, jurisdiction2, None, "Insufficient code content for comparison "
+                                  f"between {jurisdiction1} and {jurisdiction2}"))
                     continue
-                    
+                
+                code1 = db.get_content(codes1.iloc[0]['content_hash'])
+                code2 = db.get_content(codes2.iloc[0]['content_hash'])
+                
+                if not code1 or not code2:
+                    pairs.append((jurisdiction1, jurisdiction2, None, "Insufficient code content for comparison"))
+                    continue
+                
+                job_id = queue.submit('pair_analysis', {'code1': code1, 'code2': code2})
+                pairs.append((jurisdiction1, jurisdiction2, job_id, None))
+        
+        job_ids = [job_id for _, _, job_id, _ in pairs if job_id]
+        jobs = queue.get_jobs(job_ids)
+        summary = summarize_jobs(jobs, job_ids)
+        render_job_progress(summary, key="policy_retry")
+        
+        for jurisdiction1, jurisdiction2, job_id, warning in pairs:
+            st.markdown(f"### {jurisdiction1} vs {jurisdiction2}")
+            
+            if warning:
+                st.warning(warning)
+                continue
+            
+            job = jobs.get(job_id, {})
+            if job.get('status') == 'failed':
+                st.error(f"Error analyzing codes: {job['error'].strip().splitlines()[-1]}")
+                continue
+            if job.get('status') != 'done':
+                st.info("Analysis queued...")
+                continue
+            
+            # Display recommendations with citations
+            recommendations = pair_results(job['result'], jurisdiction1, jurisdiction2)['recommendations']
+            if recommendations:
+                st.markdown("#### Recommended Actions")
+                for rec in recommendations:
+                    with st.expander(f"{rec['category']} - {rec['impact']} Impact"):
+                        st.markdown(f"**Description:** {rec['description']}")
+                        st.markdown(f"**Expected Benefit:** {rec['benefit']}")
+                        
+                        # Display details
+                        st.markdown("**Details:**")
+                        for detail in rec['details']:
+                            st.markdown(detail)
+                        
+                        # Display citations
+                        if 'citations' in rec:
+                            st.markdown("**Supporting Citations:**")
+                            for citation in rec['citations']:
+                                st.markdown(f"📌 {citation}")
+
+        rerun_while_pending(summary)
     except Exception as e:
         st.error(f"Error in policy recommendations: {e}")
\ No newline at end of file
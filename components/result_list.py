@@ -0,0 +1,55 @@
+import math
+from typing import Callable, Dict, Optional, Sequence
+import streamlit as st
+
+PAGE_SIZES = [10, 25, 50, 100]
+
+def render_result_list(key: str,
+                       summary: Callable[[Dict], str],
+                       body: Callable[[Dict], None],
+                       items: Optional[Sequence[Dict]] = None,
+                       total: Optional[int] = None,
+                       fetch_page: Optional[Callable[[int, int], Sequence[Dict]]] = None,
+                       item_key: Optional[Callable[[Dict], str]] = None,
+                       empty_message: str = "No results found"):
+    """Render a paginated list of collapsed results, rendering each body only when opened.
+
+    Pass either ``items`` (windowed locally) or ``total`` and ``fetch_page(offset, limit)``
+    (paginated by the caller, e.g. with SQL LIMIT/OFFSET).
+    """
+    if items is not None:
+        total = len(items)
+    if not total:
+        st.info(empty_message)
+        return
+
+    size_key = f"{key}_page_size"
+    page_key = f"{key}_page"
+
+    info_col, page_col, size_col = st.columns([3, 1, 1])
+    with size_col:
+        page_size = st.selectbox("Per page", PAGE_SIZES, key=size_key)
+
+    # Clamp the stored page before the widget is created so shrinking results never overflow
+    page_count = max(1, math.ceil(total / page_size))
+    if st.session_state.get(page_key, 1) > page_count:
+        st.session_state[page_key] = page_count
+    with page_col:
+        page = st.number_input("Page", min_value=1, max_value=page_count, step=1, key=page_key)
+
+    start = (int(page) - 1) * page_size
+    end = min(start + page_size, total)
+    with info_col:
+        st.caption(f"Showing {start + 1}-{end} of {total} results (page {int(page)} of {page_count})")
+
+    if items is not None:
+        page_items = items[start:end]
+    else:
+        page_items = fetch_page(start, page_size)
+
+    for index, item in enumerate(page_items, start):
+        row_key = item_key(item) if item_key else str(index)
+        # Only opened rows pay for their content
+        if st.checkbox(summary(item), key=f"{key}_open_{row_key}"):
+            with st.container():
+                body(item)
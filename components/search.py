@@ -1,4 +1,26 @@
 import streamlit as st
+from components.result_list import render_result_list
+
+def get_selected_jurisdictions(db):
+    """Jurisdictions picked on the search tab, kept for reruns where that tab isn't open"""
+    if 'selected_jurisdictions' not in st.session_state:
+        st.session_state.selected_jurisdictions = db.get_jurisdictions()[:2]
+    return st.session_state.selected_jurisdictions
+
+def render_similar_sections(db, code, k=5):
+    """Closest sections in other jurisdictions, by content rather than section number"""
+    try:
+        # Imported here so scikit-learn only loads once someone asks for similar sections
+        from utils.semantic_index import get_semantic_index
+        similar = get_semantic_index(db).more_like_this(code['content_hash'], k, exclude_jurisdiction=code['jurisdiction'])
+    except Exception as e:
+        st.error(f"Error finding similar sections: {e}")
+        return
+    if not similar:
+        st.info("No similar sections found in other jurisdictions")
+    for match, score in similar:
+        st.markdown(f"- **{match['jurisdiction']}** - {match['category']} - Section {match['section']} "
+                    f"(similarity {score:.2f})")
 
 def render_search(db):
     st.subheader("Search Building Codes")
@@ -7,23 +29,30 @@ def render_search(db):
     selected_jurisdictions = st.multiselect(
         "Select Jurisdictions",
         options=db.get_jurisdictions(),
-        default=db.get_jurisdictions()[:2]
+        default=get_selected_jurisdictions(db)
     )
+    st.session_state.selected_jurisdictions = selected_jurisdictions
     
     if search_term:
         codes = []
         for jurisdiction in selected_jurisdictions:
             jurisdiction_codes = db.get_building_codes(jurisdiction)
-            codes.extend([
-                code for code in jurisdiction_codes
-                if search_term.lower() in code['content'].lower()
-            ])
+            # Search each distinct text once, however many sections share it
+            contents = db.get_contents(code['content_hash'] for code in jurisdiction_codes)
+            matching = {digest for digest, content in contents.items() if search_term.lower() in content.lower()}
+            codes.extend([code for code in jurisdiction_codes if code['content_hash'] in matching])
+        
+        def render_code(code):
+            st.markdown(db.get_content(code['content_hash']))
+            if st.button("More like this", key=f"more_like_{code['id']}"):
+                render_similar_sections(db, code)
         
-        if codes:
-            for code in codes:
-                with st.expander(f"{code['jurisdiction']} - {code['category']} - Section {code['section']}"):
-                    st.markdown(code['content'])
-        else:
-            st.info("No results found")
+        render_result_list(
+            "search_results",
+            summary=lambda code: f"{code['jurisdiction']} - {code['category']} - Section {code['section']}",
+            body=render_code,
+            items=codes,
+            item_key=lambda code: str(code['id'])
+        )
     
     return selected_jurisdictions
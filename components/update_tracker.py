@@ -1,16 +1,51 @@
+import html
 import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta
+from typing import Dict, List, Optional
 from utils.code_tracker import CodeTracker
+from utils.adoption_analytics import AdoptionAnalytics
+from utils.text_diff import word_diff
+from utils.instrumentation import span
+from components.result_list import render_result_list
 import plotly.express as px
 
-def render_update_tracker(db, code_tracker: CodeTracker):
+def diff_html(previous_content: str, ops: List[list], side: str) -> str:
+    """Render one side of a word diff, highlighting what that side removed or added"""
+    parts, pos = [], 0
+    for op, value in ops:
+        if op == '=':
+            parts.append(html.escape(previous_content[pos:pos + value]))
+            pos += value
+        elif op == '-':
+            pos += len(value)
+            if side == 'previous':
+                parts.append(f'<del class="diff-del">{html.escape(value)}</del>')
+        elif side == 'new':
+            parts.append(f'<ins class="diff-ins">{html.escape(value)}</ins>')
+    # Line breaks as tags, so a blank line can't end the HTML block mid-diff
+    return '<div class="diff-view">' + ''.join(parts).replace('\n', '<br>') + '</div>'
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def get_update_diff(update_id: int, _previous_content: str, _new_content: str,
+                    _ops: Optional[List[list]] = None) -> Dict:
+    """Highlighted diff of a MODIFY update, cached by update id since updates never change"""
+    ops = _ops if _ops is not None else word_diff(_previous_content, _new_content)
+    return {
+        'previous_html': diff_html(_previous_content, ops, 'previous'),
+        'new_html': diff_html(_previous_content, ops, 'new'),
+        'removed': sum(len(value.split()) for op, value in ops if op == '-'),
+        'added': sum(len(value.split()) for op, value in ops if op == '+')
+    }
+
+def render_update_tracker(db, code_tracker: CodeTracker, adoption_analytics: Optional[AdoptionAnalytics] = None):
     st.subheader("Code Update Tracking")
     
-    # Create tabs for different tracking views
-    tab1, tab2, tab3 = st.tabs(["Recent Updates", "Version History", "Update Notifications"])
+    # Only the selected view runs its queries, unlike st.tabs which renders all three
+    view = st.radio("Tracking view", ["Recent Updates", "Version History", "Update Notifications"],
+                    key="update_tracker_view", horizontal=True, label_visibility="collapsed")
     
-    with tab1:
+    if view == "Recent Updates":
         st.markdown("### Recent Code Updates")
         
         # Filters
@@ -41,73 +76,109 @@ def render_update_tracker(db, code_tracker: CodeTracker):
             days = int(timeframe.split()[1])
             from_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
         
-        # Get updates based on filters
-        updates = code_tracker.get_code_updates(
-            jurisdiction=None if jurisdiction == "All" else jurisdiction,
-            category=None if category == "All" else category,
-            from_date=from_date
-        )
+        # Get updates based on filters, one page at a time
+        filters = {
+            'jurisdiction': None if jurisdiction == "All" else jurisdiction,
+            'category': None if category == "All" else category,
+            'from_date': from_date
+        }
         
-        if updates:
-            updates_df = pd.DataFrame(updates)
-            updates_df['update_date'] = pd.to_datetime(updates_df['update_date'])
-            
-            # Display updates in an expandable format
-            for _, update in updates_df.iterrows():
-                with st.expander(
-                    f"{update['jurisdiction']} - {update['category']} - {update['section']} "
-                    f"({update['change_type']} on {update['update_date'].strftime('%Y-%m-%d')})"
-                ):
-                    if update['change_type'] == 'MODIFY':
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            st.markdown("**Previous Version:**")
-                            st.markdown(update['previous_content'])
-                        with col2:
-                            st.markdown("**New Version:**")
-                            st.markdown(update['new_content'])
-                    else:
-                        st.markdown("**Content:**")
-                        st.markdown(update['new_content'])
-        else:
-            st.info("No updates found for the selected filters")
+        def render_update(update):
+            # Diff-only updates are rebuilt here, when the row is opened
+            previous_content, new_content = code_tracker.get_update_contents(update)
+            if update['change_type'] == 'MODIFY':
+                if previous_content is None and new_content is None:
+                    st.warning("The content of this update could not be rebuilt from the stored diff")
+                    return
+                diff = get_update_diff(update['id'], previous_content, new_content, update.get('diff'))
+                st.caption(f"{diff['removed']} word(s) removed, {diff['added']} word(s) added")
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.markdown("**Previous Version:**")
+                    st.markdown(diff['previous_html'], unsafe_allow_html=True)
+                with col2:
+                    st.markdown("**New Version:**")
+                    st.markdown(diff['new_html'], unsafe_allow_html=True)
+            elif update['change_type'] == 'DELETE':
+                st.markdown("**Removed Content:**")
+                st.markdown(previous_content)
+            else:
+                st.markdown("**Content:**")
+                st.markdown(new_content)
+        
+        render_result_list(
+            "recent_updates",
+            summary=lambda update: (
+                f"{update['jurisdiction']} - {update['category']} - {update['section']} "
+                f"({update['change_type']} on {pd.to_datetime(update['update_date']).strftime('%Y-%m-%d')})"
+            ),
+            body=render_update,
+            total=code_tracker.count_code_updates(**filters),
+            fetch_page=lambda offset, limit: code_tracker.get_code_updates(limit=limit, offset=offset, **filters),
+            item_key=lambda update: str(update['id']),
+            empty_message="No updates found for the selected filters"
+        )
     
-    with tab2:
+    if view == "Version History":
         st.markdown("### Version History")
         
-        # Get all versions for each jurisdiction
-        with db.get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT jurisdiction, version_number, effective_date, created_at
-                    FROM code_versions
-                    ORDER BY jurisdiction, effective_date DESC
-                """)
-                versions = cur.fetchall()
+        analytics = (adoption_analytics or AdoptionAnalytics(code_tracker)).get()
+        versions_df = analytics['versions']
         
-        if versions:
-            versions_df = pd.DataFrame(versions, columns=['Jurisdiction', 'Version', 'Effective Date', 'Created At'])
-            versions_df['Effective Date'] = pd.to_datetime(versions_df['Effective Date'])
-            versions_df['Created At'] = pd.to_datetime(versions_df['Created At'])
-            
-            st.dataframe(versions_df)
+        if not versions_df.empty:
+            st.dataframe(versions_df[[
+                'jurisdiction', 'version_number', 'effective_date', 'cycle', 'lag_days',
+                'update_count', 'added_count', 'modified_count', 'deleted_count'
+            ]].rename(columns={
+                'jurisdiction': 'Jurisdiction', 'version_number': 'Version',
+                'effective_date': 'Effective Date', 'cycle': 'Cycle', 'lag_days': 'Lag (days)',
+                'update_count': 'Modifications', 'added_count': 'Added',
+                'modified_count': 'Modified', 'deleted_count': 'Deleted'
+            }))
             
             # Version timeline visualization
             st.markdown("#### Version Timeline")
             
             fig = px.timeline(
-                versions_df,
-                x_start='Effective Date',
-                x_end='Created At',
-                y='Jurisdiction',
-                color='Version',
+                versions_df.assign(created_at=pd.to_datetime(versions_df['created_at'])),
+                x_start='effective_date',
+                x_end='created_at',
+                y='jurisdiction',
+                color='version_number',
                 title='Code Version Timeline by Jurisdiction'
             )
-            st.plotly_chart(fig, key="version_timeline")
+            with span('plotly.render', chart='version_timeline'):
+                st.plotly_chart(fig, key="version_timeline")
+            
+            # Adoption lag against each cycle's statewide effective date
+            st.markdown("#### Adoption Lag by Cycle")
+            adoption_df = analytics['adoption']
+            fig = px.bar(
+                adoption_df.assign(cycle=adoption_df['cycle'].astype(str)),
+                x='jurisdiction',
+                y='lag_days',
+                color='cycle',
+                barmode='group',
+                hover_data=['adopted_on', 'amendments', 'modifications'],
+                labels={'lag_days': 'Days after statewide effective date', 'cycle': 'Cycle'},
+                title='Adoption Lag per Jurisdiction and Cycle'
+            )
+            with span('plotly.render', chart='adoption_lag'):
+                st.plotly_chart(fig, key="adoption_lag")
+            
+            st.markdown("#### Lead/Lag Ranking")
+            st.dataframe(analytics['rankings'][[
+                'position', 'jurisdiction', 'status', 'cycles', 'mean_lag_days',
+                'mean_relative_lag_days', 'modifications'
+            ]].rename(columns={
+                'position': 'Rank', 'jurisdiction': 'Jurisdiction', 'status': 'Status',
+                'cycles': 'Cycles', 'mean_lag_days': 'Mean Lag (days)',
+                'mean_relative_lag_days': 'Vs. Cycle Median (days)', 'modifications': 'Modifications'
+            }), hide_index=True)
         else:
             st.info("No version history available")
     
-    with tab3:
+    if view == "Update Notifications":
         st.markdown("### Update Notifications")
         
         # Subscription form
@@ -2,6 +2,7 @@ import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
 import pandas as pd
+from utils.instrumentation import span
 
 def render_visualizations(db, selected_jurisdictions):
     st.subheader("Code Analysis Visualizations")
@@ -12,7 +13,8 @@ def render_visualizations(db, selected_jurisdictions):
         jurisdiction_codes = db.get_building_codes(jurisdiction)
         codes.extend(jurisdiction_codes)
     
-    df = pd.DataFrame(codes)
+    with span('dataframe.build', rows=len(codes)):
+        df = pd.DataFrame(codes)
     
     # Category distribution with proper grouping
     category_distribution = (
@@ -29,13 +31,15 @@ def render_visualizations(db, selected_jurisdictions):
         title='Building Code Categories by Jurisdiction',
         labels={'count': 'Number of Sections', 'category': 'Category'}
     )
-    st.plotly_chart(fig_categories, key="category_distribution")
+    with span('plotly.render', chart='category_distribution'):
+        st.plotly_chart(fig_categories, key="category_distribution")
     
-    # Code complexity heatmap with deduplicated data
+    # Code complexity heatmap with deduplicated data: total length of the distinct texts
+    lengths = {digest: len(content) for digest, content in db.get_contents(df['content_hash']).items()}
     complexity_data = (
         df.groupby(['jurisdiction', 'category'], as_index=False)
-        .agg(complexity=('content', lambda x: len(' '.join(set(x)))))
-    )  # Fixed missing parenthesis
+        .agg(complexity=('content_hash', lambda x: sum(lengths.get(h, 0) + 1 for h in set(x)) - 1))
+    )
     
     # Pivot the data for heatmap
     heatmap_data = complexity_data.pivot(
@@ -55,4 +59,5 @@ def render_visualizations(db, selected_jurisdictions):
         xaxis_title='Category',
         yaxis_title='Jurisdiction'
     )
-    st.plotly_chart(fig_heatmap, key="complexity_heatmap")
+    with span('plotly.render', chart='complexity_heatmap'):
+        st.plotly_chart(fig_heatmap, key="complexity_heatmap")
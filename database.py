@@ -1,28 +1,117 @@
+import argparse
+import hashlib
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
 from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+import psycopg2
+from psycopg2.extras import RealDictCursor, execute_values
+from utils.change_feed import notify_change
+from utils.instrumentation import connection_factory, span, traced
 
-class Database:
-    def __init__(self):
-        self.config = {
-            'dbname': os.environ['PGDATABASE'],
-            'user': os.environ['PGUSER'],
-            'password': os.environ['PGPASSWORD'],
-            'host': os.environ['PGHOST'],
-            'port': os.environ['PGPORT']
-        }
+# Section texts kept in memory, keyed by hash; entries never go stale, so this is a plain LRU
+CONTENT_CACHE_SIZE = 20000
 
-    @contextmanager
-    def get_connection(self):
-        conn = psycopg2.connect(**self.config)
-        try:
-            yield conn
-        finally:
-            conn.close()
+def content_hash(content: str) -> str:
+    """Key of a section text in code_contents (matches Postgres' sha256 of the UTF-8 text)"""
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
 
-    def get_building_codes(self, jurisdiction=None):
-        with self.get_connection() as conn:
+def corpus_fingerprint(codes: Iterable[Dict]) -> str:
+    """Identity of a code set: changes whenever a section is added, moved or edited"""
+    digest = hashlib.sha256()
+    for code in sorted(codes, key=lambda code: code['id']):
+        digest.update(f"{code['id']}\x1f{code['jurisdiction']}\x1f{code['category']}\x1f"
+                      f"{code['section']}\x1f{code['content_hash']}\x1e".encode('utf-8'))
+    return digest.hexdigest()
+
+def intern_contents(cur, contents) -> list:
+    """Store each distinct text once in code_contents and return the hashes in input order"""
+    hashes = [content_hash(content) for content in contents]
+    unique = dict(zip(hashes, contents))
+    if unique:
+        execute_values(cur, """
+            INSERT INTO code_contents (content_hash, content) VALUES %s
+            ON CONFLICT (content_hash) DO NOTHING
+        """, list(unique.items()), page_size=1000)
+    return hashes
+
+class StorageBackend(ABC):
+    """Read side of the corpus store. Database and CodeTracker run their queries through one.
+
+    ``immutable`` backends (snapshots) never change under the app, so their reads are cached
+    for the life of the process.
+    """
+
+    immutable = False
+
+    @abstractmethod
+    def load_building_codes(self, jurisdiction: Optional[str] = None) -> List[Dict]:
+        ...
+
+    @abstractmethod
+    def load_jurisdictions(self) -> List[str]:
+        ...
+
+    @abstractmethod
+    def load_categories(self) -> List[str]:
+        ...
+
+    @abstractmethod
+    def fetch_contents(self, hashes: List[str]) -> Dict[str, str]:
+        ...
+
+    @abstractmethod
+    def code_updates(self, jurisdiction: Optional[str], category: Optional[str], from_date: Optional[str],
+                     limit: int, offset: int) -> List[Dict]:
+        ...
+
+    @abstractmethod
+    def count_code_updates(self, jurisdiction: Optional[str], category: Optional[str],
+                           from_date: Optional[str]) -> int:
+        ...
+
+    @abstractmethod
+    def version_history(self, jurisdiction: Optional[str] = None) -> List[Dict]:
+        ...
+
+    @abstractmethod
+    def codes_as_of(self, jurisdiction: str, as_of) -> List[Dict]:
+        ...
+
+    @abstractmethod
+    def load_references(self, hashes: Optional[List[str]] = None) -> List[Dict]:
+        """Citation rows (content_hash, sections, standards) recorded for each indexed text, or for ``hashes``"""
+
+    @abstractmethod
+    def load_measurements(self) -> List[Dict]:
+        """Normalized measurement rows (see utils.measurements) for each indexed text"""
+
+    @abstractmethod
+    def load_measured_texts(self) -> Set[str]:
+        """Content hashes whose measurements were parsed, including texts that have none"""
+
+    @abstractmethod
+    def section_updates(self, update: Dict) -> Tuple[List[Dict], Optional[str]]:
+        """Updates of ``update``'s section from it onwards (newest first) and the section's current text"""
+
+    @abstractmethod
+    def export_tables(self) -> Iterator[Tuple[str, Iterator[Dict]]]:
+        """Stream every corpus table as (name, rows), for loading into another backend"""
+
+class PostgresBackend(StorageBackend):
+    """The live Postgres database, reached through Database.get_connection"""
+
+    EXPORT_TABLES = ['code_contents', 'building_codes', 'code_versions', 'code_updates', 'section_history',
+                     'code_references', 'code_measurements', 'measured_texts', 'code_categories']
+
+    def __init__(self, db: 'Database'):
+        self.db = db
+
+    def load_building_codes(self, jurisdiction=None):
+        self.db.require_content_storage()
+        with self.db.get_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # Check if columns exist
                 cur.execute("""
@@ -34,7 +123,7 @@ class Database:
                 existing_columns = [row['column_name'] for row in cur.fetchall()]
 
                 # Construct base columns including sort columns in the SELECT
-                base_columns = ['id', 'jurisdiction', 'category', 'section', 'content']
+                base_columns = ['id', 'jurisdiction', 'category', 'section', 'content_hash']
                 date_columns = []
                 if 'last_updated' in existing_columns:
                     date_columns.append('last_updated')
@@ -60,14 +149,14 @@ class Database:
                 
                 return results
 
-    def get_jurisdictions(self):
-        with self.get_connection() as conn:
+    def load_jurisdictions(self):
+        with self.db.get_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute("SELECT DISTINCT jurisdiction FROM building_codes ORDER BY jurisdiction")
                 return [r['jurisdiction'] for r in cur.fetchall()]
 
-    def get_categories(self):
-        with self.get_connection() as conn:
+    def load_categories(self):
+        with self.db.get_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute("""
                     SELECT DISTINCT category, LOWER(category) as sort_category
@@ -77,6 +166,336 @@ class Database:
                 results = cur.fetchall()
                 return [r['category'].title() if r['category'] else None for r in results]
 
+    def fetch_contents(self, hashes):
+        with self.db.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT content_hash, content FROM code_contents WHERE content_hash = ANY(%s)",
+                    (hashes,)
+                )
+                return dict(cur.fetchall())
+
+    def load_references(self, hashes=None):
+        with self.db.get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("SELECT to_regclass('code_references')")
+                if cur.fetchone()['to_regclass'] is None:
+                    return []
+                if hashes is None:
+                    cur.execute("SELECT content_hash, sections, standards FROM code_references")
+                else:
+                    cur.execute("""
+                        SELECT content_hash, sections, standards FROM code_references
+                        WHERE content_hash = ANY(%s)
+                    """, (list(hashes),))
+                return cur.fetchall()
+
+    def load_measurements(self):
+        with self.db.get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("SELECT to_regclass('code_measurements')")
+                if cur.fetchone()['to_regclass'] is None:
+                    return []
+                cur.execute("SELECT * FROM code_measurements ORDER BY content_hash, position")
+                return cur.fetchall()
+
+    def load_measured_texts(self):
+        with self.db.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT to_regclass('measured_texts')")
+                if cur.fetchone()[0] is None:
+                    return set()
+                cur.execute("SELECT content_hash FROM measured_texts")
+                return {row[0] for row in cur.fetchall()}
+
+    def _update_filters(self, jurisdiction: Optional[str], category: Optional[str],
+                        from_date: Optional[str]):
+        """Build the WHERE clause shared by update listing and counting"""
+        clause = " WHERE 1=1"
+        params = []
+        
+        if jurisdiction:
+            clause += " AND cv.jurisdiction = %s"
+            params.append(jurisdiction)
+        
+        if category:
+            clause += " AND cu.category = %s"
+            params.append(category)
+        
+        if from_date:
+            clause += " AND cu.update_date >= %s"
+            params.append(from_date)
+        
+        return clause, params
+
+    def code_updates(self, jurisdiction, category, from_date, limit, offset):
+        with self.db.get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                clause, params = self._update_filters(jurisdiction, category, from_date)
+                query = """
+                    SELECT cu.*, cv.jurisdiction, cv.version_number, cv.effective_date
+                    FROM code_updates cu
+                    JOIN code_versions cv ON cu.code_version_id = cv.id
+                """ + clause
+                
+                query += " ORDER BY cu.update_date DESC, cu.id DESC LIMIT %s OFFSET %s"
+                params.extend([limit, offset])
+                
+                cur.execute(query, params)
+                return cur.fetchall()
+
+    def count_code_updates(self, jurisdiction, category, from_date):
+        with self.db.get_connection() as conn:
+            with conn.cursor() as cur:
+                clause, params = self._update_filters(jurisdiction, category, from_date)
+                cur.execute("""
+                    SELECT COUNT(*)
+                    FROM code_updates cu
+                    JOIN code_versions cv ON cu.code_version_id = cv.id
+                """ + clause, params)
+                return cur.fetchone()[0]
+
+    def version_history(self, jurisdiction=None):
+        with self.db.get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                query = """
+                    SELECT cv.*, COUNT(cu.id) as update_count,
+                           COUNT(cu.id) FILTER (WHERE cu.change_type = 'ADD') as added_count,
+                           COUNT(cu.id) FILTER (WHERE cu.change_type = 'MODIFY') as modified_count,
+                           COUNT(cu.id) FILTER (WHERE cu.change_type = 'DELETE') as deleted_count
+                    FROM code_versions cv
+                    LEFT JOIN code_updates cu ON cv.id = cu.code_version_id
+                    WHERE 1=1
+                """
+                params = []
+                
+                if jurisdiction:
+                    query += " AND cv.jurisdiction = %s"
+                    params.append(jurisdiction)
+                
+                query += " GROUP BY cv.id ORDER BY cv.effective_date DESC"
+                
+                cur.execute(query, params)
+                return cur.fetchall()
+
+    def codes_as_of(self, jurisdiction, as_of):
+        with self.db.get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT sh.id, sh.jurisdiction, INITCAP(sh.category) AS category, sh.section,
+                           sh.content_hash, cc.content,
+                           lower(sh.validity) AS valid_from, upper(sh.validity) AS valid_to
+                    FROM section_history sh
+                    JOIN code_contents cc ON cc.content_hash = sh.content_hash
+                    WHERE sh.jurisdiction = %s AND sh.validity @> %s::date
+                    ORDER BY LOWER(sh.category), sh.section
+                """, (jurisdiction, as_of))
+                return cur.fetchall()
+
+    def section_updates(self, update):
+        self.db.require_content_storage()
+        with self.db.get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT cu.id, cu.change_type, cu.diff, cu.previous_content, cu.new_content
+                    FROM code_updates cu
+                    JOIN code_versions cv ON cu.code_version_id = cv.id
+                    WHERE cv.jurisdiction = %s AND LOWER(cu.category) = LOWER(%s)
+                    AND cu.section = %s AND cu.id >= %s
+                    ORDER BY cu.id DESC
+                """, (update['jurisdiction'], update['category'], update['section'], update['id']))
+                later_updates = cur.fetchall()
+                cur.execute("""
+                    SELECT cc.content
+                    FROM building_codes bc JOIN code_contents cc ON cc.content_hash = bc.content_hash
+                    WHERE bc.jurisdiction = %s AND LOWER(bc.category) = LOWER(%s) AND bc.section = %s
+                    LIMIT 1
+                """, (update['jurisdiction'], update['category'], update['section']))
+                row = cur.fetchone()
+        return later_updates, row['content'] if row else None
+
+    def export_tables(self):
+        self.db.require_content_storage()
+        with self.db.get_connection() as conn:
+            for table in self.EXPORT_TABLES:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT to_regclass(%s)", (table,))
+                    if cur.fetchone()[0] is None:
+                        continue
+                # A server-side cursor streams the table instead of loading it whole
+                with conn.cursor(name=f"export_{table}", cursor_factory=RealDictCursor) as cur:
+                    cur.itersize = 5000
+                    cur.execute(f"SELECT * FROM {table} ORDER BY 1")
+                    yield table, iter(cur)
+
+class Database:
+    def __init__(self, backend: Optional[StorageBackend] = None):
+        """Postgres from the PG* environment variables, or reads from ``backend`` (e.g. a snapshot)"""
+        if backend is None:
+            self.config = {
+                'dbname': os.environ['PGDATABASE'],
+                'user': os.environ['PGUSER'],
+                'password': os.environ['PGPASSWORD'],
+                'host': os.environ['PGHOST'],
+                'port': os.environ['PGPORT']
+            }
+            backend = PostgresBackend(self)
+        else:
+            self.config = None
+        self.backend = backend
+        self.change_feed = None
+        self._cache = {}
+        self._cache_generation = 0
+        self._cache_lock = threading.Lock()
+        self._contents = OrderedDict()
+        self._content_storage_ready = False
+
+    def attach_change_feed(self, change_feed):
+        """Cache corpus reads for as long as the change feed is connected to invalidate them"""
+        self.change_feed = change_feed
+        change_feed.subscribe(self.invalidate)
+
+    def invalidate(self, event):
+        """Drop exactly the cached slices a building_codes change can affect"""
+        table = event.get('table')
+        if table not in (None, 'building_codes'):
+            return
+        jurisdiction = event.get('jurisdiction')
+        with self._cache_lock:
+            self._cache_generation += 1
+            if table is None or jurisdiction is None:
+                self._cache.clear()
+                return
+            for key in [('codes', jurisdiction), ('codes', None), ('jurisdictions',), ('categories',)]:
+                self._cache.pop(key, None)
+
+    @staticmethod
+    def _copy_rows(rows: list) -> list:
+        """Per-caller copies of cached rows, so a caller editing a row can't change what others read"""
+        return [dict(row) if isinstance(row, dict) else row for row in rows]
+
+    def _cached(self, key, load):
+        if not self.backend.immutable and (self.change_feed is None or not self.change_feed.connected.is_set()):
+            return load()
+        with self._cache_lock:
+            if key in self._cache:
+                return self._copy_rows(self._cache[key])
+            generation = self._cache_generation
+        value = load()
+        with self._cache_lock:
+            # Skip the store if an invalidation raced with the load
+            if generation == self._cache_generation:
+                self._cache[key] = value
+        return self._copy_rows(value)
+
+    @contextmanager
+    def get_connection(self):
+        if self.config is None:
+            raise RuntimeError(f"{type(self.backend).__name__} is read-only; writes need the Postgres backend")
+        with span('db.connect'):
+            conn = psycopg2.connect(**self.config, connection_factory=connection_factory())
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def migrate_content_storage(self) -> int:
+        """Move section texts into the content-addressed code_contents table.
+
+        Idempotent, and run through ``python database.py migrate`` rather than from any request path.
+        Returns the number of building_codes rows whose inline text was moved.
+        """
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS code_contents (
+                        content_hash TEXT PRIMARY KEY,
+                        content TEXT NOT NULL
+                    );
+                    ALTER TABLE building_codes
+                        ADD COLUMN IF NOT EXISTS content_hash TEXT REFERENCES code_contents (content_hash);
+                    ALTER TABLE building_codes ALTER COLUMN content DROP NOT NULL;
+                    CREATE INDEX IF NOT EXISTS building_codes_content_hash_idx ON building_codes (content_hash);
+                """)
+                # Rows written with inline text (older code, manual edits) are interned here
+                cur.execute("""
+                    INSERT INTO code_contents (content_hash, content)
+                    SELECT DISTINCT encode(sha256(convert_to(content, 'UTF8')), 'hex'), content
+                    FROM building_codes
+                    WHERE content IS NOT NULL
+                    ON CONFLICT (content_hash) DO NOTHING
+                """)
+                cur.execute("""
+                    UPDATE building_codes
+                    SET content_hash = encode(sha256(convert_to(content, 'UTF8')), 'hex'), content = NULL
+                    WHERE content IS NOT NULL
+                """)
+                migrated = cur.rowcount
+                if migrated:
+                    notify_change(cur, 'building_codes')
+                conn.commit()
+        self._content_storage_ready = True
+        return migrated
+
+    def require_content_storage(self):
+        """Fail clearly, once per process, if building_codes still predates code_contents"""
+        if self._content_storage_ready:
+            return
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT to_regclass('code_contents') IS NOT NULL AND EXISTS (
+                        SELECT 1 FROM information_schema.columns
+                        WHERE table_name = 'building_codes' AND column_name = 'content_hash'
+                    )
+                """)
+                migrated = cur.fetchone()[0]
+                if migrated:
+                    cur.execute("SELECT NOT EXISTS (SELECT 1 FROM building_codes WHERE content IS NOT NULL)")
+                    migrated = cur.fetchone()[0]
+        if not migrated:
+            raise RuntimeError("building_codes holds section texts inline; run `python database.py migrate` "
+                               "to move them into code_contents")
+        self._content_storage_ready = True
+
+    @traced('db.get_contents')
+    def get_contents(self, hashes) -> dict:
+        """Section texts for content hashes, fetching only the ones not already in memory"""
+        hashes = {h for h in hashes if h}
+        with self._cache_lock:
+            contents = {h: self._contents[h] for h in hashes if h in self._contents}
+        missing = list(hashes - contents.keys())
+        if missing:
+            fetched = self.backend.fetch_contents(missing)
+            contents.update(fetched)
+            with self._cache_lock:
+                self._contents.update(fetched)
+                while len(self._contents) > CONTENT_CACHE_SIZE:
+                    self._contents.popitem(last=False)
+        return contents
+
+    def get_content(self, content_hash):
+        return self.get_contents([content_hash]).get(content_hash)
+
+    def attach_contents(self, codes):
+        """Copies of code rows with their ``content`` filled in, one fetch per distinct text"""
+        contents = self.get_contents(code.get('content_hash') for code in codes)
+        return [dict(code, content=contents.get(code.get('content_hash'))) for code in codes]
+
+    @traced('db.get_building_codes')
+    def get_building_codes(self, jurisdiction=None, with_content=False):
+        """Code rows carrying a ``content_hash``; pass ``with_content`` to also load the texts"""
+        codes = self._cached(('codes', jurisdiction), lambda: self.backend.load_building_codes(jurisdiction))
+        return self.attach_contents(codes) if with_content else codes
+
+    @traced('db.get_jurisdictions')
+    def get_jurisdictions(self):
+        return self._cached(('jurisdictions',), self.backend.load_jurisdictions)
+
+    @traced('db.get_categories')
+    def get_categories(self):
+        return self._cached(('categories',), self.backend.load_categories)
+
     def update_category_case(self):
         """Update all categories to use consistent capitalization"""
         with self.get_connection() as conn:
@@ -86,5 +505,22 @@ class Database:
                     SET category = INITCAP(category)
                     WHERE category != INITCAP(category)
                 """)
+                if cur.rowcount:
+                    notify_change(cur, 'building_codes')
                 conn.commit()
                 return cur.rowcount
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Maintain the building code database schema")
+    parser.add_argument('command', choices=['migrate'],
+                        help="migrate: bring the schema and stored texts up to date (safe to re-run)")
+    args = parser.parse_args()
+
+    from utils.code_tracker import CodeTracker
+
+    db = Database()
+    print(f"building_codes: {db.migrate_content_storage()} inline text(s) moved to code_contents")
+    tracker = CodeTracker(db)
+    print(f"section_history: {tracker.migrate_history_storage()} row(s) moved to content hashes")
+    tracker.migrate_schema()
+    print("history, diff, text index and notification tables: ready")
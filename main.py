@@ -1,13 +1,8 @@
 import streamlit as st
-import plotly.express as px
 from database import Database
-from components.code_comparison import render_code_comparison
-from components.visualizations import render_visualizations
-from components.search import render_search
-from components.update_tracker import render_update_tracker
-from components.policy_recommendations import render_policy_recommendations
-from utils.data_processing import process_code_differences
 from utils.code_tracker import CodeTracker
+from utils.change_feed import ChangeFeed
+from utils import instrumentation
 
 # Page configuration
 st.set_page_config(
@@ -16,13 +11,32 @@ st.set_page_config(
     layout="wide"
 )
 
+# Opt-in per-stage timing for this session; the panel itself is rendered at the bottom
+if st.session_state.get('debug_panel'):
+    page_trace = instrumentation.start_trace('page')
+else:
+    page_trace = None
+    instrumentation.clear_trace()
+
 # Load custom CSS
 with open('styles.css') as f:
     st.markdown(f'<style>{f.read()}</style>', unsafe_allow_html=True)
 
-# Initialize database and code tracker
-db = Database()
-code_tracker = CodeTracker(db)
+# Initialize database, code tracker and change feed once per server process
+@st.cache_resource
+def get_services():
+    db = Database()
+    change_feed = ChangeFeed(db).start()
+    db.attach_change_feed(change_feed)
+    return db, CodeTracker(db), change_feed
+
+# Adoption analytics pulls in pandas, so it is built the first time the Updates tab opens
+@st.cache_resource
+def get_adoption_analytics(_code_tracker, _change_feed):
+    from utils.adoption_analytics import AdoptionAnalytics
+    return AdoptionAnalytics(_code_tracker, _change_feed)
+
+db, code_tracker, change_feed = get_services()
 
 # Sidebar - Role Selection
 st.sidebar.title("Building Code Analysis")
@@ -30,71 +44,170 @@ role = st.sidebar.selectbox(
     "Select Your Role",
     ["Architect", "Contractor", "Inspector", "Policy Maker"]  # Added Policy Maker role
 )
+st.sidebar.checkbox("Show performance debug panel", key="debug_panel")
+
+# New updates indicator, fed by the change feed rather than by re-querying
+seen_updates = st.session_state.setdefault('seen_update_counts', dict(change_feed.update_counts))
+new_updates = change_feed.new_update_count(seen_updates)
+if new_updates:
+    st.sidebar.info(f"🔔 {new_updates} new code update(s) since you last checked")
+    st.sidebar.button(
+        "Mark as seen",
+        on_click=lambda: st.session_state.update(seen_update_counts=dict(change_feed.update_counts))
+    )
 
 # Main content
 st.title("Building Code Analysis Platform")
 st.markdown(f"Viewing as: **{role}**")
 
-# Tabs for different views
-tab1, tab2, tab3, tab4, tab5 = st.tabs([
-    "Code Search & Compare", 
-    "Visualizations", 
-    "Analysis", 
+# Views, chosen with a radio rather than st.tabs: tabs render every panel on each run, while
+# only the selected view runs here. Components are imported on first use, so a session that
+# never opens a view never loads its dependencies.
+TABS = [
+    "Code Search & Compare",
+    "Visualizations",
+    "Analysis",
     "Updates",
-    "Policy Recommendations"  # New tab
-])
-
-with tab1:
-    # Search and jurisdiction selection
-    selected_jurisdictions = render_search(db)
-    
-    # Code comparison
-    if selected_jurisdictions:
-        render_code_comparison(db, selected_jurisdictions)
-
-with tab2:
-    if selected_jurisdictions:
-        render_visualizations(db, selected_jurisdictions)
-
-with tab3:
-    if selected_jurisdictions:
-        st.subheader("Code Difference Analysis")
-        
-        codes = []
-        for jurisdiction in selected_jurisdictions:
-            jurisdiction_codes = db.get_building_codes(jurisdiction)
-            codes.extend(jurisdiction_codes)
-        
-        differences = process_code_differences(codes)
+    "Policy Recommendations"
+]
+active_tab = st.radio("View", TABS, key="active_tab", horizontal=True, label_visibility="collapsed")
+
+search = instrumentation.import_module('components.search')
+selected_jurisdictions = search.get_selected_jurisdictions(db)
+
+if active_tab == "Code Search & Compare":
+    with instrumentation.span('tab.search_compare'):
+        # Search and jurisdiction selection
+        selected_jurisdictions = search.render_search(db)
         
-        for diff in differences:
-            with st.expander(f"{diff['category']} - Section {diff['section']} ({diff['severity']} severity)"):
+        # Code comparison
+        if selected_jurisdictions:
+            code_comparison = instrumentation.import_module('components.code_comparison')
+            code_comparison.render_code_comparison(db, selected_jurisdictions, code_tracker)
+
+if active_tab == "Visualizations":
+    with instrumentation.span('tab.visualizations'):
+        if selected_jurisdictions:
+            visualizations = instrumentation.import_module('components.visualizations')
+            visualizations.render_visualizations(db, selected_jurisdictions)
+
+if active_tab == "Analysis":
+    with instrumentation.span('tab.analysis'):
+        if selected_jurisdictions:
+            data_processing = instrumentation.import_module('utils.data_processing')
+            result_list = instrumentation.import_module('components.result_list')
+            st.subheader("Code Difference Analysis")
+            
+            codes = []
+            for jurisdiction in selected_jurisdictions:
+                jurisdiction_codes = db.get_building_codes(jurisdiction)
+                codes.extend(jurisdiction_codes)
+            
+            try:
+                # Line up renumbered sections with their counterparts in the first jurisdiction
+                semantic_index = instrumentation.import_module('utils.semantic_index')
+                section_aliases = semantic_index.get_semantic_index(db).section_aliases(selected_jurisdictions)
+            except Exception as e:
+                st.warning(f"Could not match sections by content: {e}")
+                section_aliases = {}
+            differences = data_processing.process_code_differences(codes, section_aliases)
+            
+            # Index codes once so opening a difference is a lookup rather than a scan
+            codes_by_section = {}
+            for code in codes:
+                codes_by_section.setdefault((code['jurisdiction'], code['category'], code['section']), code)
+            
+            def render_difference(diff):
                 st.markdown(f"**Affected Jurisdictions:** {', '.join(diff['jurisdictions'])}")
                 
                 for jurisdiction in diff['jurisdictions']:
-                    # Replace the next() call with a safer alternative
-                    try:
-                        jurisdiction_code = next(
-                            code for code in codes
-                            if code['jurisdiction'] == jurisdiction 
-                            and code['category'] == diff['category']
-                            and code['section'] == diff['section']
-                        )
-                        st.markdown(f"**{jurisdiction}:**")
-                        st.markdown(jurisdiction_code['content'])
-                    except StopIteration:
+                    section = diff['sections'].get(jurisdiction, diff['section'])
+                    jurisdiction_code = codes_by_section.get((jurisdiction, diff['category'], section))
+                    if jurisdiction_code:
+                        renumbered = f" (Section {section})" if section != diff['section'] else ""
+                        st.markdown(f"**{jurisdiction}{renumbered}:**")
+                        st.markdown(db.get_content(jurisdiction_code['content_hash']))
+                    else:
                         st.warning(f"No matching code found for {jurisdiction} in {diff['category']} section {diff['section']}")
+            
+            result_list.render_result_list(
+                "analysis_differences",
+                summary=lambda diff: f"{diff['category']} - Section {diff['section']} ({diff['severity']} severity)",
+                body=render_difference,
+                items=differences,
+                item_key=lambda diff: f"{diff['category']}_{diff['section']}",
+                empty_message="No differences found between the selected jurisdictions"
+            )
+            
+            st.subheader("Numeric Requirement Differences")
+            measurements = instrumentation.import_module('utils.measurements')
+            discrepancies = measurements.get_measurement_index(db).discrepancies(selected_jurisdictions)
+            if discrepancies:
+                import pandas as pd
+                st.dataframe(pd.DataFrame([
+                    dict({'Category': d['category'].title(), 'Section': d['section'],
+                          'Requirement': f"{d['bound']} {d['attribute'] or d['quantity']} ({d['unit']})"},
+                         **d['values'])
+                    for d in discrepancies
+                ]), hide_index=True)
+            else:
+                st.info("No numeric differences found between the selected jurisdictions")
 
-with tab4:
-    render_update_tracker(db, code_tracker)
+            with st.expander("Export results"):
+                export = instrumentation.import_module('utils.export')
+                dataset = st.selectbox("Dataset", sorted(export.DATASETS), key="export_dataset")
+                formats = [fmt for fmt in export.FORMATS if fmt != 'parquet' or export.parquet_available()]
+                fmt = st.selectbox("Format", formats, key="export_format")
+                # The file is built only on request and kept for the download button's rerun
+                export_key = (dataset, fmt, tuple(selected_jurisdictions))
+                if st.button("Prepare export"):
+                    with st.spinner("Preparing export..."):
+                        with export.export_to_file(db, dataset, fmt, jurisdictions=selected_jurisdictions) as out:
+                            st.session_state.export_file = (export_key, out.read())
+                prepared = st.session_state.get('export_file')
+                if prepared and prepared[0] == export_key:
+                    st.download_button(
+                        "Download",
+                        data=prepared[1],
+                        file_name=f"{dataset}.{fmt}",
+                        mime=export.FORMATS[fmt]
+                    )
+        
+        hotspots = instrumentation.import_module('components.hotspots')
+        hotspots.render_hotspots(db)
 
-with tab5:
-    if role == "Policy Maker":  # Show recommendations for Policy Makers
-        if selected_jurisdictions:
-            render_policy_recommendations(db, selected_jurisdictions)
-    else:
-        st.info("Policy recommendations are available for Policy Maker role. Please switch roles to access this feature.")
+if active_tab == "Updates":
+    with instrumentation.span('tab.updates'):
+        update_tracker = instrumentation.import_module('components.update_tracker')
+        update_tracker.render_update_tracker(db, code_tracker, get_adoption_analytics(code_tracker, change_feed))
+
+if active_tab == "Policy Recommendations":
+    with instrumentation.span('tab.policy_recommendations'):
+        if role == "Policy Maker":  # Show recommendations for Policy Makers
+            if selected_jurisdictions:
+                policy_recommendations = instrumentation.import_module('components.policy_recommendations')
+                policy_recommendations.render_policy_recommendations(db, selected_jurisdictions)
+        else:
+            st.info("Policy recommendations are available for Policy Maker role. Please switch roles to access this feature.")
 
 # Footer
 st.markdown("---")
 st.markdown("Built with Streamlit • Blueprint-inspired design")
+
+if page_trace is not None:
+    page_trace.stop()
+    with st.expander("⏱️ Performance debug", expanded=True):
+        import pandas as pd
+        stages = pd.DataFrame(page_trace.stages())
+        stages['stage'] = stages['depth'].map(lambda depth: '\u00a0\u00a0' * depth) + stages['stage']
+        st.markdown(f"**Page total:** {page_trace.root.duration * 1000:.1f} ms")
+        st.dataframe(
+            stages.reindex(columns=['stage', 'ms', 'rows', 'bytes', 'chart', 'statement', 'error']).dropna(axis=1, how='all'),
+            hide_index=True
+        )
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button("Download trace (JSON)", page_trace.to_json(), "trace.json", "application/json")
+        with col2:
+            st.download_button("Download metrics (Prometheus)", instrumentation.METRICS.to_prometheus(),
+                               "metrics.prom", "text/plain")
@@ -0,0 +1,84 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from utils.crawler import Crawler
+
+PAGE = "Section 1011.2 Width\nStairways shall be not less than 44 inches wide.\n"
+LAST_MODIFIED = 'Mon, 01 Jan 2024 00:00:00 GMT'
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """Serves /etag, /modified and /plain, recording when each request arrived"""
+
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((self.path, time.monotonic(), self.headers))
+        headers = {}
+        if self.path == '/etag':
+            headers['ETag'] = '"v1"'
+            if self.headers.get('If-None-Match') == '"v1"':
+                return self.reply(304, headers)
+        elif self.path == '/modified':
+            headers['Last-Modified'] = LAST_MODIFIED
+            if self.headers.get('If-Modified-Since') == LAST_MODIFIED:
+                return self.reply(304, headers)
+        self.reply(200, headers, PAGE.encode('utf-8'))
+
+    def reply(self, status, headers, body=b''):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def server():
+    FixtureHandler.requests = []
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+def sources(base):
+    return [{'jurisdiction': 'Berkeley', 'category': 'Egress', 'url': f"{base}/{path}"}
+            for path in ('etag', 'modified', 'plain')]
+
+def test_recrawl_skips_unchanged_pages_and_persists_state(server, tmp_path):
+    state_path = str(tmp_path / '.cache' / 'crawler_state.json')
+
+    crawler = Crawler(per_host_interval=0, state_path=state_path)
+    records = asyncio.run(crawler.crawl(sources(server)))
+    assert [record['section'] for record in records] == ['1011.2'] * 3
+    assert crawler.stats == {'fetched': 3, 'not_modified': 0, 'unchanged': 0, 'failed': 0}
+    crawler.save_state()
+
+    with open(state_path) as f:
+        state = json.load(f)
+    assert state[f"{server}/etag"]['etag'] == '"v1"'
+    assert state[f"{server}/modified"]['last_modified'] == LAST_MODIFIED
+    assert len({entry['content_hash'] for entry in state.values()}) == 1
+
+    # A fresh crawler picks the validators and hashes up from disk
+    recrawler = Crawler(per_host_interval=0, state_path=state_path)
+    assert asyncio.run(recrawler.crawl(sources(server))) == []
+    assert recrawler.stats == {'fetched': 0, 'not_modified': 2, 'unchanged': 1, 'failed': 0}
+    conditional = {path: headers for path, _, headers in FixtureHandler.requests[3:]}
+    assert conditional['/etag']['If-None-Match'] == '"v1"'
+    assert conditional['/modified']['If-Modified-Since'] == LAST_MODIFIED
+
+def test_requests_to_one_host_are_spaced_out(server, tmp_path):
+    crawler = Crawler(per_host_interval=0.2, state_path=str(tmp_path / 'crawler_state.json'))
+    asyncio.run(crawler.crawl(sources(server)))
+    arrivals = sorted(arrived for _, arrived, _ in FixtureHandler.requests)
+    assert len(arrivals) == 3
+    assert all(later - earlier >= 0.18 for earlier, later in zip(arrivals, arrivals[1:]))
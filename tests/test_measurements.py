@@ -0,0 +1,56 @@
+import pytest
+from database import content_hash
+from utils import measurements
+from utils.measurements import parse_measurements
+from utils.sqlite_backend import load_tables, open_snapshot
+
+def values(text):
+    return [(m['quantity'], m['value'], m['raw']) for m in parse_measurements(text)]
+
+@pytest.mark.parametrize('text, value, raw', [
+    ("Doors shall have a minimum clear width of 3 ft 6 in.", 42.0, '3 ft 6 in.'),
+    ("Guards shall be 3 feet 6 inches high.", 42.0, '3 feet 6 inches'),
+    ("Aisles shall be 3 feet and 6 inches wide.", 42.0, '3 feet and 6 inches'),
+    ("Headroom shall be not less than 6'-8\" above the tread.", 80.0, '6\'-8"'),
+    ("A 6' 8\" door is required.", 80.0, '6\' 8"'),
+    ("Landings shall be 5 ft 2-1/2 in long.", 62.5, '5 ft 2-1/2 in'),
+])
+def test_feet_and_inches_are_one_length(text, value, raw):
+    assert values(text) == [('length', value, raw)]
+
+def test_compound_length_keeps_its_context():
+    [measurement] = parse_measurements("Doors shall have a minimum clear width of 3 ft 6 in.")
+    assert (measurement['bound'], measurement['attribute'], measurement['modal']) == ('min', 'width', 'shall')
+
+def test_separate_lengths_stay_separate():
+    assert values("Stairs shall be 36 in wide and 10 ft long.") == [
+        ('length', 36.0, '36 in'), ('length', 120.0, '10 ft')
+    ]
+    assert values("Handrails shall be 34 in. to 38 in. above the nosing.") == [
+        ('length', 34.0, '34 in.'), ('length', 38.0, '38 in.')
+    ]
+
+def test_other_quantities_are_unchanged():
+    assert values("Rooms of at least 1,000 sq ft shall have 50% glazing.") == [
+        ('area', 1000.0, '1,000 sq ft'), ('percent', 50.0, '50%')
+    ]
+
+def test_texts_parsed_once_even_without_measurements(tmp_path, monkeypatch):
+    texts = ["Stairs shall be 36 in wide.", "Permits shall be posted on site.", "Guards are required."]
+    hashes = [content_hash(text) for text in texts]
+    path = str(tmp_path / 'snapshot.sqlite3')
+    load_tables(path, [
+        ('code_contents', [{'content_hash': digest, 'content': text} for digest, text in zip(hashes, texts)]),
+        ('building_codes', [{'id': i, 'jurisdiction': 'Berkeley', 'category': 'Egress', 'section': f'10{i}',
+                             'content_hash': digest} for i, digest in enumerate(hashes)]),
+        ('code_measurements', [dict(m, content_hash=hashes[0]) for m in parse_measurements(texts[0])]),
+        # The second text was parsed and has no measurements; the third was never parsed
+        ('measured_texts', [{'content_hash': hashes[0]}, {'content_hash': hashes[1]}]),
+    ])
+    db = open_snapshot(path)
+
+    parsed = []
+    monkeypatch.setattr(measurements, 'parse_measurements', lambda text: parsed.append(text) or [])
+    loaded = measurements.load_measurements(db, db.get_building_codes())
+    assert parsed == [texts[2]]
+    assert [m['raw'] for m in loaded[hashes[0]]] == ['36 in']
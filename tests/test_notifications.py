@@ -0,0 +1,118 @@
+from datetime import date
+from utils.notifications import NotificationDispatcher, OutboxTransport, SubscriptionIndex
+
+class FakeTracker:
+    """In-memory stand-in for the CodeTracker methods the dispatcher uses"""
+
+    def __init__(self, subscriptions):
+        self.subscriptions = subscriptions
+        self.updates = {}
+        self.watermarks = {}
+        self.gaps = {}
+        self.scanned = []
+
+    def add_update(self, update_id, jurisdiction, category, section='101.1'):
+        self.updates[update_id] = {
+            'id': update_id, 'jurisdiction': jurisdiction, 'category': category, 'section': section,
+            'change_type': 'modified', 'version_number': '2024', 'update_date': date(2024, 1, 1)
+        }
+
+    def get_all_subscriptions(self):
+        return self.subscriptions
+
+    def get_watermark(self, name):
+        return self.watermarks.get(name, 0)
+
+    def get_open_gaps(self, name):
+        return set(self.gaps.get(name, ()))
+
+    def get_code_updates_after(self, last_update_id, limit=1000):
+        updates = [self.updates[i] for i in sorted(self.updates) if i > last_update_id][:limit]
+        self.scanned.extend(update['id'] for update in updates)
+        return updates
+
+    def get_code_updates_by_ids(self, update_ids):
+        updates = [self.updates[i] for i in sorted(update_ids) if i in self.updates]
+        self.scanned.extend(update['id'] for update in updates)
+        return updates
+
+    def set_watermark(self, name, last_update_id, opened_gaps=(), closed_gaps=(), gap_timeout=None):
+        self.watermarks[name] = max(self.watermarks.get(name, 0), last_update_id)
+        self.gaps[name] = (self.gaps.get(name, set()) | set(opened_gaps)) - set(closed_gaps)
+
+def subscription(email, jurisdiction=None, category=None):
+    return {'user_email': email, 'jurisdiction': jurisdiction, 'category': category}
+
+def sent_to(transport):
+    """Map each recipient to the update lines of the digest they received"""
+    received = {}
+    for message, recipients in transport.sent:
+        lines = [line for line in message.get_content().splitlines() if line.startswith('- ')]
+        for email in recipients:
+            received.setdefault(email, []).extend(lines)
+    return received
+
+def test_subscription_wildcards_match_case_insensitively():
+    index = SubscriptionIndex([
+        subscription('exact@example.com', 'Berkeley', 'Fire Safety'),
+        subscription('city@example.com', 'berkeley'),
+        subscription('topic@example.com', category='fire safety'),
+        subscription('all@example.com'),
+        subscription('other@example.com', 'Oakland', 'Fire Safety'),
+    ])
+    assert index.match('BERKELEY', 'Fire Safety') == {
+        'exact@example.com', 'city@example.com', 'topic@example.com', 'all@example.com'
+    }
+    assert index.match('Oakland', None) == {'all@example.com'}
+
+def test_dispatch_groups_identical_digests_and_delivers_once():
+    tracker = FakeTracker([
+        subscription('a@example.com', 'Berkeley'),
+        subscription('b@example.com', 'Berkeley'),
+        subscription('c@example.com', category='Plumbing'),
+        subscription('d@example.com', 'Oakland'),
+    ])
+    tracker.add_update(1, 'Berkeley', 'Structural')
+    tracker.add_update(2, 'Berkeley', 'Plumbing')
+    tracker.add_update(3, 'Oakland', 'Plumbing')
+    transport = OutboxTransport()
+    dispatcher = NotificationDispatcher(tracker, transport=transport)
+
+    result = dispatcher.dispatch()
+
+    assert result['updates'] == 3
+    # a and b matched the same subscription key, so they share one digest
+    assert result['digests'] == 3
+    assert sorted(sorted(recipients) for _, recipients in transport.sent) == [
+        ['a@example.com', 'b@example.com'], ['c@example.com'], ['d@example.com']
+    ]
+    received = sent_to(transport)
+    assert len(received['a@example.com']) == 2
+    assert len(received['c@example.com']) == 2
+    assert len(received['d@example.com']) == 1
+
+    scanned = list(tracker.scanned)
+    assert dispatcher.dispatch()['updates'] == 0
+    assert len(transport.sent) == 3
+    assert tracker.scanned == scanned
+
+def test_late_committed_update_is_delivered_once():
+    tracker = FakeTracker([subscription('all@example.com')])
+    tracker.add_update(1, 'Berkeley', 'Structural')
+    transport = OutboxTransport()
+    dispatcher = NotificationDispatcher(tracker, transport=transport)
+    dispatcher.dispatch()
+
+    # Update 3 commits before update 2, whose transaction is still open
+    tracker.add_update(3, 'Berkeley', 'Structural')
+    assert dispatcher.dispatch()['open_gaps'] == 1
+    assert tracker.gaps['notification_digest'] == {2}
+
+    tracker.add_update(2, 'Oakland', 'Plumbing')
+    result = dispatcher.dispatch()
+    assert (result['updates'], result['open_gaps']) == (1, 0)
+    assert 'Oakland' in sent_to(transport)['all@example.com'][-1]
+
+    assert dispatcher.dispatch()['updates'] == 0
+    assert len(transport.sent) == 3
+    assert sorted(tracker.scanned) == [1, 2, 3]
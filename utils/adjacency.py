@@ -0,0 +1,186 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+import threading
+import weakref
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+from database import Database, corpus_fingerprint
+from utils.instrumentation import traced
+from utils.nlp_processor import get_nlp
+
+DEFAULT_NEIGHBOURS_PATH = os.environ.get('JURISDICTION_NEIGHBOURS', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'jurisdiction_neighbours.csv'
+))
+# Boundary coordinates are compared after rounding to this many decimal places (about 10 cm)
+COORDINATE_PRECISION = 6
+# Sections listing the strongest divergences of each neighbouring pair
+TOP_SECTIONS = 3
+
+def _boundary_vertices(geometry: Dict, precision: int) -> set:
+    polygons = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+    return {(round(x, precision), round(y, precision))
+            for polygon in polygons for ring in polygon for x, y, *_ in ring}
+
+def _boundary_edges(collection: Dict, precision: int = COORDINATE_PRECISION) -> List[Tuple[str, str]]:
+    """Jurisdictions whose boundaries share at least two vertices, i.e. a stretch of border, not a corner"""
+    owners: Dict[tuple, List[str]] = {}
+    for feature in collection['features']:
+        properties = feature.get('properties') or {}
+        name = properties.get('jurisdiction') or properties.get('name') or properties.get('NAME')
+        if name and feature.get('geometry'):
+            for vertex in _boundary_vertices(feature['geometry'], precision):
+                owners.setdefault(vertex, []).append(name)
+    shared = Counter()
+    for names in owners.values():
+        names = sorted(set(names))
+        for i, first in enumerate(names):
+            for second in names[i + 1:]:
+                shared[(first, second)] += 1
+    return [pair for pair, count in shared.items() if count >= 2]
+
+def load_neighbour_file(path: str) -> List[Tuple[str, str]]:
+    """Neighbouring pairs from a CSV of (jurisdiction, neighbour) rows, a JSON mapping of
+    jurisdiction to neighbours, or GeoJSON boundaries"""
+    if path.endswith(('.geojson', '.geo.json')):
+        with open(path) as f:
+            return _boundary_edges(json.load(f))
+    if path.endswith('.json'):
+        with open(path) as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            return [(name, neighbour) for name, neighbours in data.items() for neighbour in neighbours]
+        return [tuple(pair) for pair in data]
+    with open(path, newline='') as f:
+        rows = [row for row in csv.reader(f) if len(row) >= 2 and row[0].strip()]
+    if rows and rows[0][0].strip().lower() == 'jurisdiction':
+        rows = rows[1:]
+    return [(row[0].strip(), row[1].strip()) for row in rows]
+
+class AdjacencyGraph:
+    """Undirected graph of neighbouring jurisdictions"""
+
+    def __init__(self, edges: Iterable[Tuple[str, str]]):
+        self.edges = sorted({tuple(sorted(edge)) for edge in edges if edge[0] != edge[1]})
+        self.neighbours: Dict[str, List[str]] = {}
+        for first, second in self.edges:
+            self.neighbours.setdefault(first, []).append(second)
+            self.neighbours.setdefault(second, []).append(first)
+        self.fingerprint = hashlib.sha256('\n'.join(f"{a}\t{b}" for a, b in self.edges).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def from_file(cls, path: str = DEFAULT_NEIGHBOURS_PATH) -> 'AdjacencyGraph':
+        return cls(load_neighbour_file(path))
+
+    def resolve(self, jurisdictions: Iterable[str]) -> 'AdjacencyGraph':
+        """The graph renamed to the stored jurisdiction names, matched ignoring case; unknown names drop out"""
+        names = {name.casefold(): name for name in jurisdictions}
+        return AdjacencyGraph((names[a.casefold()], names[b.casefold()]) for a, b in self.edges
+                              if a.casefold() in names and b.casefold() in names)
+
+@traced('adjacency.edge_divergence')
+def edge_divergence(graph: AdjacencyGraph, codes: List[Dict], contents: Dict[str, str]) -> List[Dict]:
+    """Divergence of every neighbouring pair over one category's sections, most divergent first.
+
+    A section both jurisdictions have scores 1 - text similarity; a section only one of them has
+    scores 1. A pair's divergence is the mean over the sections either of them has. Every
+    differing text pair across all edges is scored in one vectorized similarity pass.
+    """
+    sections: Dict[str, Dict[str, str]] = {}
+    for code in codes:
+        sections.setdefault(code['jurisdiction'], {})[code['section']] = code['content_hash']
+    edges = [(a, b) for a, b in graph.edges if a in sections and b in sections]
+
+    pairs = {}
+    for a, b in edges:
+        for section in sections[a].keys() & sections[b].keys():
+            hashes = tuple(sorted((sections[a][section], sections[b][section])))
+            if hashes[0] != hashes[1]:
+                pairs.setdefault(hashes, None)
+    scores = get_nlp().calculate_similarities([(contents.get(h1) or '', contents.get(h2) or '') for h1, h2 in pairs])
+    similarity = dict(zip(pairs, scores))
+
+    results = []
+    for a, b in edges:
+        divergences = {}
+        for section in sections[a].keys() | sections[b].keys():
+            hash1, hash2 = sections[a].get(section), sections[b].get(section)
+            if hash1 is None or hash2 is None:
+                divergences[section] = 1.0
+            elif hash1 != hash2:
+                divergences[section] = max(0.0, 1.0 - similarity[tuple(sorted((hash1, hash2)))])
+        total = len(sections[a].keys() | sections[b].keys())
+        strongest = sorted(divergences.items(), key=lambda item: (-item[1], item[0]))[:TOP_SECTIONS]
+        results.append({
+            'jurisdiction1': a, 'jurisdiction2': b,
+            'divergence': sum(divergences.values()) / total if total else 0.0,
+            'sections': total,
+            'differing': len(divergences),
+            'top_sections': [{'section': section, 'divergence': score} for section, score in strongest]
+        })
+    return sorted(results, key=lambda row: (-row['divergence'], row['jurisdiction1'], row['jurisdiction2']))
+
+def jurisdiction_hotspots(edges: List[Dict]) -> List[Dict]:
+    """Jurisdictions ranked by how far their codes diverge from their neighbours', on average"""
+    by_jurisdiction: Dict[str, List[Dict]] = {}
+    for edge in edges:
+        by_jurisdiction.setdefault(edge['jurisdiction1'], []).append(edge)
+        by_jurisdiction.setdefault(edge['jurisdiction2'], []).append(edge)
+    hotspots = []
+    for jurisdiction, own in by_jurisdiction.items():
+        strongest = max(own, key=lambda edge: edge['divergence'])
+        hotspots.append({
+            'jurisdiction': jurisdiction,
+            'divergence': sum(edge['divergence'] for edge in own) / len(own),
+            'neighbours': len(own),
+            'most_divergent_neighbour': strongest['jurisdiction2'] if strongest['jurisdiction1'] == jurisdiction
+                                        else strongest['jurisdiction1']
+        })
+    return sorted(hotspots, key=lambda row: (-row['divergence'], row['jurisdiction']))
+
+_results = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+@traced('adjacency.hotspots')
+def get_hotspots(db: Database, graph: AdjacencyGraph, category: str) -> List[Dict]:
+    """Ranked neighbour divergence for a category, cached until the graph or the category's sections change"""
+    graph = graph.resolve(db.get_jurisdictions())
+    codes = [code for code in db.get_building_codes() if (code['category'] or '').lower() == category.lower()]
+    key = (graph.fingerprint, category.lower())
+    fingerprint = corpus_fingerprint(codes)
+    with _lock:
+        cached = _results.setdefault(db, {}).get(key)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+    edges = edge_divergence(graph, codes, db.get_contents(code['content_hash'] for code in codes))
+    with _lock:
+        _results[db][key] = (fingerprint, edges)
+    return edges
+
+if __name__ == '__main__':
+    import time
+
+    parser = argparse.ArgumentParser(description="Rank code divergence between neighbouring jurisdictions")
+    parser.add_argument('--neighbours', default=DEFAULT_NEIGHBOURS_PATH,
+                        help="CSV of (jurisdiction, neighbour) pairs, JSON mapping or GeoJSON boundaries")
+    parser.add_argument('--snapshot', help="Read a SQLite snapshot instead of Postgres")
+    parser.add_argument('--category', action='append', help="Repeat for several categories (default: all)")
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.snapshot:
+        from utils.sqlite_backend import open_snapshot
+        db = open_snapshot(args.snapshot)
+    else:
+        db = Database()
+    graph = AdjacencyGraph.from_file(args.neighbours)
+    for category in args.category or db.get_categories():
+        start = time.perf_counter()
+        edges = get_hotspots(db, graph, category)
+        print(f"{category}: {len(edges)} neighbouring pairs in {time.perf_counter() - start:.2f}s")
+        for edge in edges[:args.top]:
+            sections = ', '.join(row['section'] for row in edge['top_sections'])
+            print(f"  {edge['divergence']:.3f}  {edge['jurisdiction1']} / {edge['jurisdiction2']}  "
+                  f"({edge['differing']} of {edge['sections']} sections differ; most: {sections})")
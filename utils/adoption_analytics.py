@@ -0,0 +1,107 @@
+import threading
+from typing import Dict, Optional
+import pandas as pd
+from utils.instrumentation import traced
+
+# California publishes its model codes every three years (2019, 2022, 2025, ...), and each
+# edition takes effect statewide on January 1 of the following year
+CYCLE_YEARS = 3
+BASE_CYCLE = 2019
+# Local ordinances are often adopted a few months ahead of the statewide date
+EARLY_ADOPTION_WINDOW = pd.Timedelta(days=180)
+# Jurisdictions within a month of the cycle's median adoption count as on pace
+ON_PACE_DAYS = 30
+
+def assign_cycles(effective_dates: pd.Series) -> pd.Series:
+    """Map each effective date to the template cycle (edition year) it adopts"""
+    year = (pd.to_datetime(effective_dates) + EARLY_ADOPTION_WINDOW).dt.year - 1
+    return year - (year - BASE_CYCLE) % CYCLE_YEARS
+
+def template_dates(cycles: pd.Series) -> pd.Series:
+    """Statewide effective date of each cycle's template"""
+    return pd.to_datetime((cycles + 1).astype(str) + '-01-01')
+
+@traced('analysis.compute_adoption')
+def compute_adoption(versions: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """Adoption lag, per-version modification counts and lead/lag rankings for all versions at once.
+
+    ``versions`` has one row per code version, as returned by CodeTracker.get_version_history.
+    Returns ``versions`` (per version), ``adoption`` (per jurisdiction and cycle) and ``rankings``
+    (per jurisdiction, ordered from earliest to latest adopter).
+    """
+    if versions.empty:
+        return {'versions': versions, 'adoption': pd.DataFrame(), 'rankings': pd.DataFrame()}
+
+    versions = versions.copy()
+    versions['effective_date'] = pd.to_datetime(versions['effective_date'])
+    versions = versions.sort_values(['jurisdiction', 'effective_date', 'id'], ignore_index=True)
+    versions['cycle'] = assign_cycles(versions['effective_date'])
+    versions['template_date'] = template_dates(versions['cycle'])
+    versions['lag_days'] = (versions['effective_date'] - versions['template_date']).dt.days
+    versions['days_since_previous'] = versions.groupby('jurisdiction')['effective_date'].diff().dt.days
+
+    # The first version in a cycle is the adoption; later ones are local amendments
+    adoption = versions.groupby(['jurisdiction', 'cycle'], as_index=False).agg(
+        adopted_on=('effective_date', 'min'),
+        template_date=('template_date', 'first'),
+        lag_days=('lag_days', 'min'),
+        versions=('id', 'size'),
+        modifications=('update_count', 'sum'),
+        added=('added_count', 'sum'),
+        modified=('modified_count', 'sum'),
+        deleted=('deleted_count', 'sum')
+    )
+    adoption['amendments'] = adoption['versions'] - 1
+    by_cycle = adoption.groupby('cycle')['lag_days']
+    adoption['rank'] = by_cycle.rank(method='min').astype(int)
+    adoption['relative_lag_days'] = adoption['lag_days'] - by_cycle.transform('median')
+
+    rankings = adoption.groupby('jurisdiction', as_index=False).agg(
+        cycles=('cycle', 'size'),
+        mean_lag_days=('lag_days', 'mean'),
+        mean_relative_lag_days=('relative_lag_days', 'mean'),
+        median_rank=('rank', 'median'),
+        modifications=('modifications', 'sum')
+    ).sort_values(['mean_relative_lag_days', 'jurisdiction'], ignore_index=True)
+    rankings['position'] = rankings['mean_relative_lag_days'].rank(method='min').astype(int)
+    rankings['status'] = pd.cut(
+        rankings['mean_relative_lag_days'], [-float('inf'), -ON_PACE_DAYS, ON_PACE_DAYS, float('inf')],
+        labels=['Leads', 'On pace', 'Lags']
+    ).astype(str)
+
+    return {'versions': versions, 'adoption': adoption, 'rankings': rankings}
+
+class AdoptionAnalytics:
+    """Cached adoption-cycle analytics, recomputed after versions or updates are recorded.
+
+    Invalidation comes from the CodeTracker's version listeners, and from the change feed when
+    other processes record versions.
+    """
+
+    def __init__(self, code_tracker, change_feed=None):
+        self.code_tracker = code_tracker
+        self._results: Optional[Dict[str, pd.DataFrame]] = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        code_tracker.add_version_listener(self.invalidate)
+        if change_feed is not None:
+            change_feed.subscribe(self.invalidate)
+
+    def invalidate(self, event=None):
+        if isinstance(event, dict) and event.get('table') not in (None, 'code_versions', 'code_updates'):
+            return
+        with self._lock:
+            self._generation += 1
+            self._results = None
+
+    def get(self) -> Dict[str, pd.DataFrame]:
+        with self._lock:
+            if self._results is not None:
+                return self._results
+            generation = self._generation
+        results = compute_adoption(pd.DataFrame(self.code_tracker.get_version_history()))
+        with self._lock:
+            # Skip the store if an invalidation raced with the load
+            if generation == self._generation:
+                self._results = results
+        return results
@@ -0,0 +1,514 @@
+import argparse
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+from database import Database
+from utils import instrumentation
+from utils.code_tracker import CodeTracker
+
+# Responses kept in memory across all clients, bounded by their encoded size
+RESPONSE_CACHE_BYTES = 64 * 1024 * 1024
+# Bodies smaller than this aren't worth compressing
+GZIP_MIN_BYTES = 1024
+# Upper bound on section pairs analyzed by one request
+MAX_COMPARISONS = 5000
+# Endpoints that report live process state rather than corpus data
+UNCACHED_PATHS = {'/health'}
+# Tables whose changes can alter an API response
+DATA_TABLES = {None, 'building_codes', 'code_contents', 'code_versions', 'code_updates', 'code_references',
+               'code_measurements'}
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+class DataVersion:
+    """Token naming the current state of the corpus, used as the ETag prefix and cache key.
+
+    Snapshots never change, so their token comes from the snapshot itself. Against Postgres
+    the token counts change-feed events, and is None (no caching) while the feed is disconnected.
+    """
+
+    def __init__(self, db: Database, change_feed=None):
+        self.db = db
+        self.change_feed = change_feed
+        self._boot = uuid.uuid4().hex[:8]
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._static = None
+        if db.backend.immutable:
+            meta = db.backend.meta() if hasattr(db.backend, 'meta') else {}
+            self._static = hashlib.sha256(json.dumps(meta, sort_keys=True).encode()).hexdigest()[:12]
+        if change_feed is not None:
+            change_feed.subscribe(self.bump)
+
+    def bump(self, event=None):
+        if isinstance(event, dict) and event.get('table') not in DATA_TABLES:
+            return
+        with self._lock:
+            self._generation += 1
+
+    def current(self) -> Optional[str]:
+        if self._static is not None:
+            return self._static
+        if self.change_feed is None or not self.change_feed.connected.is_set():
+            return None
+        with self._lock:
+            return f"{self._boot}.{self._generation}"
+
+class ResponseCache:
+    """Process-wide LRU of encoded responses, shared by every client and handler thread"""
+
+    def __init__(self, max_bytes: int = RESPONSE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry: Dict):
+        size = len(entry['body']) + len(entry.get('gzip') or b'')
+        if size > self.max_bytes // 4:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous['size']
+            entry['size'] = size
+            self._entries[key] = entry
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted['size']
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._size, 'hits': self.hits, 'misses': self.misses}
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=str)
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+def encode_json(payload) -> bytes:
+    return json.dumps(payload, default=_json_default, separators=(',', ':')).encode('utf-8')
+
+def _param(query: Dict[str, List[str]], name: str, default=None, required: bool = False):
+    values = query.get(name)
+    if not values:
+        if required:
+            raise ApiError(400, f"Missing query parameter: {name}")
+        return default
+    return values[0]
+
+def _int_param(query, name: str, default: int, maximum: int) -> int:
+    try:
+        return max(0, min(maximum, int(_param(query, name, default))))
+    except ValueError:
+        raise ApiError(400, f"{name} must be an integer")
+
+def _float_param(query, name: str) -> Optional[float]:
+    try:
+        value = _param(query, name)
+        return float(value) if value is not None else None
+    except ValueError:
+        raise ApiError(400, f"{name} must be a number")
+
+def _flag(query, name: str) -> bool:
+    return _param(query, name, 'false').lower() in ('1', 'true', 'yes')
+
+class CodeApi:
+    """Read-only JSON endpoints over Database, CodeTracker and the policy analysis functions"""
+
+    def __init__(self, db: Database, code_tracker: CodeTracker, version: DataVersion,
+                 cache: Optional[ResponseCache] = None):
+        self.db = db
+        self.code_tracker = code_tracker
+        self.version = version
+        self.cache = cache or ResponseCache()
+        self.routes: Dict[Tuple[str, str], Callable] = {
+            ('GET', '/health'): self.health,
+            ('GET', '/jurisdictions'): lambda query: self.db.get_jurisdictions(),
+            ('GET', '/categories'): lambda query: self.db.get_categories(),
+            ('GET', '/codes'): self.codes,
+            ('GET', '/search'): self.search,
+            ('GET', '/updates'): self.updates,
+            ('GET', '/compare'): self.compare,
+            ('POST', '/compare'): self.compare_pairs,
+            ('GET', '/similar'): self.similar,
+            ('GET', '/align'): self.align,
+            ('GET', '/references/standard'): self.standard_dependents,
+            ('GET', '/references/impact'): self.impact_radius,
+            ('GET', '/references/standards'): self.top_standards,
+            ('GET', '/measurements'): self.measurements,
+            ('GET', '/measurements/by-jurisdiction'): self.measurements_by_jurisdiction,
+            ('GET', '/measurements/discrepancies'): self.measurement_discrepancies,
+            ('GET', '/hotspots'): self.hotspots
+        }
+        # State outside the database that a route's response also depends on, folded into its cache key
+        self.route_inputs: Dict[str, Callable[[], str]] = {'/hotspots': self.neighbour_file_state}
+
+    def health(self, query):
+        return {'status': 'ok', 'data_version': self.version.current(), 'cache': self.cache.stats()}
+
+    def codes(self, query):
+        jurisdiction = _param(query, 'jurisdiction')
+        category = _param(query, 'category')
+        codes = self.db.get_building_codes(jurisdiction, with_content=_flag(query, 'content'))
+        if category:
+            codes = [code for code in codes if (code['category'] or '').lower() == category.lower()]
+        return codes
+
+    def search(self, query):
+        term = _param(query, 'q', required=True).lower()
+        limit = _int_param(query, 'limit', 100, 1000)
+        jurisdictions = query.get('jurisdiction') or self.db.get_jurisdictions()
+        results = []
+        for jurisdiction in jurisdictions:
+            codes = self.db.get_building_codes(jurisdiction)
+            # Match each distinct text once, however many sections share it
+            contents = self.db.get_contents(code['content_hash'] for code in codes)
+            matching = {digest: content for digest, content in contents.items() if term in content.lower()}
+            for code in codes:
+                content = matching.get(code['content_hash'])
+                if content is not None:
+                    start = max(0, content.lower().index(term) - 80)
+                    results.append(dict(code, snippet=content[start:start + len(term) + 160]))
+                    if len(results) >= limit:
+                        return results
+        return results
+
+    def updates(self, query):
+        filters = {
+            'jurisdiction': _param(query, 'jurisdiction'),
+            'category': _param(query, 'category'),
+            'from_date': _param(query, 'from_date')
+        }
+        return {
+            'total': self.code_tracker.count_code_updates(**filters),
+            'updates': self.code_tracker.get_code_updates(
+                limit=_int_param(query, 'limit', 100, 1000), offset=_int_param(query, 'offset', 0, 10 ** 9), **filters
+            )
+        }
+
+    def similar(self, query):
+        """Sections closest in content to the code with the given id"""
+        code_id = _int_param(query, 'id', 0, 2 ** 63)
+        code = next((code for code in self.db.get_building_codes() if code['id'] == code_id), None)
+        if code is None:
+            raise ApiError(404, f"No code with id {code_id}")
+        from utils.semantic_index import get_semantic_index
+        exclude = None if _flag(query, 'same_jurisdiction') else code['jurisdiction']
+        similar = get_semantic_index(self.db).more_like_this(
+            code['content_hash'], _int_param(query, 'k', 10, 100), exclude_jurisdiction=exclude
+        )
+        return [dict(match, score=score) for match, score in similar]
+
+    def align(self, query):
+        """Pair the sections of two jurisdictions by content, flagging renumbered ones"""
+        jurisdictions = query.get('jurisdiction') or []
+        if len(jurisdictions) != 2:
+            raise ApiError(400, "Pass exactly two jurisdiction parameters")
+        from utils.semantic_index import MIN_ALIGNMENT_SCORE, get_semantic_index
+        try:
+            min_score = float(_param(query, 'min_score', MIN_ALIGNMENT_SCORE))
+        except ValueError:
+            raise ApiError(400, "min_score must be a number")
+        return get_semantic_index(self.db).align_sections(
+            jurisdictions[0], jurisdictions[1], _param(query, 'category'), min_score
+        )
+
+    def _reference_graph(self):
+        from utils.reference_graph import get_reference_graph
+        return get_reference_graph(self.db)
+
+    def _max_depth(self, query) -> Optional[int]:
+        return _int_param(query, 'max_depth', None, 100) if _param(query, 'max_depth') else None
+
+    def standard_dependents(self, query):
+        """Sections depending on a standard, directly or through sections that cite it"""
+        return self._reference_graph().dependents_of_standard(
+            _param(query, 'standard', required=True), _param(query, 'jurisdiction'), self._max_depth(query)
+        )
+
+    def impact_radius(self, query):
+        """Sections that cite a section, directly or transitively"""
+        return self._reference_graph().impact_radius(
+            _param(query, 'jurisdiction', required=True), _param(query, 'section', required=True),
+            self._max_depth(query)
+        )
+
+    def top_standards(self, query):
+        return self._reference_graph().top_standards(_param(query, 'jurisdiction'), _int_param(query, 'limit', 10, 1000))
+
+    def _measurement_index(self):
+        from utils.measurements import get_measurement_index
+        return get_measurement_index(self.db)
+
+    def measurements(self, query):
+        """Measurements within a normalized range (inches, square feet or percent), smallest first"""
+        return self._measurement_index().range_query(
+            _param(query, 'attribute'), _param(query, 'quantity'), _float_param(query, 'low'),
+            _float_param(query, 'high'), _param(query, 'bound'), _param(query, 'subject'),
+            query.get('jurisdiction'), _int_param(query, 'limit', 500, 10000)
+        )
+
+    def measurements_by_jurisdiction(self, query):
+        return self._measurement_index().by_jurisdiction(
+            _param(query, 'attribute'), _param(query, 'quantity'), _param(query, 'bound'),
+            _param(query, 'subject'), query.get('jurisdiction')
+        )
+
+    def measurement_discrepancies(self, query):
+        return self._measurement_index().discrepancies(
+            query.get('jurisdiction'), _param(query, 'category'), _param(query, 'section'), _param(query, 'attribute')
+        )
+
+    @staticmethod
+    def neighbour_file_state() -> str:
+        from utils.adjacency import DEFAULT_NEIGHBOURS_PATH
+        try:
+            stat = os.stat(DEFAULT_NEIGHBOURS_PATH)
+        except FileNotFoundError:
+            return 'missing'
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+    def hotspots(self, query):
+        """Neighbouring jurisdictions ranked by how far their codes in a category diverge"""
+        from utils.adjacency import DEFAULT_NEIGHBOURS_PATH, AdjacencyGraph, get_hotspots, jurisdiction_hotspots
+        try:
+            graph = AdjacencyGraph.from_file(DEFAULT_NEIGHBOURS_PATH)
+        except FileNotFoundError:
+            raise ApiError(404, "No neighbour file configured")
+        limit = _int_param(query, 'limit', 50, 10000)
+        edges = get_hotspots(self.db, graph, _param(query, 'category', required=True))
+        return {'pairs': edges[:limit], 'jurisdictions': jurisdiction_hotspots(edges)[:limit]}
+
+    def _analyze(self, code1: str, code2: str, jurisdiction1: str, jurisdiction2: str, detail: bool) -> Dict:
+        from components.policy_recommendations import analyze_pair
+        result = analyze_pair(code1, code2, jurisdiction1, jurisdiction2)
+        summary = {
+            'similarity_score': result['analysis']['similarity_score'],
+            'impact_score': result['impact_score'],
+            'recommendations': result['recommendations']
+        }
+        if detail:
+            summary['analysis'] = result['analysis']
+            summary['citation_analysis'] = result['citation_analysis']
+        return summary
+
+    def compare(self, query):
+        """Analyze every section the given jurisdictions share, pair by pair"""
+        jurisdictions = query.get('jurisdiction') or []
+        if len(jurisdictions) < 2:
+            raise ApiError(400, "Pass at least two jurisdiction parameters")
+        category = (_param(query, 'category') or '').lower()
+        section = _param(query, 'section')
+        limit = _int_param(query, 'limit', 500, MAX_COMPARISONS)
+        detail = _flag(query, 'detail')
+
+        sections = {}
+        for jurisdiction in jurisdictions:
+            sections[jurisdiction] = {
+                ((code['category'] or '').lower(), code['section']): code
+                for code in self.db.get_building_codes(jurisdiction)
+                if (not category or (code['category'] or '').lower() == category)
+                and (not section or code['section'] == section)
+            }
+        pairs = []
+        for jurisdiction1, jurisdiction2 in itertools.combinations(jurisdictions, 2):
+            for key in sorted(sections[jurisdiction1].keys() & sections[jurisdiction2].keys()):
+                pairs.append((jurisdiction1, jurisdiction2, sections[jurisdiction1][key], sections[jurisdiction2][key]))
+        pairs = pairs[:limit]
+        contents = self.db.get_contents(code['content_hash'] for pair in pairs for code in pair[2:])
+
+        results = []
+        for jurisdiction1, jurisdiction2, code1, code2 in pairs:
+            result = {'jurisdiction1': jurisdiction1, 'jurisdiction2': jurisdiction2,
+                      'category': code1['category'], 'section': code1['section']}
+            result.update(self._analyze(contents.get(code1['content_hash']) or '',
+                                        contents.get(code2['content_hash']) or '',
+                                        jurisdiction1, jurisdiction2, detail))
+            results.append(result)
+        return results
+
+    def compare_pairs(self, query, body):
+        """Analyze a batch of explicit pairs, given as texts or as (jurisdiction, category, section)"""
+        items = body.get('pairs') if isinstance(body, dict) else None
+        if not isinstance(items, list):
+            raise ApiError(400, 'Body must be {"pairs": [...]}')
+        if len(items) > MAX_COMPARISONS:
+            raise ApiError(400, f"At most {MAX_COMPARISONS} pairs per request")
+        detail = bool(body.get('detail'))
+
+        lookup = {}
+        for item in items:
+            if not isinstance(item, dict):
+                raise ApiError(400, "Each pair must be a JSON object")
+            if 'code1' not in item:
+                for side in ('1', '2'):
+                    jurisdiction = item.get('jurisdiction' + side)
+                    if jurisdiction and jurisdiction not in lookup:
+                        lookup[jurisdiction] = {
+                            ((code['category'] or '').lower(), code['section']): code['content_hash']
+                            for code in self.db.get_building_codes(jurisdiction)
+                        }
+        contents = self.db.get_contents(digest for codes in lookup.values() for digest in codes.values())
+
+        results = []
+        for item in items:
+            jurisdiction1, jurisdiction2 = item.get('jurisdiction1') or 'Code 1', item.get('jurisdiction2') or 'Code 2'
+            if 'code1' in item:
+                code1, code2 = item.get('code1') or '', item.get('code2') or ''
+            else:
+                key = ((item.get('category') or '').lower(), item.get('section'))
+                code1 = contents.get(lookup.get(item.get('jurisdiction1'), {}).get(key))
+                code2 = contents.get(lookup.get(item.get('jurisdiction2'), {}).get(key))
+                if code1 is None or code2 is None:
+                    results.append(dict(item, error="Section not found in both jurisdictions"))
+                    continue
+            result = {key: item[key] for key in ('jurisdiction1', 'jurisdiction2', 'category', 'section') if key in item}
+            result.update(self._analyze(code1, code2, jurisdiction1, jurisdiction2, detail))
+            results.append(result)
+        return results
+
+    def handle(self, method: str, target: str, headers, body: bytes) -> Tuple[int, Dict[str, str], bytes]:
+        """Route one request and return (status, headers, body), using ETags and the shared cache"""
+        url = urlsplit(target)
+        path = url.path.rstrip('/') or '/'
+        if method == 'GET' and path == '/metrics':
+            return 200, {'Content-Type': 'text/plain; version=0.0.4'}, \
+                instrumentation.METRICS.to_prometheus().encode('utf-8')
+        route = self.routes.get((method, path))
+        if route is None:
+            allowed = [m for m, p in self.routes if p == path]
+            if allowed:
+                return 405, {'Allow': ', '.join(allowed)}, encode_json({'error': 'Method not allowed'})
+            return 404, {}, encode_json({'error': f"Unknown endpoint: {path}"})
+        query = parse_qs(url.query)
+
+        if method == 'POST':
+            try:
+                payload = json.loads(body or b'{}')
+            except ValueError:
+                raise ApiError(400, "Body must be JSON")
+            return 200, {'Cache-Control': 'no-store'}, encode_json(route(query, payload))
+
+        version = self.version.current()
+        if version is None or path in UNCACHED_PATHS:
+            return 200, {'Cache-Control': 'no-store'}, encode_json(route(query))
+
+        # The ETag is known before any work: the data version plus the normalized request
+        canonical = path + '?' + '&'.join(f"{k}={v}" for k in sorted(query) for v in query[k])
+        if path in self.route_inputs:
+            canonical += '#' + self.route_inputs[path]()
+        etag = f'"{version}-{hashlib.sha256(canonical.encode()).hexdigest()[:16]}"'
+        cache_headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if etag in [tag.strip() for tag in (headers.get('If-None-Match') or '').split(',')]:
+            return 304, cache_headers, b''
+        entry = self.cache.get(etag)
+        if entry is None:
+            entry = {'body': encode_json(route(query))}
+            if len(entry['body']) >= GZIP_MIN_BYTES:
+                entry['gzip'] = gzip.compress(entry['body'], compresslevel=5)
+            # Don't store a response computed while the data changed underneath it
+            if self.version.current() == version:
+                self.cache.put(etag, entry)
+        if entry.get('gzip') and 'gzip' in (headers.get('Accept-Encoding') or ''):
+            return 200, dict(cache_headers, **{'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'}), entry['gzip']
+        return 200, dict(cache_headers, Vary='Accept-Encoding'), entry['body']
+
+def make_handler(api: CodeApi):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _respond(self, method: str):
+            start = time.perf_counter()
+            trace = instrumentation.start_trace(f"api.{method} {urlsplit(self.path).path}")
+            try:
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                try:
+                    status, headers, payload = api.handle(method, self.path, self.headers, body)
+                except ApiError as e:
+                    status, headers, payload = e.status, {}, encode_json({'error': str(e)})
+                except Exception as e:
+                    print(f"Error handling {method} {self.path}: {e}")
+                    status, headers, payload = 500, {}, encode_json({'error': 'Internal server error'})
+            finally:
+                trace.stop()
+            self.send_response(status)
+            if status != 304:
+                headers.setdefault('Content-Type', 'application/json')
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(payload)))
+            self.send_header('Server-Timing', f"app;dur={(time.perf_counter() - start) * 1000:.1f}")
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            self._respond('GET')
+
+        def do_POST(self):
+            self._respond('POST')
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+def create_api(snapshot: Optional[str] = None) -> CodeApi:
+    """API over a snapshot file, or over Postgres with the change feed driving data versions"""
+    if snapshot:
+        from utils.sqlite_backend import open_snapshot
+        db = open_snapshot(snapshot)
+        change_feed = None
+    else:
+        from utils.change_feed import ChangeFeed
+        db = Database()
+        change_feed = ChangeFeed(db).start()
+        db.attach_change_feed(change_feed)
+        change_feed.connected.wait(timeout=10)
+    return CodeApi(db, CodeTracker(db), DataVersion(db, change_feed))
+
+def serve(api: CodeApi, host: str = '127.0.0.1', port: int = 8600) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), make_handler(api))
+    server.daemon_threads = True
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve the building code JSON API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8600)
+    parser.add_argument('--snapshot', help="Serve a SQLite snapshot instead of Postgres")
+    args = parser.parse_args()
+    server = serve(create_api(args.snapshot), args.host, args.port)
+    print(f"Serving on http://{args.host}:{server.server_address[1]}")
+    server.serve_forever()
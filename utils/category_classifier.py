@@ -0,0 +1,248 @@
+import argparse
+import hashlib
+import os
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+import joblib
+import numpy as np
+from psycopg2.extras import execute_values
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import SGDClassifier
+from database import Database, content_hash
+from utils.instrumentation import traced
+from utils.section_parser import categorize
+
+DEFAULT_MODEL_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache', 'category_classifier.joblib'
+)
+# Bump when the features or the model change, so stored models and predictions are replaced
+MODEL_VERSION = 1
+# Category for text the classifier cannot place and no technical term hints at
+DEFAULT_CATEGORY = 'General'
+
+class CategoryClassifier:
+    """Linear model over TF-IDF features, trained on the categories already in the corpus.
+
+    Texts are classified a batch at a time: one sparse transform and one matrix product
+    score every text against every category.
+    """
+
+    def __init__(self, vectorizer: TfidfVectorizer, model: SGDClassifier, trained_on: str, samples: int):
+        self.vectorizer = vectorizer
+        self.model = model
+        self.trained_on = trained_on
+        self.samples = samples
+
+    @property
+    def version(self) -> str:
+        """Changes whenever the model does; stored predictions from other versions are stale"""
+        return f"{MODEL_VERSION}.{self.trained_on[:12]}"
+
+    @property
+    def categories(self) -> List[str]:
+        return [str(category) for category in self.model.classes_]
+
+    @classmethod
+    @traced('categories.train')
+    def train(cls, codes: List[Dict], contents: Dict[str, str]) -> 'CategoryClassifier':
+        """Fit on every distinct text, labelled with the category most sections using it carry"""
+        labels: Dict[str, Counter] = {}
+        for code in codes:
+            if code['content_hash'] in contents and code['category']:
+                labels.setdefault(code['content_hash'], Counter())[code['category'].title()] += 1
+        hashes = sorted(labels)
+        targets = [labels[digest].most_common(1)[0][0] for digest in hashes]
+        if len(set(targets)) < 2:
+            raise ValueError("Training needs sections from at least two categories")
+
+        vectorizer = TfidfVectorizer(stop_words='english', sublinear_tf=True, ngram_range=(1, 2),
+                                     max_features=50000, dtype=np.float32)
+        features = vectorizer.fit_transform([contents[digest] for digest in hashes])
+        model = SGDClassifier(loss='log_loss', alpha=1e-5, max_iter=50, tol=1e-4,
+                              class_weight='balanced', random_state=0)
+        model.fit(features, targets)
+        trained_on = hashlib.sha256('\n'.join(f"{digest} {target}" for digest, target
+                                              in zip(hashes, targets)).encode('utf-8')).hexdigest()
+        return cls(vectorizer, model, trained_on, len(hashes))
+
+    @traced('categories.predict')
+    def predict(self, texts: List[str]) -> List[Tuple[str, float]]:
+        """(category, probability) for each text"""
+        if not texts:
+            return []
+        probabilities = self.model.predict_proba(self.vectorizer.transform(texts))
+        best = probabilities.argmax(axis=1)
+        classes = self.model.classes_
+        return [(str(classes[i]), float(probabilities[row, i])) for row, i in enumerate(best)]
+
+    def save(self, path: str = DEFAULT_MODEL_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        partial = path + '.partial'
+        joblib.dump({
+            'model_version': MODEL_VERSION, 'vectorizer': self.vectorizer, 'model': self.model,
+            'trained_on': self.trained_on, 'samples': self.samples
+        }, partial)
+        os.replace(partial, path)
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_MODEL_PATH) -> 'CategoryClassifier':
+        state = joblib.load(path)
+        if state.get('model_version') != MODEL_VERSION:
+            raise ValueError(f"model version {state.get('model_version')} is not {MODEL_VERSION}")
+        return cls(state['vectorizer'], state['model'], state['trained_on'], state['samples'])
+
+def model_path_for(db: Database) -> str:
+    """Snapshots keep their model beside the snapshot file; Postgres uses the shared cache path"""
+    snapshot = getattr(db.backend, 'path', None)
+    return f"{snapshot}.categories.joblib" if snapshot else DEFAULT_MODEL_PATH
+
+_classifiers: Dict[str, Optional[CategoryClassifier]] = {}
+_lock = threading.Lock()
+
+def _train_and_save(db: Database, path: str) -> CategoryClassifier:
+    codes = db.get_building_codes()
+    classifier = CategoryClassifier.train(codes, db.get_contents(code['content_hash'] for code in codes))
+    classifier.save(path)
+    return classifier
+
+def train_classifier(db: Database, path: Optional[str] = None) -> CategoryClassifier:
+    """Retrain on the current corpus and replace the stored model"""
+    path = path or model_path_for(db)
+    with _lock:
+        classifier = _classifiers[path] = _train_and_save(db, path)
+    return classifier
+
+def get_category_classifier(db: Database, path: Optional[str] = None) -> Optional[CategoryClassifier]:
+    """Process-wide classifier, loaded from disk or trained once; None while the corpus has too few categories.
+
+    Training reads the corpus over its own connections, so call this outside any open transaction.
+    Concurrent first calls wait on the lock for one load or training run.
+    """
+    path = path or model_path_for(db)
+    with _lock:
+        if path in _classifiers:
+            return _classifiers[path]
+        if os.path.exists(path):
+            try:
+                _classifiers[path] = CategoryClassifier.load(path)
+                return _classifiers[path]
+            except Exception as e:
+                print(f"Error loading category classifier, retraining: {e}")
+        try:
+            _classifiers[path] = _train_and_save(db, path)
+        except ValueError:
+            _classifiers[path] = None
+        return _classifiers[path]
+
+def ensure_category_storage(db: Database):
+    """Create the per-text prediction table, so texts are classified once per model version"""
+    with db.get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS code_categories (
+                    content_hash TEXT PRIMARY KEY,
+                    model_version TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    confidence REAL NOT NULL
+                );
+            """)
+            conn.commit()
+
+def classify_texts(cur, classifier: Optional[CategoryClassifier], contents: Dict[str, str]) -> Dict[str, str]:
+    """Categories for texts by content hash, reusing predictions stored for the current model"""
+    if classifier is None:
+        return {digest: categorize(text, DEFAULT_CATEGORY) for digest, text in contents.items()}
+    cur.execute("""
+        SELECT content_hash, category FROM code_categories
+        WHERE content_hash = ANY(%s) AND model_version = %s
+    """, (list(contents), classifier.version))
+    categories = dict(cur.fetchall())
+    missing = [digest for digest in contents if digest not in categories]
+    if missing:
+        predictions = classifier.predict([contents[digest] for digest in missing])
+        execute_values(cur, """
+            INSERT INTO code_categories (content_hash, model_version, category, confidence) VALUES %s
+            ON CONFLICT (content_hash) DO UPDATE
+            SET model_version = EXCLUDED.model_version, category = EXCLUDED.category, confidence = EXCLUDED.confidence
+        """, [(digest, classifier.version, category, confidence)
+              for digest, (category, confidence) in zip(missing, predictions)], page_size=1000)
+        categories.update((digest, category) for digest, (category, _) in zip(missing, predictions))
+    return categories
+
+@traced('categories.assign')
+def assign_categories(cur, classifier: Optional[CategoryClassifier], records: List[Dict]) -> List[Dict]:
+    """Records with a category filled in where they arrived without one"""
+    pending = [i for i, record in enumerate(records) if not record.get('category')]
+    if not pending:
+        return records
+    hashes = [content_hash(records[i]['content']) for i in pending]
+    categories = classify_texts(cur, classifier, {digest: records[i]['content'] for i, digest in zip(pending, hashes)})
+    records = list(records)
+    for i, digest in zip(pending, hashes):
+        records[i] = dict(records[i], category=categories[digest])
+    return records
+
+@traced('categories.reclassify')
+def reclassify(db: Database, classifier: CategoryClassifier, batch_size: int = 5000) -> int:
+    """Classify stored texts that have no prediction from the current model"""
+    db.require_content_storage()
+    ensure_category_storage(db)
+    classified = 0
+    with db.get_connection() as conn:
+        with conn.cursor() as cur:
+            while True:
+                cur.execute("""
+                    SELECT cc.content_hash, cc.content
+                    FROM code_contents cc
+                    LEFT JOIN code_categories cat ON cat.content_hash = cc.content_hash
+                    WHERE cat.content_hash IS NULL OR cat.model_version != %s
+                    LIMIT %s
+                """, (classifier.version, batch_size))
+                rows = cur.fetchall()
+                if not rows:
+                    return classified
+                classify_texts(cur, classifier, dict(rows))
+                classified += len(rows)
+                conn.commit()
+
+def disagreements(db: Database, classifier: CategoryClassifier, min_confidence: float = 0.9) -> List[Dict]:
+    """Sections whose stored category the current model confidently contradicts"""
+    with db.get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT bc.jurisdiction, INITCAP(bc.category), bc.section, cat.category, cat.confidence
+                FROM building_codes bc JOIN code_categories cat ON cat.content_hash = bc.content_hash
+                WHERE cat.model_version = %s AND cat.confidence >= %s AND INITCAP(bc.category) != cat.category
+                ORDER BY cat.confidence DESC, bc.jurisdiction, bc.section
+            """, (classifier.version, min_confidence))
+            return [{'jurisdiction': jurisdiction, 'category': category, 'section': section,
+                     'predicted': predicted, 'confidence': confidence}
+                    for jurisdiction, category, section, predicted, confidence in cur.fetchall()]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Train and apply the section category classifier")
+    parser.add_argument('--snapshot', help="Train from a SQLite snapshot instead of Postgres")
+    parser.add_argument('--train', action='store_true', help="Retrain on the current corpus")
+    parser.add_argument('--reclassify', action='store_true', help="Classify stored texts not yet seen by this model")
+    parser.add_argument('--disagreements', action='store_true', help="List sections the model files elsewhere")
+    parser.add_argument('--min-confidence', type=float, default=0.9)
+    args = parser.parse_args()
+    if args.snapshot and (args.reclassify or args.disagreements):
+        parser.error("--reclassify and --disagreements work on the predictions stored in Postgres, not a snapshot")
+
+    if args.snapshot:
+        from utils.sqlite_backend import open_snapshot
+        db = open_snapshot(args.snapshot)
+    else:
+        db = Database()
+    classifier = train_classifier(db) if args.train else get_category_classifier(db)
+    if classifier is None:
+        raise SystemExit("The corpus needs sections from at least two categories to train on")
+    print(f"Model {classifier.version}: {classifier.samples} texts, categories {', '.join(classifier.categories)}")
+    if args.reclassify:
+        print(f"Classified {reclassify(db, classifier)} texts")
+    if args.disagreements:
+        for row in disagreements(db, classifier, args.min_confidence):
+            print(f"{row['jurisdiction']} - Section {row['section']}: {row['category']} -> "
+                  f"{row['predicted']} ({row['confidence']:.2f})")
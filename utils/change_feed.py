@@ -0,0 +1,97 @@
+import json
+import select
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+CHANNEL = 'code_changes'
+
+def notify_change(cur, table: str, jurisdiction: Optional[str] = None,
+                  category: Optional[str] = None, op: str = 'UPDATE'):
+    """Queue a change event on the cursor's transaction; Postgres delivers it on commit"""
+    cur.execute("SELECT pg_notify(%s, %s)", (CHANNEL, json.dumps({
+        'table': table,
+        'op': op,
+        'jurisdiction': jurisdiction,
+        'category': category
+    })))
+
+class ChangeFeed:
+    """Background LISTEN loop that fans change events out to cache invalidators.
+
+    Callbacks receive the decoded event dict. When the connection drops, events may have been
+    missed, so subscribers get a ``{'table': None}`` event meaning "invalidate everything".
+    """
+
+    def __init__(self, db, channel: str = CHANNEL, poll_timeout: float = 5.0):
+        self.db = db
+        self.channel = channel
+        self.poll_timeout = poll_timeout
+        self.connected = threading.Event()
+        self.update_counts: Dict[Optional[str], int] = defaultdict(int)
+        self._callbacks: List[Callable[[Dict], None]] = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, callback: Callable[[Dict], None]):
+        self._callbacks.append(callback)
+        return callback
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="change-feed", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def new_update_count(self, seen: Dict[Optional[str], int], jurisdictions: Optional[List[str]] = None) -> int:
+        """Updates recorded since a session last looked, optionally limited to jurisdictions"""
+        keys = jurisdictions if jurisdictions is not None else list(self.update_counts)
+        return sum(max(0, self.update_counts.get(key, 0) - seen.get(key, 0)) for key in keys)
+
+    def _publish(self, event: Dict):
+        if event.get('table') == 'code_updates':
+            self.update_counts[event.get('jurisdiction')] += 1
+        for callback in self._callbacks:
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"Error in change feed callback: {e}")
+
+    def _run(self):
+        backoff = 1.0
+        while not self._stop.is_set():
+            try:
+                conn = psycopg2.connect(**self.db.config)
+                try:
+                    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                    with conn.cursor() as cur:
+                        cur.execute(f"LISTEN {self.channel}")
+                    # Anything cached before we were listening may already be stale
+                    self._publish({'table': None})
+                    self.connected.set()
+                    backoff = 1.0
+
+                    while not self._stop.is_set():
+                        if select.select([conn], [], [], self.poll_timeout) == ([], [], []):
+                            continue
+                        conn.poll()
+                        while conn.notifies:
+                            notify = conn.notifies.pop(0)
+                            try:
+                                self._publish(json.loads(notify.payload))
+                            except ValueError:
+                                self._publish({'table': None})
+                finally:
+                    self.connected.clear()
+                    conn.close()
+            except Exception as e:
+                print(f"Change feed disconnected: {e}")
+                self._publish({'table': None})
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60.0)
@@ -1,26 +1,55 @@
-from datetime import datetime
-from typing import Dict, List, Optional
+import json
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from database import Database
+from psycopg2.extras import DateRange, RealDictCursor, execute_values
+from database import Database, content_hash, intern_contents
+from utils.change_feed import notify_change
+from utils.instrumentation import traced
+from utils.text_diff import revert_diff, word_diff
+
+# First key of the advisory locks that serialize ingests per jurisdiction (the second is the name's hash)
+INGEST_LOCK_CLASS = 3401
 
 class CodeTracker:
     def __init__(self, db: Database):
         self.db = db
+        self._version_listeners = []
+        self._storage_ready = False
+
+    def add_version_listener(self, callback):
+        """Call ``callback(jurisdiction)`` after this tracker records versions or updates"""
+        self._version_listeners.append(callback)
+        return callback
+
+    def _versions_changed(self, jurisdiction: Optional[str]):
+        for callback in self._version_listeners:
+            try:
+                callback(jurisdiction)
+            except Exception as e:
+                print(f"Error in version listener: {e}")
 
     def record_code_version(self, jurisdiction: str, version_number: str, effective_date: str) -> int:
         """Record a new code version for a jurisdiction"""
         with self.db.get_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO code_versions (jurisdiction, version_number, effective_date)
-                    VALUES (%s, %s, %s)
-                    ON CONFLICT (jurisdiction, version_number) 
-                    DO UPDATE SET effective_date = EXCLUDED.effective_date
-                    RETURNING id
-                """, (jurisdiction, version_number, effective_date))
+                version_id = self._insert_code_version(cur, jurisdiction, version_number, effective_date)
                 conn.commit()
-                return cur.fetchone()[0]
+        self._versions_changed(jurisdiction)
+        return version_id
+
+    @staticmethod
+    def _insert_code_version(cur, jurisdiction: str, version_number: str, effective_date: str) -> int:
+        cur.execute("""
+            INSERT INTO code_versions (jurisdiction, version_number, effective_date)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (jurisdiction, version_number) 
+            DO UPDATE SET effective_date = EXCLUDED.effective_date
+            RETURNING id
+        """, (jurisdiction, version_number, effective_date))
+        version_id = cur.fetchone()[0]
+        notify_change(cur, 'code_versions', jurisdiction=jurisdiction, op='UPSERT')
+        return version_id
 
     def record_code_update(self, code_version_id: int, section: str, category: str,
                          previous_content: Optional[str], new_content: str,
@@ -34,62 +63,34 @@ class CodeTracker:
                     VALUES (%s, %s, %s, %s, %s, %s)
                     RETURNING id
                 """, (code_version_id, section, category, previous_content, new_content, change_type))
+                update_id = cur.fetchone()[0]
+                cur.execute("SELECT jurisdiction FROM code_versions WHERE id = %s", (code_version_id,))
+                jurisdiction = cur.fetchone()[0]
+                notify_change(cur, 'code_updates', jurisdiction=jurisdiction, category=category, op='INSERT')
                 conn.commit()
-                return cur.fetchone()[0]
+        self._versions_changed(jurisdiction)
+        return update_id
 
+    @traced('code_tracker.get_code_updates')
     def get_code_updates(self, jurisdiction: Optional[str] = None,
                         category: Optional[str] = None,
                         from_date: Optional[str] = None,
-                        limit: int = 100) -> List[Dict]:
+                        limit: int = 100,
+                        offset: int = 0) -> List[Dict]:
         """Get code updates with optional filters"""
-        with self.db.get_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                query = """
-                    SELECT cu.*, cv.jurisdiction, cv.version_number, cv.effective_date
-                    FROM code_updates cu
-                    JOIN code_versions cv ON cu.code_version_id = cv.id
-                    WHERE 1=1
-                """
-                params = []
-                
-                if jurisdiction:
-                    query += " AND cv.jurisdiction = %s"
-                    params.append(jurisdiction)
-                
-                if category:
-                    query += " AND cu.category = %s"
-                    params.append(category)
-                
-                if from_date:
-                    query += " AND cu.update_date >= %s"
-                    params.append(from_date)
-                
-                query += " ORDER BY cu.update_date DESC LIMIT %s"
-                params.append(limit)
-                
-                cur.execute(query, params)
-                return cur.fetchall()
+        return self.db.backend.code_updates(jurisdiction, category, from_date, limit, offset)
+
+    @traced('code_tracker.count_code_updates')
+    def count_code_updates(self, jurisdiction: Optional[str] = None,
+                          category: Optional[str] = None,
+                          from_date: Optional[str] = None) -> int:
+        """Count code updates matching the same filters as get_code_updates"""
+        return self.db.backend.count_code_updates(jurisdiction, category, from_date)
 
+    @traced('code_tracker.get_version_history')
     def get_version_history(self, jurisdiction: Optional[str] = None) -> List[Dict]:
         """Get version history for jurisdictions"""
-        with self.db.get_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                query = """
-                    SELECT cv.*, COUNT(cu.id) as update_count
-                    FROM code_versions cv
-                    LEFT JOIN code_updates cu ON cv.id = cu.code_version_id
-                    WHERE 1=1
-                """
-                params = []
-                
-                if jurisdiction:
-                    query += " AND cv.jurisdiction = %s"
-                    params.append(jurisdiction)
-                
-                query += " GROUP BY cv.id ORDER BY cv.effective_date DESC"
-                
-                cur.execute(query, params)
-                return cur.fetchall()
+        return self.db.backend.version_history(jurisdiction)
 
     def subscribe_to_updates(self, email: str, jurisdiction: str, category: Optional[str] = None) -> int:
         """Subscribe to code updates for a jurisdiction"""
@@ -114,3 +115,543 @@ class CodeTracker:
                     ORDER BY jurisdiction, category
                 """, (email,))
                 return cur.fetchall()
+
+    def get_code_updates_after(self, last_update_id: int, limit: int = 1000) -> List[Dict]:
+        """Get updates with ids above a delivery watermark, oldest first"""
+        with self.db.get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT cu.id, cu.section, cu.category, cu.change_type, cu.update_date,
+                           cv.jurisdiction, cv.version_number
+                    FROM code_updates cu
+                    JOIN code_versions cv ON cu.code_version_id = cv.id
+                    WHERE cu.id > %s
+                    ORDER BY cu.id
+                    LIMIT %s
+                """, (last_update_id, limit))
+                return cur.fetchall()
+
+    def get_all_subscriptions(self) -> List[Dict]:
+        """Get every notification subscription"""
+        with self.db.get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT user_email, jurisdiction, category
+                    FROM notification_subscriptions
+                """)
+                return cur.fetchall()
+
+    def get_code_updates_by_ids(self, update_ids: List[int]) -> List[Dict]:
+        """Get the updates among the given ids that are visible now, oldest first"""
+        with self.db.get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT cu.id, cu.section, cu.category, cu.change_type, cu.update_date,
+                           cv.jurisdiction, cv.version_number
+                    FROM code_updates cu
+                    JOIN code_versions cv ON cu.code_version_id = cv.id
+                    WHERE cu.id = ANY(%s)
+                    ORDER BY cu.id
+                """, (list(update_ids),))
+                return cur.fetchall()
+
+    def ensure_notification_storage(self):
+        """Create the delivery watermark and open-gap tables; part of ``python database.py migrate``"""
+        with self.db.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS notification_watermarks (
+                        name TEXT PRIMARY KEY,
+                        last_update_id INTEGER NOT NULL,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    );
+                    CREATE TABLE IF NOT EXISTS notification_gaps (
+                        name TEXT NOT NULL,
+                        update_id INTEGER NOT NULL,
+                        first_seen TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (name, update_id)
+                    );
+                    DROP TABLE IF EXISTS notification_deliveries;
+                """)
+                conn.commit()
+
+    def get_watermark(self, name: str) -> int:
+        """Get the last update id processed by a named consumer"""
+        with self.db.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT last_update_id FROM notification_watermarks WHERE name = %s", (name,))
+                row = cur.fetchone()
+                return row[0] if row else 0
+
+    def get_open_gaps(self, name: str) -> Set[int]:
+        """Ids below a named consumer's watermark that were not yet visible when it passed them"""
+        with self.db.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT update_id FROM notification_gaps WHERE name = %s", (name,))
+                return {row[0] for row in cur.fetchall()}
+
+    def set_watermark(self, name: str, last_update_id: int, opened_gaps: Iterable[int] = (),
+                      closed_gaps: Iterable[int] = (), gap_timeout: Optional[float] = None):
+        """Advance a named consumer's watermark and update its open gaps in one transaction.
+
+        Gaps open for longer than ``gap_timeout`` seconds belong to rolled-back transactions
+        and are dropped.
+        """
+        with self.db.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO notification_watermarks (name, last_update_id)
+                    VALUES (%s, %s)
+                    ON CONFLICT (name) DO UPDATE
+                    SET last_update_id = GREATEST(notification_watermarks.last_update_id, EXCLUDED.last_update_id),
+                        updated_at = CURRENT_TIMESTAMP
+                """, (name, last_update_id))
+                execute_values(cur, """
+                    INSERT INTO notification_gaps (name, update_id) VALUES %s
+                    ON CONFLICT DO NOTHING
+                """, [(name, update_id) for update_id in opened_gaps], page_size=1000)
+                cur.execute("DELETE FROM notification_gaps WHERE name = %s AND update_id = ANY(%s)",
+                            (name, list(closed_gaps)))
+                if gap_timeout is not None:
+                    cur.execute("""
+                        DELETE FROM notification_gaps
+                        WHERE name = %s AND first_seen < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                    """, (name, gap_timeout))
+                conn.commit()
+
+    @traced('code_tracker.bulk_upsert_codes')
+    def bulk_upsert_codes(self, records: List[Dict], page_size: int = 1000) -> int:
+        """Insert or update many (jurisdiction, category, section, content) records in one transaction"""
+        if not records:
+            return 0
+        self.require_storage()
+        changed = 0
+        today = date.today()
+        classifier = self.category_classifier(records)
+        with self.db.get_connection() as conn:
+            with conn.cursor() as cur:
+                # Categories match case-insensitively, as in ingest_code_version; the last record wins
+                records = list({
+                    (r['jurisdiction'], r['category'].lower(), r['section']): r
+                    for r in self.assign_categories(cur, classifier, records)
+                }.values())
+                jurisdictions = sorted({r['jurisdiction'] for r in records})
+                # Sections that predate history need an interval before this write closes it
+                for jurisdiction in jurisdictions:
+                    self._backfill_section_history(cur, jurisdiction)
+                for start in range(0, len(records), page_size):
+                    batch = records[start:start + page_size]
+                    hashes = intern_contents(cur, [r['content'] for r in batch])
+                    index_texts(cur, dict(zip(hashes, (r['content'] for r in batch))))
+                    page = [(r['jurisdiction'], r['category'], r['section'], digest)
+                            for r, digest in zip(batch, hashes)]
+                    updated = execute_values(cur, """
+                        UPDATE building_codes bc
+                        SET content_hash = v.content_hash
+                        FROM (VALUES %s) AS v (jurisdiction, category, section, content_hash)
+                        WHERE bc.jurisdiction = v.jurisdiction
+                        AND LOWER(bc.category) = LOWER(v.category)
+                        AND bc.section = v.section
+                        AND bc.content_hash IS DISTINCT FROM v.content_hash
+                        RETURNING bc.jurisdiction, bc.category, bc.section, bc.content_hash
+                    """, page, page_size=page_size, fetch=True)
+                    inserted = execute_values(cur, """
+                        INSERT INTO building_codes (jurisdiction, category, section, content_hash)
+                        SELECT v.jurisdiction, v.category, v.section, v.content_hash
+                        FROM (VALUES %s) AS v (jurisdiction, category, section, content_hash)
+                        WHERE NOT EXISTS (
+                            SELECT 1 FROM building_codes bc
+                            WHERE bc.jurisdiction = v.jurisdiction
+                            AND LOWER(bc.category) = LOWER(v.category)
+                            AND bc.section = v.section
+                        )
+                        RETURNING jurisdiction, category, section, content_hash
+                    """, page, page_size=page_size, fetch=True)
+                    changed += len(updated) + len(inserted)
+                    # Keep point-in-time reads in step with building_codes
+                    self._close_intervals(cur, [row[:3] for row in updated], today)
+                    self._open_intervals(cur, updated + inserted, today)
+                for jurisdiction in jurisdictions:
+                    notify_change(cur, 'building_codes', jurisdiction=jurisdiction, op='UPSERT')
+                conn.commit()
+                return changed
+
+    def migrate_schema(self):
+        """Create every table and column ingest writes to; part of ``python database.py migrate``"""
+        self.ensure_diff_storage()
+        self.ensure_history_storage()
+        self.ensure_text_indexes()
+        self.ensure_notification_storage()
+        self._storage_ready = True
+
+    def require_storage(self):
+        """Fail clearly, once per process, if the schema predates the tables ingest writes to"""
+        if self._storage_ready:
+            return
+        self.db.require_content_storage()
+        with self.db.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT to_regclass('section_history') IS NOT NULL
+                    AND to_regclass('code_references') IS NOT NULL
+                    AND to_regclass('code_measurements') IS NOT NULL
+                    AND to_regclass('measured_texts') IS NOT NULL
+                    AND to_regclass('code_categories') IS NOT NULL
+                    AND EXISTS (
+                        SELECT 1 FROM information_schema.columns
+                        WHERE table_name = 'code_updates' AND column_name = 'diff'
+                    )
+                """)
+                ready = cur.fetchone()[0] and not self._history_has_inline_contents(cur)
+        if not ready:
+            raise RuntimeError("The tracker schema is out of date; run `python database.py migrate`")
+        self._storage_ready = True
+
+    def ensure_text_indexes(self):
+        """Create the per-text citation, measurement and category tables that ingest keeps filled"""
+        from utils.category_classifier import ensure_category_storage
+        from utils.measurements import ensure_measurement_storage
+        from utils.reference_graph import ensure_reference_storage
+        ensure_reference_storage(self.db)
+        ensure_measurement_storage(self.db)
+        ensure_category_storage(self.db)
+
+    def category_classifier(self, records: List[Dict]):
+        """The category model, loaded only when some records arrive without a category.
+
+        Call it before opening the write transaction: a first call may train the model.
+        """
+        if all(record.get('category') for record in records):
+            return None
+        from utils.category_classifier import get_category_classifier
+        return get_category_classifier(self.db)
+
+    def assign_categories(self, cur, classifier, records: List[Dict]) -> List[Dict]:
+        """Classify records that arrive without a category"""
+        if all(record.get('category') for record in records):
+            return records
+        from utils.category_classifier import assign_categories
+        return assign_categories(cur, classifier, records)
+
+    def ensure_diff_storage(self):
+        """Add the columns used by diff-based update storage"""
+        with self.db.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    ALTER TABLE code_updates ADD COLUMN IF NOT EXISTS diff JSONB;
+                    ALTER TABLE code_updates ADD COLUMN IF NOT EXISTS content_hash TEXT;
+                    ALTER TABLE code_updates ALTER COLUMN new_content DROP NOT NULL;
+                    CREATE INDEX IF NOT EXISTS code_updates_section_idx
+                        ON code_updates (category, section, id);
+                """)
+                conn.commit()
+
+    @traced('code_tracker.ingest_code_version')
+    def ingest_code_version(self, jurisdiction: str, version_number: str, effective_date: str,
+                            sections: Iterable[Dict]) -> Dict:
+        """Record a new code version by diffing its sections against the current code.
+
+        Sections are matched on (category, section) and compared by their code_contents hash,
+        so unchanged sections cost one hash each. ADD and DELETE updates keep the added or removed text;
+        MODIFY updates keep only a word-level diff, and get_update_contents rebuilds both sides.
+        """
+        self.require_storage()
+        sections = list(sections)
+        classifier = self.category_classifier(sections)
+        # The version, the diff against the current code and every write share one transaction
+        with self.db.get_connection() as conn:
+            with conn.cursor() as cur:
+                # Ingests of one jurisdiction queue here until the holder commits or rolls back
+                cur.execute("SELECT pg_advisory_xact_lock(%s, hashtext(%s))", (INGEST_LOCK_CLASS, jurisdiction))
+                self._backfill_section_history(cur, jurisdiction)
+                incoming = {}
+                for record in self.assign_categories(cur, classifier, sections):
+                    incoming[(record['category'].lower(), record['section'])] = record
+                # Compare stored hashes so unchanged text never leaves the database
+                cur.execute("""
+                    SELECT id, category, section, content_hash
+                    FROM building_codes
+                    WHERE jurisdiction = %s
+                """, (jurisdiction,))
+                current = {(category.lower(), section): (code_id, category, digest)
+                           for code_id, category, section, digest in cur.fetchall()}
+
+                added = [key for key in incoming if key not in current]
+                deleted = [key for key in current if key not in incoming]
+                modified = [
+                    key for key in incoming
+                    if key in current and current[key][2] != content_hash(incoming[key]['content'])
+                ]
+
+                version_id = self._insert_code_version(cur, jurisdiction, version_number, effective_date)
+                if added or deleted or modified:
+                    self._apply_version(cur, jurisdiction, effective_date, version_id,
+                                        incoming, current, added, modified, deleted)
+                conn.commit()
+
+        self._versions_changed(jurisdiction)
+        return {'version_id': version_id, 'added': len(added), 'modified': len(modified), 'deleted': len(deleted)}
+
+    def _apply_version(self, cur, jurisdiction: str, effective_date: str, version_id: int,
+                       incoming: Dict, current: Dict, added: List, modified: List, deleted: List):
+        """Write a version's updates and bring building_codes and section_history in line with it"""
+        changed_ids = [current[key][0] for key in deleted + modified]
+        previous = {}
+        if changed_ids:
+            cur.execute("""
+                SELECT bc.id, cc.content
+                FROM building_codes bc JOIN code_contents cc ON cc.content_hash = bc.content_hash
+                WHERE bc.id = ANY(%s)
+            """, (changed_ids,))
+            previous = dict(cur.fetchall())
+
+        rows = []
+        for key in added:
+            record = incoming[key]
+            rows.append((version_id, record['section'], record['category'], None,
+                         record['content'], 'ADD', None, content_hash(record['content'])))
+        for key in modified:
+            record = incoming[key]
+            ops = word_diff(previous[current[key][0]], record['content'])
+            rows.append((version_id, record['section'], current[key][1], None, None,
+                         'MODIFY', json.dumps(ops), content_hash(record['content'])))
+        for key in deleted:
+            code_id, category, _ = current[key]
+            rows.append((version_id, key[1], category, previous[code_id], None,
+                         'DELETE', None, None))
+        execute_values(cur, """
+            INSERT INTO code_updates
+            (code_version_id, section, category, previous_content, new_content, change_type, diff, content_hash)
+            VALUES %s
+        """, rows, page_size=1000)
+
+        # Bring building_codes in line with the new version
+        if deleted:
+            cur.execute("DELETE FROM building_codes WHERE id = ANY(%s)",
+                        ([current[key][0] for key in deleted],))
+        hashes = dict(zip(added + modified,
+                          intern_contents(cur, [incoming[key]['content'] for key in added + modified])))
+        index_texts(cur, {hashes[key]: incoming[key]['content'] for key in added + modified})
+        if modified:
+            execute_values(cur, """
+                UPDATE building_codes bc SET content_hash = v.content_hash
+                FROM (VALUES %s) AS v (id, content_hash)
+                WHERE bc.id = v.id
+            """, [(current[key][0], hashes[key]) for key in modified], page_size=1000)
+        if added:
+            execute_values(cur, """
+                INSERT INTO building_codes (jurisdiction, category, section, content_hash)
+                VALUES %s
+            """, [(jurisdiction, incoming[key]['category'], incoming[key]['section'], hashes[key])
+                  for key in added], page_size=1000)
+
+        # Close the validity intervals of replaced sections and open new ones
+        self._close_intervals(cur, [(jurisdiction, current[key][1], key[1]) for key in deleted + modified],
+                              effective_date)
+        self._open_intervals(cur, [(jurisdiction, incoming[key]['category'], incoming[key]['section'], hashes[key])
+                                   for key in added + modified], effective_date)
+
+        notify_change(cur, 'building_codes', jurisdiction=jurisdiction, op='UPSERT')
+        notify_change(cur, 'code_updates', jurisdiction=jurisdiction, op='INSERT')
+
+    def ensure_history_storage(self):
+        """Create the validity-interval table behind point-in-time queries"""
+        with self.db.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS section_history (
+                        id SERIAL PRIMARY KEY,
+                        jurisdiction TEXT NOT NULL,
+                        category TEXT NOT NULL,
+                        section TEXT NOT NULL,
+                        content_hash TEXT NOT NULL REFERENCES code_contents (content_hash),
+                        validity DATERANGE NOT NULL
+                    )
+                """)
+                if self._history_has_inline_contents(cur):
+                    raise RuntimeError("section_history holds section texts inline; run "
+                                       "`python database.py migrate` to move them into code_contents")
+                conn.commit()
+                try:
+                    # A composite GiST index finds one jurisdiction's live rows without scanning its history
+                    cur.execute("CREATE EXTENSION IF NOT EXISTS btree_gist")
+                    cur.execute("""
+                        CREATE INDEX IF NOT EXISTS section_history_validity_idx
+                        ON section_history USING gist (jurisdiction, validity)
+                    """)
+                    conn.commit()
+                except psycopg2.Error:
+                    conn.rollback()
+                    cur.execute("""
+                        CREATE INDEX IF NOT EXISTS section_history_range_idx
+                        ON section_history USING gist (validity)
+                    """)
+                    conn.commit()
+
+    @staticmethod
+    def _history_has_inline_contents(cur) -> bool:
+        cur.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'section_history' AND column_name = 'content'
+        """)
+        return cur.fetchone() is not None
+
+    def migrate_history_storage(self) -> int:
+        """Replace the inline texts of history rows written before they were content-addressed.
+
+        Idempotent; part of ``python database.py migrate``. Returns the number of rows migrated.
+        """
+        with self.db.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT to_regclass('section_history') IS NOT NULL")
+                if not cur.fetchone()[0] or not self._history_has_inline_contents(cur):
+                    return 0
+                cur.execute("""
+                    INSERT INTO code_contents (content_hash, content)
+                    SELECT DISTINCT encode(sha256(convert_to(content, 'UTF8')), 'hex'), content
+                    FROM section_history
+                    ON CONFLICT (content_hash) DO NOTHING;
+                    ALTER TABLE section_history
+                        ADD COLUMN IF NOT EXISTS content_hash TEXT REFERENCES code_contents (content_hash);
+                    UPDATE section_history SET content_hash = encode(sha256(convert_to(content, 'UTF8')), 'hex');
+                """)
+                migrated = cur.rowcount
+                cur.execute("ALTER TABLE section_history ALTER COLUMN content_hash SET NOT NULL, DROP COLUMN content")
+                conn.commit()
+                return migrated
+
+    @staticmethod
+    def _close_intervals(cur, sections: List[Tuple[str, str, str]], effective_date):
+        """End the open interval of each (jurisdiction, category, section) at ``effective_date``"""
+        if not sections:
+            return
+        jurisdictions, categories, section_numbers = zip(*sections)
+        # An interval opened on or after the date would end up empty, so it is dropped instead
+        cur.execute("""
+            WITH replaced AS (
+                DELETE FROM section_history sh
+                USING unnest(%(jurisdictions)s::text[], %(categories)s::text[], %(sections)s::text[])
+                    AS v (jurisdiction, category, section)
+                WHERE sh.jurisdiction = v.jurisdiction AND upper_inf(sh.validity)
+                AND LOWER(sh.category) = LOWER(v.category) AND sh.section = v.section
+                AND lower(sh.validity) >= %(date)s::date
+            )
+            UPDATE section_history sh
+            SET validity = daterange(lower(sh.validity), %(date)s::date)
+            FROM unnest(%(jurisdictions)s::text[], %(categories)s::text[], %(sections)s::text[])
+                AS v (jurisdiction, category, section)
+            WHERE sh.jurisdiction = v.jurisdiction AND upper_inf(sh.validity)
+            AND LOWER(sh.category) = LOWER(v.category) AND sh.section = v.section
+            AND (lower_inf(sh.validity) OR lower(sh.validity) < %(date)s::date)
+        """, {
+            'date': effective_date,
+            'jurisdictions': list(jurisdictions),
+            'categories': list(categories),
+            'sections': list(section_numbers)
+        })
+
+    @staticmethod
+    def _open_intervals(cur, rows: List[Tuple[str, str, str, str]], effective_date):
+        """Start an open-ended interval for each (jurisdiction, category, section, content_hash)"""
+        execute_values(cur, """
+            INSERT INTO section_history (jurisdiction, category, section, content_hash, validity)
+            VALUES %s
+        """, [(jurisdiction, category, section, digest, DateRange(effective_date, None))
+              for jurisdiction, category, section, digest in rows], page_size=1000)
+
+    def backfill_section_history(self, jurisdiction: Optional[str] = None) -> int:
+        """Give sections that predate history tracking an interval open at both ends, and
+        re-open the intervals of sections whose text changed outside ingest as of today"""
+        self.require_storage()
+        with self.db.get_connection() as conn:
+            with conn.cursor() as cur:
+                count = self._backfill_section_history(cur, jurisdiction)
+                count += self._reconcile_section_history(cur, jurisdiction, date.today())
+                conn.commit()
+                return count
+
+    @staticmethod
+    def _backfill_section_history(cur, jurisdiction: Optional[str]) -> int:
+        cur.execute("""
+            INSERT INTO section_history (jurisdiction, category, section, content_hash, validity)
+            SELECT bc.jurisdiction, bc.category, bc.section, bc.content_hash, daterange(NULL, NULL)
+            FROM building_codes bc
+            WHERE (bc.jurisdiction = %s OR %s IS NULL)
+            AND bc.content_hash IS NOT NULL
+            AND NOT EXISTS (
+                SELECT 1 FROM section_history sh
+                WHERE sh.jurisdiction = bc.jurisdiction
+                AND LOWER(sh.category) = LOWER(bc.category)
+                AND sh.section = bc.section
+            )
+        """, (jurisdiction, jurisdiction))
+        return cur.rowcount
+
+    def _reconcile_section_history(self, cur, jurisdiction: Optional[str], effective_date) -> int:
+        """Bring open intervals in line with building_codes where the two have drifted apart"""
+        cur.execute("""
+            SELECT bc.jurisdiction, bc.category, bc.section, bc.content_hash
+            FROM building_codes bc
+            JOIN section_history sh ON sh.jurisdiction = bc.jurisdiction
+                AND LOWER(sh.category) = LOWER(bc.category) AND sh.section = bc.section
+                AND upper_inf(sh.validity)
+            WHERE (bc.jurisdiction = %s OR %s IS NULL)
+            AND sh.content_hash IS DISTINCT FROM bc.content_hash
+        """, (jurisdiction, jurisdiction))
+        drifted = cur.fetchall()
+        cur.execute("""
+            SELECT sh.jurisdiction, sh.category, sh.section
+            FROM section_history sh
+            WHERE (sh.jurisdiction = %s OR %s IS NULL) AND upper_inf(sh.validity)
+            AND NOT EXISTS (
+                SELECT 1 FROM building_codes bc
+                WHERE bc.jurisdiction = sh.jurisdiction
+                AND LOWER(bc.category) = LOWER(sh.category) AND bc.section = sh.section
+            )
+        """, (jurisdiction, jurisdiction))
+        removed = cur.fetchall()
+        self._close_intervals(cur, [row[:3] for row in drifted] + removed, effective_date)
+        self._open_intervals(cur, drifted, effective_date)
+        return len(drifted) + len(removed)
+
+    @traced('code_tracker.get_codes_as_of')
+    def get_codes_as_of(self, jurisdiction: str, as_of) -> List[Dict]:
+        """Get a jurisdiction's full section set as it stood on a date"""
+        return self.db.backend.codes_as_of(jurisdiction, as_of)
+
+    @traced('code_tracker.get_update_contents')
+    def get_update_contents(self, update: Dict) -> Tuple[Optional[str], Optional[str]]:
+        """Return (previous_content, new_content) for an update, rebuilding diff-only updates.
+
+        Walks back from the section's current text through later updates of the same section,
+        reverting each diff until the requested update is reached.
+        """
+        if update.get('diff') is None:
+            return update.get('previous_content'), update.get('new_content')
+
+        later_updates, text = self.db.backend.section_updates(update)
+        for later in later_updates:
+            if later['change_type'] == 'DELETE':
+                text = later['previous_content']
+            elif later['change_type'] == 'ADD':
+                text = None
+            elif later['diff'] is not None:
+                if text is None:
+                    break
+                if later['id'] == update['id']:
+                    if update.get('content_hash') and content_hash(text) != update['content_hash']:
+                        # building_codes was edited outside ingest; the chain no longer applies
+                        break
+                    return revert_diff(text, later['diff']), text
+                text = revert_diff(text, later['diff'])
+            else:
+                text = later['previous_content']
+        return None, None
+
+def index_texts(cur, contents: Dict[str, str]):
+    """Extract citations and measurements from newly stored texts, keyed by content hash"""
+    # Imported here so reading the tracker doesn't load the NLP stack
+    from utils.measurements import index_measurements
+    from utils.reference_graph import index_references
+    index_references(cur, contents)
+    index_measurements(cur, contents)
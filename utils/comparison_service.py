@@ -0,0 +1,177 @@
+import argparse
+import asyncio
+import os
+import threading
+from typing import List, Optional, Tuple
+from uagents import Model
+from utils.nlp_processor import BuildingCodeNLP, extract_entities_cached, get_nlp
+
+class CodeComparisonModel(Model):
+    content1: str
+    content2: str
+
+class ComparisonResult(Model):
+    similarity_score: float
+    differences: List[str]
+    technical_terms1: List[str]
+    technical_terms2: List[str]
+    common_terms: List[str]
+
+class ComparisonService:
+    """Long-lived async comparison service that batches concurrent requests.
+
+    Requests arriving within ``batch_window`` seconds of each other (up to
+    ``max_batch_size``) are scored with a single vectorized similarity call.
+    """
+
+    def __init__(self, nlp: Optional[BuildingCodeNLP] = None,
+                 max_batch_size: int = 64, batch_window: float = 0.005):
+        self.nlp = nlp or get_nlp()
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self._queue = None
+        self._task = None
+
+    async def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run_batches())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def compare(self, request: CodeComparisonModel) -> ComparisonResult:
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((request, future))
+        return await future
+
+    async def _run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            requests = [request for request, _ in batch]
+            try:
+                results = await asyncio.to_thread(self.compare_batch, requests)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def compare_batch(self, requests: List[CodeComparisonModel]) -> List[ComparisonResult]:
+        """Compare a batch of requests with one similarity pass and per-text term extraction"""
+        pairs = [(request.content1, request.content2) for request in requests]
+        similarities = self.nlp.calculate_similarities(pairs)
+
+        terms = {}
+        sentences = {}
+        for text in dict.fromkeys(text for pair in pairs for text in pair):
+            # Shared with analyze_code_differences, so a pair analysis doesn't extract twice
+            terms[text] = [
+                term
+                for group in extract_entities_cached(text)['technical_terms']
+                for term in group['terms']
+            ]
+            sentences[text] = self.nlp.preprocess_text(text)
+
+        results = []
+        for (text1, text2), similarity in zip(pairs, similarities):
+            sentences1, sentences2 = set(sentences[text1]), set(sentences[text2])
+            differences = (
+                [f"- {sentence}" for sentence in sentences[text1] if sentence not in sentences2] +
+                [f"+ {sentence}" for sentence in sentences[text2] if sentence not in sentences1]
+            )
+            results.append(ComparisonResult(
+                similarity_score=similarity,
+                differences=differences,
+                technical_terms1=terms[text1],
+                technical_terms2=terms[text2],
+                common_terms=sorted(set(terms[text1]).intersection(terms[text2]))
+            ))
+        return results
+
+class LocalTransport:
+    """In-process transport: queries go straight to the service, no Fetch.ai network"""
+
+    def __init__(self, service: ComparisonService):
+        self.service = service
+
+    async def query(self, request: CodeComparisonModel) -> ComparisonResult:
+        return await self.service.compare(request)
+
+class AgentTransport:
+    """Expose the service as a Fetch.ai uagents query handler.
+
+    The seed determines the agent's address and signing key, so it comes from the
+    caller or the AGENT_SEED environment variable and is never defaulted.
+    """
+
+    def __init__(self, service: ComparisonService, name: str = "building_code_analyzer",
+                 seed: Optional[str] = None):
+        from uagents import Agent, Context
+
+        seed = seed or os.environ.get('AGENT_SEED')
+        if not seed:
+            raise RuntimeError("Set AGENT_SEED (or pass --seed) to run the comparison agent")
+        self.service = service
+        self.agent = Agent(name=name, seed=seed)
+
+        @self.agent.on_query(model=CodeComparisonModel, replies={ComparisonResult})
+        async def analyze_codes(ctx: Context, sender: str, msg: CodeComparisonModel):
+            await ctx.send(sender, await self.service.compare(msg))
+
+    def run(self):
+        self.agent.run()
+
+_service = None
+_loop = None
+_lock = threading.Lock()
+
+def get_comparison_service() -> Tuple[ComparisonService, asyncio.AbstractEventLoop]:
+    """Process-wide service running on its own event loop thread, started on first use"""
+    global _service, _loop
+    with _lock:
+        if _service is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="comparison-service", daemon=True).start()
+            _service = ComparisonService()
+            asyncio.run_coroutine_threadsafe(_service.start(), _loop).result()
+        return _service, _loop
+
+async def compare_codes(request: CodeComparisonModel) -> ComparisonResult:
+    """Query the shared service from any event loop"""
+    service, loop = get_comparison_service()
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(LocalTransport(service).query(request), loop))
+
+def compare_codes_sync(request: CodeComparisonModel, timeout: Optional[float] = None) -> ComparisonResult:
+    """Query the shared service from synchronous code such as a job worker thread"""
+    service, loop = get_comparison_service()
+    return asyncio.run_coroutine_threadsafe(LocalTransport(service).query(request), loop).result(timeout)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve code comparisons to the Fetch.ai network")
+    parser.add_argument('--seed', help="agent seed (default: $AGENT_SEED)")
+    parser.add_argument('--name', default="building_code_analyzer")
+    args = parser.parse_args()
+    # Serve comparisons from a single long-lived agent
+    AgentTransport(ComparisonService(), name=args.name, seed=args.seed).run()
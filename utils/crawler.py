@@ -0,0 +1,152 @@
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlparse
+from utils.section_parser import iter_sections
+
+DEFAULT_STATE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache', 'crawler_state.json'
+)
+
+def parse_page(text: str, jurisdiction: str, category: Optional[str] = None) -> List[Dict]:
+    """Split a code page into (jurisdiction, category, section, content) records by section headings"""
+    return list(iter_sections(io.StringIO(text), jurisdiction, category))
+
+class HostRateLimiter:
+    """Space out requests to the same host by at least ``min_interval`` seconds"""
+
+    def __init__(self, min_interval: float = 1.0):
+        self.min_interval = min_interval
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._next_allowed: Dict[str, float] = {}
+
+    async def wait(self, host: str):
+        lock = self._locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            delay = self._next_allowed.get(host, 0) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_allowed[host] = time.monotonic() + self.min_interval
+
+class Crawler:
+    """Bounded-concurrency fetcher with per-host rate limits, conditional requests and hash dedup.
+
+    Validators (ETag/Last-Modified) and content hashes are persisted per URL, so a re-crawl only
+    parses pages whose content actually changed.
+    """
+
+    def __init__(self, concurrency: int = 8, per_host_interval: float = 1.0,
+                 state_path: str = DEFAULT_STATE_PATH, timeout: float = 30.0,
+                 user_agent: str = 'BuildingCodeAnalysis/0.1'):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.rate_limiter = HostRateLimiter(per_host_interval)
+        self.state_path = state_path
+        self.timeout = timeout
+        self.user_agent = user_agent
+        self.state = self._load_state()
+        self.stats = {'fetched': 0, 'not_modified': 0, 'unchanged': 0, 'failed': 0}
+
+    def _load_state(self) -> Dict[str, Dict]:
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_state(self):
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _fetch_blocking(self, url: str, headers: Dict[str, str]):
+        request = urllib.request.Request(url, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                charset = response.headers.get_content_charset() or 'utf-8'
+                return response.status, dict(response.headers), response.read().decode(charset, errors='replace')
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return 304, dict(e.headers), None
+            raise
+
+    async def fetch(self, url: str) -> Optional[str]:
+        """Fetch a page, returning None when it is unchanged since the last crawl"""
+        cached = self.state.get(url, {})
+        headers = {'User-Agent': self.user_agent}
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+
+        async with self.semaphore:
+            await self.rate_limiter.wait(urlparse(url).netloc)
+            status, response_headers, body = await asyncio.to_thread(self._fetch_blocking, url, headers)
+
+        if status == 304:
+            self.stats['not_modified'] += 1
+            return None
+
+        content_hash = hashlib.sha256(body.encode('utf-8')).hexdigest()
+        unchanged = cached.get('content_hash') == content_hash
+        self.state[url] = {
+            'etag': response_headers.get('ETag'),
+            'last_modified': response_headers.get('Last-Modified'),
+            'content_hash': content_hash
+        }
+        if unchanged:
+            self.stats['unchanged'] += 1
+            return None
+        self.stats['fetched'] += 1
+        return body
+
+    async def crawl_source(self, source: Dict) -> List[Dict]:
+        try:
+            body = await self.fetch(source['url'])
+        except Exception as e:
+            self.stats['failed'] += 1
+            print(f"Error fetching {source['url']}: {e}")
+            return []
+        if body is None:
+            return []
+        return parse_page(body, source['jurisdiction'], source.get('category'))
+
+    async def crawl(self, sources: Iterable[Dict]) -> List[Dict]:
+        """Crawl every source concurrently and return the parsed records of changed pages.
+
+        Call save_state once the records are stored, so a failed load is retried next crawl.
+        """
+        results = await asyncio.gather(*(self.crawl_source(source) for source in sources))
+        return [record for records in results for record in records]
+
+def ingest_sources(sources: List[Dict], code_tracker, **crawler_options) -> Dict:
+    """Crawl sources and bulk-load the changed sections into building_codes"""
+    crawler = Crawler(**crawler_options)
+    records = asyncio.run(crawler.crawl(sources))
+    changed = code_tracker.bulk_upsert_codes(records)
+    crawler.save_state()
+    return dict(crawler.stats, records=len(records), changed=changed)
+
+if __name__ == '__main__':
+    from database import Database
+    from utils.code_tracker import CodeTracker
+
+    parser = argparse.ArgumentParser(description="Crawl jurisdiction code sources into building_codes")
+    parser.add_argument('sources', help="JSON file listing {jurisdiction, url, category} sources")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--per-host-interval', type=float, default=1.0,
+                        help="Minimum seconds between requests to one host")
+    args = parser.parse_args()
+
+    with open(args.sources) as f:
+        sources = json.load(f)
+    print(ingest_sources(sources, CodeTracker(Database()),
+                         concurrency=args.concurrency, per_host_interval=args.per_host_interval))
@@ -1,8 +1,22 @@
 import pandas as pd
+from utils.instrumentation import traced
 
-def process_code_differences(codes_data):
-    """Process and highlight differences between building codes"""
+@traced('analysis.process_code_differences')
+def process_code_differences(codes_data, section_aliases=None):
+    """Process and highlight differences between building codes
+
+    ``section_aliases`` maps (jurisdiction, category, section) to the section number it
+    corresponds to elsewhere, so renumbered sections are compared with their counterparts.
+    """
     df = pd.DataFrame(codes_data)
+    # Equal hashes mean equal text, so compare the short keys rather than the texts
+    text_column = 'content_hash' if 'content_hash' in df.columns else 'content'
+    df['aligned_section'] = df['section']
+    if section_aliases:
+        df['aligned_section'] = [
+            section_aliases.get((jurisdiction, category, section), section)
+            for jurisdiction, category, section in zip(df['jurisdiction'], df['category'], df['section'])
+        ]
     
     differences = []
     categories = df['category'].unique()
@@ -11,14 +25,16 @@ def process_code_differences(codes_data):
         category_codes = df[df['category'] == category]
         jurisdictions = category_codes['jurisdiction'].unique()
         
-        for section in category_codes['section'].unique():
-            section_codes = category_codes[category_codes['section'] == section]
-            if len(section_codes) > 1 and not all(section_codes['content'].iloc[0] == section_codes['content']):
+        for section in category_codes['aligned_section'].unique():
+            section_codes = category_codes[category_codes['aligned_section'] == section]
+            if len(section_codes) > 1 and section_codes[text_column].nunique() > 1:
                 differences.append({
                     'category': category,
                     'section': section,
                     'jurisdictions': list(jurisdictions),
-                    'severity': 'high' if len(set(section_codes['content'])) > 2 else 'medium'
+                    # The section number each jurisdiction files this provision under
+                    'sections': dict(zip(section_codes['jurisdiction'], section_codes['section'])),
+                    'severity': 'high' if section_codes[text_column].nunique() > 2 else 'medium'
                 })
     
     return differences
@@ -0,0 +1,217 @@
+import argparse
+import csv
+import io
+import itertools
+import json
+import sys
+import tempfile
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional
+from database import Database
+from utils.instrumentation import traced
+
+# Column names and types per dataset; lists and mappings are JSON-encoded in CSV and Parquet
+DATASETS = {
+    'differences': [
+        ('category', 'string'), ('section', 'string'), ('severity', 'string'),
+        ('jurisdiction_count', 'int'), ('sections', 'json')
+    ],
+    'comparisons': [
+        ('jurisdiction1', 'string'), ('jurisdiction2', 'string'), ('category', 'string'), ('section', 'string'),
+        ('similarity_score', 'float'), ('impact_score', 'float'), ('requirements_added', 'int'),
+        ('requirements_removed', 'int'), ('recommendations', 'int')
+    ],
+    'recommendations': [
+        ('jurisdiction1', 'string'), ('jurisdiction2', 'string'), ('category', 'string'), ('section', 'string'),
+        ('recommendation', 'string'), ('impact', 'string'), ('description', 'string'), ('benefit', 'string'),
+        ('details', 'json'), ('citations', 'json')
+    ]
+}
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet'
+}
+
+def _encode(row: Dict, columns: List[tuple]) -> Dict:
+    return {name: json.dumps(row.get(name)) if kind == 'json' else row.get(name) for name, kind in columns}
+
+class _CsvWriter:
+    def __init__(self, stream: BinaryIO, columns: List[tuple]):
+        self.columns = columns
+        self.text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+        self.writer = csv.DictWriter(self.text, fieldnames=[name for name, _ in columns])
+        self.writer.writeheader()
+
+    def write(self, rows: List[Dict]):
+        self.writer.writerows(_encode(row, self.columns) for row in rows)
+
+    def close(self):
+        self.text.flush()
+        # Leave the caller's stream open
+        self.text.detach()
+
+class _JsonlWriter:
+    def __init__(self, stream: BinaryIO, columns: List[tuple]):
+        self.stream = stream
+        self.names = [name for name, _ in columns]
+
+    def write(self, rows: List[Dict]):
+        self.stream.write(''.join(
+            json.dumps({name: row.get(name) for name in self.names}) + '\n' for row in rows
+        ).encode('utf-8'))
+
+    def close(self):
+        self.stream.flush()
+
+class _ParquetWriter:
+    """One Parquet row group per chunk, so only a chunk is ever held in memory"""
+
+    def __init__(self, stream: BinaryIO, columns: List[tuple]):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+        types = {'string': pa.string(), 'json': pa.string(), 'float': pa.float64(), 'int': pa.int64()}
+        self.pa = pa
+        self.columns = columns
+        self.schema = pa.schema([(name, types[kind]) for name, kind in columns])
+        self.writer = pq.ParquetWriter(stream, self.schema)
+
+    def write(self, rows: List[Dict]):
+        encoded = [_encode(row, self.columns) for row in rows]
+        self.writer.write_table(self.pa.Table.from_pylist(encoded, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+WRITERS = {'csv': _CsvWriter, 'jsonl': _JsonlWriter, 'parquet': _ParquetWriter}
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow.parquet  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def _codes_by_category(db: Database, jurisdictions: Optional[List[str]],
+                       categories: Optional[List[str]]) -> Iterator[tuple]:
+    """(category, codes) one category at a time, so analyses never span the whole corpus"""
+    codes = []
+    for jurisdiction in jurisdictions or [None]:
+        codes.extend(db.get_building_codes(jurisdiction))
+    wanted = {category.lower() for category in categories} if categories else None
+    by_category: Dict[str, List[Dict]] = {}
+    for code in codes:
+        category = code['category'] or ''
+        if wanted is None or category.lower() in wanted:
+            by_category.setdefault(category, []).append(code)
+    for category in sorted(by_category):
+        yield category, by_category[category]
+
+def iter_differences(db: Database, jurisdictions: Optional[List[str]] = None,
+                     categories: Optional[List[str]] = None) -> Iterator[Dict]:
+    """process_code_differences rows: sections whose text differs between jurisdictions"""
+    from utils.data_processing import process_code_differences
+    for _, codes in _codes_by_category(db, jurisdictions, categories):
+        for difference in process_code_differences(codes):
+            yield dict(difference, jurisdiction_count=len(difference['sections']))
+
+def iter_pair_analyses(db: Database, jurisdictions: Optional[List[str]] = None,
+                       categories: Optional[List[str]] = None) -> Iterator[Dict]:
+    """Full pairwise analysis of every section two jurisdictions both have in different wording.
+
+    Analyses come from the memoized NLP caches where a text pair was seen before, and are
+    computed on demand otherwise; texts are fetched one category at a time.
+    """
+    from components.policy_recommendations import analyze_pair
+    for category, codes in _codes_by_category(db, jurisdictions, categories):
+        contents = db.get_contents(code['content_hash'] for code in codes)
+        sections: Dict[str, Dict[str, Dict]] = {}
+        for code in codes:
+            sections.setdefault(code['section'], {})[code['jurisdiction']] = code
+        for section in sorted(sections):
+            by_jurisdiction = sections[section]
+            for jurisdiction1, jurisdiction2 in itertools.combinations(sorted(by_jurisdiction), 2):
+                hash1 = by_jurisdiction[jurisdiction1]['content_hash']
+                hash2 = by_jurisdiction[jurisdiction2]['content_hash']
+                if hash1 == hash2:
+                    continue
+                result = analyze_pair(contents.get(hash1) or '', contents.get(hash2) or '',
+                                      jurisdiction1, jurisdiction2)
+                yield dict(result, jurisdiction1=jurisdiction1, jurisdiction2=jurisdiction2,
+                           category=category, section=section)
+
+def iter_comparisons(db: Database, jurisdictions: Optional[List[str]] = None,
+                     categories: Optional[List[str]] = None) -> Iterator[Dict]:
+    for pair in iter_pair_analyses(db, jurisdictions, categories):
+        changes = pair['analysis']['requirement_changes']
+        yield dict(pair, similarity_score=pair['analysis']['similarity_score'],
+                   requirements_added=len(changes['added']), requirements_removed=len(changes['removed']),
+                   recommendations=len(pair['recommendations']))
+
+def iter_recommendations(db: Database, jurisdictions: Optional[List[str]] = None,
+                         categories: Optional[List[str]] = None) -> Iterator[Dict]:
+    for pair in iter_pair_analyses(db, jurisdictions, categories):
+        for recommendation in pair['recommendations']:
+            yield dict(recommendation, jurisdiction1=pair['jurisdiction1'], jurisdiction2=pair['jurisdiction2'],
+                       category=pair['category'], section=pair['section'],
+                       recommendation=recommendation['category'])
+
+ROWS = {'differences': iter_differences, 'comparisons': iter_comparisons, 'recommendations': iter_recommendations}
+
+@traced('export.write_rows')
+def write_rows(rows: Iterable[Dict], dataset: str, stream: BinaryIO, fmt: str = 'csv',
+               chunk_size: int = 1000, limit: Optional[int] = None) -> int:
+    """Write rows to a binary stream in chunks of ``chunk_size``; returns the row count"""
+    writer = WRITERS[fmt](stream, DATASETS[dataset])
+    rows = iter(itertools.islice(rows, limit))
+    written = 0
+    try:
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                return written
+            writer.write(chunk)
+            written += len(chunk)
+    finally:
+        writer.close()
+
+def export_results(db: Database, dataset: str, stream: BinaryIO, fmt: str = 'csv',
+                   jurisdictions: Optional[List[str]] = None, categories: Optional[List[str]] = None,
+                   chunk_size: int = 1000, limit: Optional[int] = None) -> int:
+    """Stream one result dataset, filtered to jurisdictions and categories, to ``stream``"""
+    return write_rows(ROWS[dataset](db, jurisdictions, categories), dataset, stream, fmt, chunk_size, limit)
+
+def export_to_file(db: Database, dataset: str, fmt: str = 'csv', **filters) -> BinaryIO:
+    """Export into an anonymous temporary file, rewound for reading (e.g. by a download button)"""
+    out = tempfile.TemporaryFile()
+    export_results(db, dataset, out, fmt, **filters)
+    out.seek(0)
+    return out
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export comparison and difference results")
+    parser.add_argument('dataset', choices=sorted(DATASETS))
+    parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+    parser.add_argument('--output', default='-', help="Output file (default: stdout)")
+    parser.add_argument('--jurisdiction', action='append', help="Repeat to export several jurisdictions")
+    parser.add_argument('--category', action='append', help="Repeat to export several categories")
+    parser.add_argument('--snapshot', help="Read a SQLite snapshot instead of Postgres")
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--limit', type=int, help="Stop after this many rows")
+    args = parser.parse_args()
+
+    if args.snapshot:
+        from utils.sqlite_backend import open_snapshot
+        db = open_snapshot(args.snapshot)
+    else:
+        db = Database()
+    if args.output == '-':
+        count = export_results(db, args.dataset, sys.stdout.buffer, args.format, args.jurisdiction,
+                               args.category, args.chunk_size, args.limit)
+    else:
+        with open(args.output, 'wb') as out:
+            count = export_results(db, args.dataset, out, args.format, args.jurisdiction,
+                                   args.category, args.chunk_size, args.limit)
+    print(f"Exported {count} {args.dataset} rows", file=sys.stderr)
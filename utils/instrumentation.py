@@ -0,0 +1,265 @@
+import importlib
+import json
+import re
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, List, Optional
+import psycopg2.extensions
+
+_current_trace: ContextVar[Optional['Trace']] = ContextVar('current_trace', default=None)
+
+class Span:
+    """One timed stage, with attributes such as ``rows`` and ``bytes`` and nested child spans"""
+
+    __slots__ = ('name', 'attrs', 'start', 'duration', 'children')
+
+    def __init__(self, name: str, attrs: Dict):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.duration = None
+        self.children: List['Span'] = []
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, **counts):
+        for key, value in counts.items():
+            self.attrs[key] = self.attrs.get(key, 0) + value
+
+    def walk(self, depth: int = 0):
+        yield depth, self
+        for child in self.children:
+            yield from child.walk(depth + 1)
+
+    def to_dict(self) -> Dict:
+        return {
+            'name': self.name,
+            'seconds': self.duration,
+            'attrs': self.attrs,
+            'children': [child.to_dict() for child in self.children]
+        }
+
+class _NoopSpan:
+    """Stand-in returned when no trace is active, so instrumented code needs no branches"""
+
+    def set(self, **attrs):
+        pass
+
+    def add(self, **counts):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NOOP_SPAN = _NoopSpan()
+
+class _SpanContext:
+    __slots__ = ('trace', 'span')
+
+    def __init__(self, trace: 'Trace', name: str, attrs: Dict):
+        self.trace = trace
+        self.span = Span(name, attrs)
+
+    def __enter__(self) -> Span:
+        self.trace.stack[-1].children.append(self.span)
+        self.trace.stack.append(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.duration = time.perf_counter() - self.span.start
+        if exc_type is not None:
+            self.span.attrs['error'] = exc_type.__name__
+        self.trace.stack.pop()
+        return False
+
+class MetricsRegistry:
+    """Process-wide per-stage totals, fed by every finished trace"""
+
+    FIELDS = ('calls', 'seconds', 'rows', 'bytes')
+
+    def __init__(self):
+        self._stages: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, trace: 'Trace'):
+        with self._lock:
+            for _, span in trace.root.walk():
+                stage = self._stages.setdefault(span.name, dict.fromkeys(self.FIELDS, 0))
+                stage['calls'] += 1
+                stage['seconds'] += span.duration or 0.0
+                stage['rows'] += span.attrs.get('rows', 0) or 0
+                stage['bytes'] += span.attrs.get('bytes', 0) or 0
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {name: dict(stage) for name, stage in self._stages.items()}
+
+    def to_prometheus(self, prefix: str = 'building_codes') -> str:
+        """Render the totals in the Prometheus text exposition format"""
+        stages = self.snapshot()
+        lines = []
+        for field, description in (('calls', 'Times each stage ran'),
+                                   ('seconds', 'Wall-clock seconds spent in each stage'),
+                                   ('rows', 'Rows returned or affected'),
+                                   ('bytes', 'Approximate bytes fetched')):
+            metric = f"{prefix}_stage_{field}_total"
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} counter")
+            for name in sorted(stages):
+                label = name.replace('\\', '\\\\').replace('"', '\\"')
+                lines.append(f'{metric}{{stage="{label}"}} {stages[name][field]:g}')
+        return '\n'.join(lines) + '\n'
+
+METRICS = MetricsRegistry()
+
+class Trace:
+    """Span tree for one unit of work, such as a page render"""
+
+    def __init__(self, name: str):
+        self.root = Span(name, {})
+        self.stack = [self.root]
+        self._token = None
+
+    def start(self) -> 'Trace':
+        self._token = _current_trace.set(self)
+        return self
+
+    def stop(self, registry: Optional[MetricsRegistry] = METRICS) -> 'Trace':
+        if self.root.duration is None:
+            self.root.duration = time.perf_counter() - self.root.start
+            if registry is not None:
+                registry.record(self)
+        if self._token is not None:
+            _current_trace.reset(self._token)
+            self._token = None
+        return self
+
+    def __enter__(self) -> 'Trace':
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def stages(self) -> List[Dict]:
+        """Flattened spans in call order, with their nesting depth"""
+        return [
+            dict(span.attrs, stage=span.name, depth=depth, ms=(span.duration or 0.0) * 1000)
+            for depth, span in self.root.walk()
+        ]
+
+    def to_dict(self) -> Dict:
+        return self.root.to_dict()
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2, default=str)
+
+def active() -> bool:
+    return _current_trace.get() is not None
+
+def start_trace(name: str) -> Trace:
+    return Trace(name).start()
+
+def clear_trace():
+    """Drop a trace left active by an interrupted run"""
+    _current_trace.set(None)
+
+def span(name: str, **attrs):
+    """Time a block as a child of the current span; free when no trace is active"""
+    trace = _current_trace.get()
+    if trace is None:
+        return NOOP_SPAN
+    return _SpanContext(trace, name, attrs)
+
+def traced(name: Optional[str] = None) -> Callable:
+    """Decorator running a function inside a span named after it"""
+    def decorator(fn):
+        stage = name or f"{fn.__module__}.{fn.__qualname__}"
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            trace = _current_trace.get()
+            if trace is None:
+                return fn(*args, **kwargs)
+            with _SpanContext(trace, stage, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def import_module(name: str):
+    """Import a module inside an ``import.<name>`` span, flagging the first (cold) load"""
+    cold = name not in sys.modules
+    with span(f"import.{name}", cold=cold):
+        return importlib.import_module(name)
+
+# Query instrumentation, installed on connections only while a trace is active
+
+_STATEMENT_KIND = re.compile(r'^\s*(\w+)')
+
+def _query_stage(statement: str) -> str:
+    if 'information_schema' in statement:
+        return 'db.query.information_schema'
+    match = _STATEMENT_KIND.match(statement)
+    return f"db.query.{match.group(1).lower() if match else 'other'}"
+
+def _payload_bytes(rows) -> int:
+    total = 0
+    for row in rows:
+        for value in (row.values() if isinstance(row, dict) else row):
+            if isinstance(value, (str, bytes)):
+                total += len(value)
+            elif value is not None:
+                total += 8
+    return total
+
+_cursor_classes: Dict[type, type] = {}
+
+def _instrumented_cursor(base: type) -> type:
+    cls = _cursor_classes.get(base)
+    if cls is None:
+        class InstrumentedCursor(base):
+            def execute(self, query, vars=None):
+                statement = query.decode('utf-8', 'replace') if isinstance(query, bytes) else query
+                with span(_query_stage(statement), statement=' '.join(statement[:400].split())[:200]) as query_span:
+                    result = super().execute(query, vars)
+                    query_span.set(rows=max(self.rowcount, 0))
+                self._query_span = query_span
+                return result
+
+            def _fetched(self, rows):
+                query_span = getattr(self, '_query_span', None)
+                if query_span is not None:
+                    query_span.add(bytes=_payload_bytes(rows))
+                return rows
+
+            def fetchone(self):
+                row = super().fetchone()
+                return row if row is None else self._fetched([row])[0]
+
+            def fetchmany(self, size=None):
+                return self._fetched(super().fetchmany(size) if size is not None else super().fetchmany())
+
+            def fetchall(self):
+                return self._fetched(super().fetchall())
+
+        cls = _cursor_classes[base] = InstrumentedCursor
+    return cls
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """Connection whose cursors record a span per query, with row counts and bytes fetched"""
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = _instrumented_cursor(factory)
+        return super().cursor(*args, **kwargs)
+
+def connection_factory():
+    """Connection class for psycopg2.connect: instrumented only while a trace is active"""
+    return InstrumentedConnection if active() else None
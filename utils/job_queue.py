@@ -0,0 +1,277 @@
+import argparse
+import hashlib
+import importlib
+import json
+import multiprocessing
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+DEFAULT_QUEUE_PATH = os.environ.get(
+    'JOB_QUEUE_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache', 'jobs.sqlite3')
+)
+
+# Job kinds map to "module:function" so the worker only imports what it runs
+HANDLERS = {
+    'pair_analysis': 'components.policy_recommendations:analyze_code_pair',
+}
+
+# Kinds identified by the ordered content hashes of these payload texts rather than the whole payload
+CONTENT_KEYS = {
+    'pair_analysis': ('code1', 'code2'),
+}
+
+class JobQueue:
+    """SQLite-backed queue of analysis jobs, deduplicated by a hash of their payload"""
+
+    def __init__(self, path: str = DEFAULT_QUEUE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._ensure_schema()
+
+    @contextmanager
+    def get_connection(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _ensure_schema(self):
+        with self.get_connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    progress REAL NOT NULL DEFAULT 0,
+                    message TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_idx ON jobs (status, created_at)")
+
+    @staticmethod
+    def job_id(kind: str, payload: Dict) -> str:
+        """Content hash identifying a job; identical requests share one id"""
+        key = payload
+        if kind in CONTENT_KEYS:
+            key = [hashlib.sha256((payload[field] or '').encode('utf-8')).hexdigest()
+                   for field in CONTENT_KEYS[kind]]
+        encoded = json.dumps([kind, key], sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+    def submit(self, kind: str, payload: Dict) -> str:
+        """Queue a job unless an identical one already exists; a failed one stays failed until retried"""
+        if kind not in HANDLERS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = self.job_id(kind, payload)
+        now = time.time()
+        with self.get_connection() as conn:
+            conn.execute("""
+                INSERT INTO jobs (id, kind, payload, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (id) DO NOTHING
+            """, (job_id, kind, json.dumps(payload, default=str), now, now))
+        return job_id
+
+    def retry(self, job_ids: List[str]) -> int:
+        """Put failed jobs back in the queue"""
+        if not job_ids:
+            return 0
+        with self.get_connection() as conn:
+            placeholders = ', '.join('?' for _ in job_ids)
+            cur = conn.execute(f"""
+                UPDATE jobs SET status = 'queued', progress = 0, message = NULL, error = NULL, updated_at = ?
+                WHERE status = 'failed' AND id IN ({placeholders})
+            """, [time.time()] + list(job_ids))
+            return cur.rowcount
+
+    def submit_many(self, kind: str, payloads: Iterable[Dict]) -> List[str]:
+        return [self.submit(kind, payload) for payload in payloads]
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        jobs = self.get_jobs([job_id])
+        return jobs.get(job_id)
+
+    def get_jobs(self, job_ids: List[str]) -> Dict[str, Dict]:
+        """Fetch jobs by id with their results decoded"""
+        if not job_ids:
+            return {}
+        with self.get_connection() as conn:
+            placeholders = ', '.join('?' for _ in job_ids)
+            rows = conn.execute(f"""
+                SELECT id, kind, status, progress, message, result, error, updated_at
+                FROM jobs WHERE id IN ({placeholders})
+            """, list(job_ids)).fetchall()
+        jobs = {}
+        for row in rows:
+            job = dict(row)
+            job['result'] = json.loads(job['result']) if job['result'] else None
+            jobs[job['id']] = job
+        return jobs
+
+    def claim_next(self) -> Optional[Dict]:
+        """Atomically move the oldest queued job to running"""
+        with self.get_connection() as conn:
+            row = conn.execute("""
+                UPDATE jobs SET status = 'running', updated_at = ?
+                WHERE id = (
+                    SELECT id FROM jobs WHERE status = 'queued'
+                    ORDER BY created_at LIMIT 1
+                )
+                RETURNING id, kind, payload
+            """, (time.time(),)).fetchone()
+        if row is None:
+            return None
+        return {'id': row['id'], 'kind': row['kind'], 'payload': json.loads(row['payload'])}
+
+    def report_progress(self, job_id: str, progress: float, message: Optional[str] = None):
+        with self.get_connection() as conn:
+            conn.execute("""
+                UPDATE jobs SET progress = ?, message = ?, updated_at = ?
+                WHERE id = ?
+            """, (progress, message, time.time(), job_id))
+
+    def complete(self, job_id: str, result):
+        with self.get_connection() as conn:
+            conn.execute("""
+                UPDATE jobs SET status = 'done', progress = 1, result = ?, updated_at = ?
+                WHERE id = ?
+            """, (json.dumps(result, default=str), time.time(), job_id))
+
+    def fail(self, job_id: str, error: str):
+        with self.get_connection() as conn:
+            conn.execute("""
+                UPDATE jobs SET status = 'failed', error = ?, updated_at = ?
+                WHERE id = ?
+            """, (error, time.time(), job_id))
+
+    def requeue_stalled(self, timeout: float = 600) -> int:
+        """Return running jobs abandoned by a dead worker to the queue"""
+        with self.get_connection() as conn:
+            cur = conn.execute("""
+                UPDATE jobs SET status = 'queued', updated_at = ?
+                WHERE status = 'running' AND updated_at < ?
+            """, (time.time(), time.time() - timeout))
+            return cur.rowcount
+
+def resolve_handler(kind: str):
+    module_name, func_name = HANDLERS[kind].split(':')
+    return getattr(importlib.import_module(module_name), func_name)
+
+def run_job(queue: JobQueue, job: Dict):
+    try:
+        queue.report_progress(job['id'], 0.1, "Running")
+        result = resolve_handler(job['kind'])(**job['payload'])
+        queue.complete(job['id'], result)
+    except Exception:
+        queue.fail(job['id'], traceback.format_exc())
+
+def run_worker(queue: JobQueue, poll_interval: float = 0.5, stop_event: Optional[threading.Event] = None,
+               concurrency: int = 4):
+    """Process queued jobs on a pool of threads until stopped.
+
+    Threads share the process-wide entity and pair caches in utils.nlp_processor and the
+    comparison service, which scores their concurrent pairs in one batch.
+    """
+    queue.requeue_stalled()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="job-worker") as pool:
+        running = set()
+        while stop_event is None or not stop_event.is_set():
+            running = {future for future in running if not future.done()}
+            if len(running) >= concurrency:
+                wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                continue
+            job = queue.claim_next()
+            if job is None:
+                time.sleep(poll_interval)
+                continue
+            running.add(pool.submit(run_job, queue, job))
+
+def _run_child_worker(path: str, poll_interval: float, concurrency: int, parent_pid: int):
+    """Worker process body: stop once the process that started it has gone"""
+    stop_event = threading.Event()
+
+    def watch_parent():
+        while os.getppid() == parent_pid:
+            time.sleep(poll_interval)
+        stop_event.set()
+
+    threading.Thread(target=watch_parent, daemon=True).start()
+    run_worker(JobQueue(path), poll_interval=poll_interval, stop_event=stop_event, concurrency=concurrency)
+
+def run_workers(queue: JobQueue, processes: int, poll_interval: float = 0.5, concurrency: int = 4):
+    """Run one worker per process so CPU-bound analyses aren't serialized by the GIL.
+
+    Workers claim jobs from the shared SQLite queue atomically; this process runs one of them.
+    """
+    context = multiprocessing.get_context('spawn')
+    children = [
+        context.Process(target=_run_child_worker, args=(queue.path, poll_interval, concurrency, os.getpid()),
+                        name=f"job-worker-{i}", daemon=True)
+        for i in range(1, processes)
+    ]
+    for child in children:
+        child.start()
+    try:
+        run_worker(queue, poll_interval=poll_interval, concurrency=concurrency)
+    finally:
+        for child in children:
+            child.terminate()
+
+_queue = None
+_worker = None
+_lock = threading.Lock()
+
+def get_job_queue(start_worker: bool = True) -> JobQueue:
+    """Process-wide queue, spawning a worker process the first time it is needed"""
+    global _queue, _worker
+    with _lock:
+        if _queue is None:
+            _queue = JobQueue()
+        if start_worker and (_worker is None or _worker.poll() is not None):
+            _worker = subprocess.Popen(
+                [sys.executable, '-m', 'utils.job_queue', '--queue', _queue.path],
+                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            )
+        return _queue
+
+def summarize_jobs(jobs: Dict[str, Dict], job_ids: List[str]) -> Dict:
+    """Aggregate status of a batch for progress reporting"""
+    statuses = [jobs.get(job_id, {}).get('status', 'queued') for job_id in job_ids]
+    done = sum(1 for status in statuses if status in ('done', 'failed'))
+    return {
+        'total': len(job_ids),
+        'done': done,
+        'failed': statuses.count('failed'),
+        'failed_ids': [job_id for job_id, status in zip(job_ids, statuses) if status == 'failed'],
+        'pending': len(job_ids) - done,
+        'progress': done / len(job_ids) if job_ids else 1.0
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the analysis job worker")
+    parser.add_argument('--queue', default=DEFAULT_QUEUE_PATH, help="Path to the SQLite queue")
+    parser.add_argument('--poll-interval', type=float, default=0.5)
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 4,
+                        help="Number of worker processes analyzing jobs in parallel")
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help="Jobs in flight per process, batched by the comparison service")
+    args = parser.parse_args()
+    run_workers(JobQueue(args.queue), args.processes, poll_interval=args.poll_interval,
+                concurrency=args.concurrency)
@@ -0,0 +1,411 @@
+import argparse
+import re
+import threading
+import weakref
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from psycopg2.extras import execute_values
+from database import Database, corpus_fingerprint
+from utils.change_feed import notify_change
+from utils.instrumentation import traced
+
+# Canonical unit per quantity, and the factor converting each spelling into it
+QUANTITY_UNITS = {'length': 'in', 'area': 'sq ft', 'percent': '%'}
+UNITS = [
+    (r'square\s+(?:feet|foot)|sq\.?\s*ft\.?|sf\b', 'area', 1.0),
+    (r'square\s+inch(?:es)?|sq\.?\s*in\.?', 'area', 1 / 144),
+    (r'square\s+met(?:er|re)s?|m2\b', 'area', 10.7639),
+    (r'percent\b|%', 'percent', 1.0),
+    (r'feet\b|foot\b|ft\b\.?', 'length', 12.0),
+    (r'inch(?:es)?\b|in\.(?!\w)|in\b(?=\s*(?:[,;.)]|$|\s+(?:of|from|in|above|below|wide|high|deep)\b))', 'length', 1.0),
+    (r'millimet(?:er|re)s?\b|mm\b', 'length', 1 / 25.4),
+    (r'centimet(?:er|re)s?\b|cm\b', 'length', 1 / 2.54),
+    (r'met(?:er|re)s?\b|m\b', 'length', 39.3701),
+]
+# Feet and inches written as one length: "3 ft 6 in", "3 feet and 6 inches", 6'-8", 5' 2-1/2"
+FEET_INCHES = (
+    r"(?P<feet>\d+)\s*(?:'|\u2032|feet\b|foot\b|ft\b\.?)\s*(?:-|and\b)?\s*"
+    r"(?P<inches>\d+(?:\.\d+)?(?:[\s-]+\d+/\d+)?|\d+/\d+)\s*(?:\"|''|\u2033|inch(?:es)?\b|in\b\.?)"
+)
+MEASUREMENT_PATTERN = re.compile(
+    r'(?<![\w.])(?:' + FEET_INCHES + r'|(?P<number>\d+(?:,\d{3})*(?:\.\d+)?(?:\s+\d+/\d+)?|\d+/\d+)\s*(?P<unit>'
+    + '|'.join(f'(?:{pattern})' for pattern, _, _ in UNITS) + '))',
+    re.IGNORECASE
+)
+UNIT_PATTERNS = [(re.compile(pattern, re.IGNORECASE), quantity, factor) for pattern, quantity, factor in UNITS]
+
+# Words just before a value that make it a lower or an upper limit
+MIN_CUES = re.compile(r'\b(?:minimum|min\.|at least|not less than|no less than)\b', re.IGNORECASE)
+MAX_CUES = re.compile(r'\b(?:maximum|max\.|exceed|no more than|not more than|up to)\b', re.IGNORECASE)
+MODAL_PATTERN = re.compile(r'\b(shall not|shall|must not|must|should|may|is permitted to)\b', re.IGNORECASE)
+ARTICLES = {'a', 'an', 'the', 'every', 'each', 'any', 'all', 'required', 'exposed'}
+# How far back from a value to look for its limit cue and attribute
+CONTEXT_CHARS = 60
+
+def _number(text: str) -> float:
+    whole, _, fraction = text.replace(',', '').partition(' ')
+    if '/' in whole:
+        whole, fraction = '0', whole
+    value = float(whole)
+    if fraction:
+        numerator, denominator = fraction.split('/')
+        value += float(numerator) / float(denominator)
+    return value
+
+def _value(match: re.Match) -> Tuple[str, float]:
+    """Quantity and value in its canonical unit of a MEASUREMENT_PATTERN match"""
+    if match.group('feet') is not None:
+        return 'length', _number(match.group('feet')) * 12 + _number(re.sub(r'[\s-]+', ' ', match.group('inches')))
+    unit = match.group('unit').strip()
+    quantity, factor = next((quantity, factor) for pattern, quantity, factor in UNIT_PATTERNS
+                            if pattern.fullmatch(unit))
+    return quantity, _number(match.group('number')) * factor
+
+def _subject(prefix: str) -> Optional[str]:
+    """Head of the sentence's subject: the words before the modal, after any introductory clause"""
+    clause = prefix.rsplit(',', 1)[-1].rsplit(':', 1)[-1].lower()
+    # "A stairway serving an occupant load..." is about the stairway
+    clause = re.split(r'\b(?:serving|that|which|located|where|in|of|with|for)\b', clause)[0]
+    words = [word for word in re.findall(r"[a-z]+", clause) if word not in ARTICLES]
+    return ' '.join(words[-2:]) or None
+
+def _attribute(before: str, after: str) -> Optional[str]:
+    """What the value measures, from the words around it ("minimum width of", "of separation")"""
+    match = re.search(r'(?:within|of)\s*$', before)
+    if match and match.group().startswith('within'):
+        target = re.match(r'\s*of\s+(?:a|an|the)?\s*(\w+)', after)
+        return f"distance to {target.group(1).lower()}" if target else 'distance'
+    match = re.search(r'(\w+)\s+of\s*$', before)
+    if match:
+        return match.group(1).lower()
+    match = re.match(r'\s*of\s+(?!a\b|an\b|the\b)(\w+)', after)
+    if match:
+        return match.group(1).lower()
+    match = re.match(r'\s*from\s+(?:a|an|the)?\s*(\w+(?:\s+line)?)', after)
+    if match:
+        return f"distance from {match.group(1).lower()}"
+    match = re.match(r'\s*(wide|high|deep|long|tall)\b', after)
+    if match:
+        return {'wide': 'width', 'high': 'height', 'deep': 'depth', 'long': 'length', 'tall': 'height'}[match.group(1)]
+    return None
+
+def parse_measurements(text: str) -> List[Dict]:
+    """Every measurement in a text, in order, with its value in the canonical unit and its context.
+
+    Each item has ``quantity`` (length, area or percent), ``value`` (inches, square feet or
+    percent), ``bound`` (min, max or value), ``attribute``, ``subject``, ``modal`` and ``raw``.
+    """
+    measurements = []
+    # Split clauses at semicolons, and sentences only before a capital so "34 in. to 38 in." stays whole
+    for sentence in re.split(r'(?<=\.)\s+(?=[A-Z])|(?<=;)\s+', text or ''):
+        modal = MODAL_PATTERN.search(sentence)
+        for match in MEASUREMENT_PATTERN.finditer(sentence):
+            quantity, value = _value(match)
+            before = sentence[max(0, match.start() - CONTEXT_CHARS):match.start()]
+            after = sentence[match.end():match.end() + CONTEXT_CHARS]
+            cues = [(cue.end(), 'min') for cue in MIN_CUES.finditer(before)] + \
+                   [(cue.end(), 'max') for cue in MAX_CUES.finditer(before)]
+            measurements.append({
+                'position': len(measurements),
+                'quantity': quantity,
+                'value': round(value, 4),
+                'bound': max(cues)[1] if cues else 'value',
+                'attribute': _attribute(before, after),
+                'subject': _subject(sentence[:modal.start()]) if modal and modal.start() < match.start() else None,
+                'modal': modal.group(1).lower() if modal else None,
+                'raw': match.group().strip()
+            })
+    return measurements
+
+MEASUREMENT_COLUMNS = ['content_hash', 'position', 'quantity', 'value', 'bound', 'attribute', 'subject', 'modal', 'raw']
+
+def ensure_measurement_storage(db: Database):
+    """Create the normalized measurement table, indexed for range scans per attribute"""
+    with db.get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS code_measurements (
+                    content_hash TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    quantity TEXT NOT NULL,
+                    value DOUBLE PRECISION NOT NULL,
+                    bound TEXT NOT NULL,
+                    attribute TEXT,
+                    subject TEXT,
+                    modal TEXT,
+                    raw TEXT NOT NULL,
+                    PRIMARY KEY (content_hash, position)
+                );
+                CREATE INDEX IF NOT EXISTS code_measurements_value_idx
+                    ON code_measurements (quantity, attribute, value);
+                -- Every parsed text, including those with no measurements, so each is parsed once
+                CREATE TABLE IF NOT EXISTS measured_texts (
+                    content_hash TEXT PRIMARY KEY
+                );
+                INSERT INTO measured_texts (content_hash)
+                SELECT DISTINCT content_hash FROM code_measurements
+                ON CONFLICT (content_hash) DO NOTHING;
+            """)
+            conn.commit()
+
+def index_measurements(cur, contents: Dict[str, str]) -> int:
+    """Parse and store the measurements of newly stored texts, marking each one as parsed"""
+    if not contents:
+        return 0
+    execute_values(cur, """
+        INSERT INTO measured_texts (content_hash) VALUES %s
+        ON CONFLICT (content_hash) DO NOTHING
+    """, [(digest,) for digest in contents], page_size=1000)
+    rows = [
+        tuple(dict(measurement, content_hash=digest)[column] for column in MEASUREMENT_COLUMNS)
+        for digest, text in contents.items() for measurement in parse_measurements(text)
+    ]
+    if rows:
+        execute_values(cur, f"""
+            INSERT INTO code_measurements ({', '.join(MEASUREMENT_COLUMNS)}) VALUES %s
+            ON CONFLICT (content_hash, position) DO NOTHING
+        """, rows, page_size=1000)
+        notify_change(cur, 'code_measurements', op='INSERT')
+    return len(rows)
+
+@traced('measurements.backfill')
+def backfill_measurements(db: Database, batch_size: int = 2000) -> int:
+    """Parse texts stored before measurement indexing"""
+    db.require_content_storage()
+    ensure_measurement_storage(db)
+    indexed = 0
+    with db.get_connection() as conn:
+        with conn.cursor() as cur:
+            while True:
+                cur.execute("""
+                    SELECT cc.content_hash, cc.content
+                    FROM code_contents cc
+                    WHERE NOT EXISTS (SELECT 1 FROM measured_texts mt WHERE mt.content_hash = cc.content_hash)
+                    LIMIT %s
+                """, (batch_size,))
+                rows = cur.fetchall()
+                if not rows:
+                    return indexed
+                indexed += index_measurements(cur, dict(rows))
+                conn.commit()
+
+class MeasurementIndex:
+    """Columnar in-memory index of every measurement in the corpus, joined to its sections.
+
+    Rows are held as numpy columns sorted by (quantity, attribute, value), so a range query on
+    one attribute is a binary search within that attribute's slice.
+    """
+
+    def __init__(self, codes: List[Dict], measurements: Dict[str, List[Dict]]):
+        self.fingerprint = corpus_fingerprint(codes)
+        rows = [
+            (code['id'], code['jurisdiction'], code['category'], code['section'], measurement)
+            for code in codes for measurement in measurements.get(code['content_hash'], [])
+        ]
+        rows.sort(key=lambda row: (row[4]['quantity'], row[4]['attribute'] or '', row[4]['value']))
+        self.code_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self.jurisdiction_names, jurisdiction_codes = np.unique(
+            np.array([row[1] for row in rows], dtype=object), return_inverse=True
+        )
+        self.jurisdiction_codes = jurisdiction_codes.astype(np.int64)
+        self.categories = np.array([row[2] for row in rows], dtype=object)
+        self.sections = np.array([row[3] for row in rows], dtype=object)
+        self.values = np.array([row[4]['value'] for row in rows], dtype=np.float64)
+        self.columns = {column: np.array([row[4][column] for row in rows], dtype=object)
+                        for column in ('position', 'quantity', 'bound', 'attribute', 'subject', 'modal', 'raw')}
+        self.slices: Dict[tuple, tuple] = {}
+        for offset, row in enumerate(rows):
+            key = (row[4]['quantity'], row[4]['attribute'])
+            start, _ = self.slices.get(key, (offset, offset))
+            self.slices[key] = (start, offset + 1)
+
+        # Number each requirement (section, quantity, attribute, bound, nth such value in the text)
+        # so measurements of the same requirement in different jurisdictions share a key
+        self.requirements: List[tuple] = []
+        requirement_ids: Dict[tuple, int] = {}
+        occurrences: Dict[tuple, int] = {}
+        self.requirement_codes = np.empty(len(rows), dtype=np.int64)
+        for i in sorted(range(len(rows)), key=lambda i: (rows[i][0], rows[i][4]['position'])):
+            code_id, _, category, section, measurement = rows[i]
+            requirement = ((category or '').lower(), section, measurement['quantity'],
+                           measurement['attribute'], measurement['bound'])
+            occurrence = occurrences.get((code_id,) + requirement, 0)
+            occurrences[(code_id,) + requirement] = occurrence + 1
+            key = requirement + (occurrence,)
+            if key not in requirement_ids:
+                requirement_ids[key] = len(self.requirements)
+                self.requirements.append(key)
+            self.requirement_codes[i] = requirement_ids[key]
+
+    def __len__(self):
+        return len(self.values)
+
+    def attributes(self, quantity: Optional[str] = None) -> List[Dict]:
+        return sorted(({'quantity': key[0], 'attribute': key[1], 'count': stop - start}
+                       for key, (start, stop) in self.slices.items() if quantity in (None, key[0])),
+                      key=lambda row: -row['count'])
+
+    def _row(self, i: int) -> Dict:
+        row = {'code_id': int(self.code_ids[i]), 'jurisdiction': self.jurisdiction_names[self.jurisdiction_codes[i]],
+               'category': self.categories[i], 'section': self.sections[i], 'value': float(self.values[i])}
+        row.update((column, values[i]) for column, values in self.columns.items())
+        row['unit'] = QUANTITY_UNITS[row['quantity']]
+        return row
+
+    def _matching(self, attribute: Optional[str], quantity: Optional[str], low: Optional[float],
+                  high: Optional[float], bound: Optional[str], subject: Optional[str],
+                  jurisdictions: Optional[List[str]]) -> np.ndarray:
+        """Row numbers within [low, high] on the matching attribute slices, filtered by context"""
+        ranges = []
+        for (slice_quantity, slice_attribute), (start, stop) in self.slices.items():
+            if quantity not in (None, slice_quantity) or (attribute is not None and slice_attribute != attribute):
+                continue
+            values = self.values[start:stop]
+            first = start + (np.searchsorted(values, low, 'left') if low is not None else 0)
+            last = start + (np.searchsorted(values, high, 'right') if high is not None else len(values))
+            ranges.append(np.arange(first, last))
+        rows = np.concatenate(ranges) if ranges else np.empty(0, dtype=np.int64)
+        if bound is not None:
+            rows = rows[self.columns['bound'][rows] == bound]
+        if subject is not None:
+            rows = rows[np.array([subject in (value or '') for value in self.columns['subject'][rows]], dtype=bool)]
+        if jurisdictions is not None:
+            wanted = np.flatnonzero(np.isin(self.jurisdiction_names, list(jurisdictions)))
+            rows = rows[np.isin(self.jurisdiction_codes[rows], wanted)]
+        return rows
+
+    def _groups(self, rows: np.ndarray, keys: np.ndarray):
+        """Sort ``rows`` by ``keys`` and return them with each group's start offset"""
+        order = np.lexsort((self.values[rows], keys[rows]))
+        rows = rows[order]
+        sorted_keys = keys[rows]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]) if len(rows) else np.empty(0, dtype=np.int64)
+        return rows, starts
+
+    @traced('measurements.range_query')
+    def range_query(self, attribute: Optional[str] = None, quantity: Optional[str] = None,
+                    low: Optional[float] = None, high: Optional[float] = None, bound: Optional[str] = None,
+                    subject: Optional[str] = None, jurisdictions: Optional[List[str]] = None,
+                    limit: Optional[int] = None) -> List[Dict]:
+        """Measurements whose normalized value lies within [low, high], smallest first"""
+        rows = self._matching(attribute, quantity, low, high, bound, subject, jurisdictions)
+        rows = rows[np.argsort(self.values[rows], kind='stable')][:limit]
+        return [self._row(i) for i in rows]
+
+    @traced('measurements.by_jurisdiction')
+    def by_jurisdiction(self, attribute: Optional[str] = None, quantity: Optional[str] = None,
+                        bound: Optional[str] = None, subject: Optional[str] = None,
+                        jurisdictions: Optional[List[str]] = None) -> List[Dict]:
+        """Smallest and largest value each jurisdiction sets, e.g. its minimum stair width"""
+        rows, starts = self._groups(self._matching(attribute, quantity, None, None, bound, subject, jurisdictions),
+                                    self.jurisdiction_codes)
+        if not len(rows):
+            return []
+        stops = np.r_[starts[1:], len(rows)]
+        values = self.values[rows]
+        summary = [{
+            'jurisdiction': self.jurisdiction_names[self.jurisdiction_codes[rows[start]]],
+            'min': float(values[start]),
+            'max': float(values[stop - 1]),
+            'count': int(stop - start),
+            'sections': sorted(set(self.sections[rows[start:stop]]))
+        } for start, stop in zip(starts, stops)]
+        return sorted(summary, key=lambda entry: (entry['min'], entry['jurisdiction']))
+
+    @traced('measurements.discrepancies')
+    def discrepancies(self, jurisdictions: Optional[List[str]] = None, category: Optional[str] = None,
+                      section: Optional[str] = None, attribute: Optional[str] = None) -> List[Dict]:
+        """Same requirement, different numbers: measurements that disagree across jurisdictions.
+
+        Measurements are matched on section, quantity, attribute, bound and their order among
+        such measurements in the section. The widest relative spreads come first.
+        """
+        rows, starts = self._groups(self._matching(attribute, None, None, None, None, None, jurisdictions),
+                                    self.requirement_codes)
+        if not len(rows):
+            return []
+        stops = np.r_[starts[1:], len(rows)]
+        values = self.values[rows]
+        results = []
+        # Groups are sorted by value, so a group disagrees exactly when its ends differ
+        for start, stop in zip(starts, stops):
+            if values[start] == values[stop - 1]:
+                continue
+            category_key, section_key, quantity, attribute_key, bound, _ = self.requirements[self.requirement_codes[rows[start]]]
+            if (category is not None and category_key != category.lower()) or section not in (None, section_key):
+                continue
+            by_jurisdiction = {self.jurisdiction_names[self.jurisdiction_codes[i]]: float(self.values[i])
+                               for i in rows[start:stop]}
+            if len(by_jurisdiction) < 2:
+                continue
+            low, high = float(values[start]), float(values[stop - 1])
+            results.append({
+                'category': category_key, 'section': section_key, 'quantity': quantity,
+                'attribute': attribute_key, 'bound': bound, 'unit': QUANTITY_UNITS[quantity],
+                'values': dict(sorted(by_jurisdiction.items())), 'min': low, 'max': high,
+                'spread': (high - low) / high if high else 0.0
+            })
+        return sorted(results, key=lambda result: (-result['spread'], result['category'], result['section']))
+
+def load_measurements(db: Database, codes: List[Dict]) -> Dict[str, List[Dict]]:
+    """Stored measurements by content hash; texts never parsed are parsed in memory"""
+    measurements: Dict[str, List[Dict]] = {}
+    for row in db.backend.load_measurements():
+        measurements.setdefault(row['content_hash'], []).append(row)
+    missing = {code['content_hash'] for code in codes} - measurements.keys() - db.backend.load_measured_texts()
+    if missing:
+        for digest, text in db.get_contents(missing).items():
+            measurements[digest] = parse_measurements(text)
+    return measurements
+
+_indexes = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+@traced('measurements.get_index')
+def get_measurement_index(db: Database) -> MeasurementIndex:
+    """Process-wide measurement index for ``db``'s corpus, rebuilt when its sections change"""
+    codes = db.get_building_codes()
+    fingerprint = corpus_fingerprint(codes)
+    with _lock:
+        index = _indexes.get(db)
+        if index is None or index.fingerprint != fingerprint:
+            index = MeasurementIndex(codes, load_measurements(db, codes))
+            _indexes[db] = index
+        return index
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Query normalized measurements across jurisdictions")
+    parser.add_argument('--snapshot', help="Read a SQLite snapshot instead of Postgres")
+    parser.add_argument('--backfill', action='store_true', help="Parse measurements of texts stored before indexing")
+    parser.add_argument('--attribute', help="What is measured, e.g. width or clearance")
+    parser.add_argument('--quantity', choices=sorted(QUANTITY_UNITS))
+    parser.add_argument('--bound', choices=['min', 'max', 'value'])
+    parser.add_argument('--subject', help="Substring of the regulated element, e.g. stair")
+    parser.add_argument('--low', type=float, help="Smallest normalized value (inches, square feet or percent)")
+    parser.add_argument('--high', type=float, help="Largest normalized value")
+    parser.add_argument('--discrepancies', action='store_true', help="List requirements whose numbers differ")
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.snapshot:
+        from utils.sqlite_backend import open_snapshot
+        db = open_snapshot(args.snapshot)
+    else:
+        db = Database()
+    if args.backfill:
+        print(f"Indexed {backfill_measurements(db)} measurements")
+    index = get_measurement_index(db)
+    print(f"{len(index)} measurements, {len(index.slices)} attributes")
+    if args.discrepancies:
+        for result in index.discrepancies(attribute=args.attribute)[:args.limit]:
+            values = ', '.join(f"{jurisdiction} {value:g}" for jurisdiction, value in result['values'].items())
+            print(f"{result['category']} {result['section']} {result['attribute'] or result['quantity']} "
+                  f"({result['bound']}, {result['unit']}): {values}")
+    elif args.low is not None or args.high is not None:
+        for row in index.range_query(args.attribute, args.quantity, args.low, args.high, args.bound,
+                                     args.subject, limit=args.limit):
+            print(f"{row['jurisdiction']} - {row['category']} - Section {row['section']}: "
+                  f"{row['bound']} {row['value']:g} {row['unit']} ({row['raw']})")
+    else:
+        for row in index.by_jurisdiction(args.attribute, args.quantity, args.bound, args.subject)[:args.limit]:
+            print(f"{row['jurisdiction']}: {row['min']:g}-{row['max']:g} over {row['count']} measurements")
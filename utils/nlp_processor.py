@@ -1,6 +1,12 @@
+import hashlib
 import re
-from sklearn.feature_extraction.text import TfidfVectorizer
+import threading
+from collections import OrderedDict
+import numpy as np
+from sklearn.base import clone
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
+from utils.instrumentation import traced
 
 class BuildingCodeNLP:
     def __init__(self):
@@ -54,6 +60,7 @@ class BuildingCodeNLP:
         sentences = [s.strip() for s in sentences if s.strip()]
         return sentences
 
+    @traced('nlp.calculate_similarity')
     def calculate_similarity(self, text1, text2):
         """Calculate similarity between two texts"""
         try:
@@ -61,13 +68,56 @@ class BuildingCodeNLP:
             proc_text1 = ' '.join(self.preprocess_text(text1))
             proc_text2 = ' '.join(self.preprocess_text(text2))
             
-            # Calculate TF-IDF similarity
-            tfidf_matrix = self.vectorizer.fit_transform([proc_text1, proc_text2])
+            # Calculate TF-IDF similarity on a fresh copy so shared instances stay thread-safe
+            tfidf_matrix = clone(self.vectorizer).fit_transform([proc_text1, proc_text2])
             return float(cosine_similarity(tfidf_matrix[0:1], tfidf_matrix[1:2])[0][0])
         except Exception as e:
             print(f"Error in similarity calculation: {e}")
             return 0.5  # Return moderate similarity on error
 
+    @traced('nlp.calculate_similarities')
+    def calculate_similarities(self, pairs):
+        """Calculate calculate_similarity for many (text1, text2) pairs in one vectorized pass.
+
+        Term counts are built once over every distinct text; each pair is then scored with the
+        smoothed IDF a two-document fit would give (1 for shared terms, 1 + ln(3/2) otherwise),
+        so scores match calculate_similarity exactly.
+        """
+        if not pairs:
+            return []
+        try:
+            texts = list(dict.fromkeys(text for pair in pairs for text in pair))
+            index = {text: i for i, text in enumerate(texts)}
+            counts = CountVectorizer(stop_words='english').fit_transform(
+                [' '.join(self.preprocess_text(text)) for text in texts]
+            ).astype(float)
+        except ValueError:
+            # No usable terms anywhere in the batch
+            return [0.5] * len(pairs)
+        
+        rows1 = counts[[index[text1] for text1, _ in pairs]]
+        rows2 = counts[[index[text2] for _, text2 in pairs]]
+        shared = (rows1 > 0).multiply(rows2 > 0)
+        single_idf_sq = (1 + np.log(1.5)) ** 2
+        
+        dot = np.asarray(rows1.multiply(rows2).sum(axis=1)).ravel()
+        norms = []
+        for rows in (rows1, rows2):
+            squares = rows.multiply(rows)
+            shared_sq = np.asarray(squares.multiply(shared).sum(axis=1)).ravel()
+            total_sq = np.asarray(squares.sum(axis=1)).ravel()
+            norms.append(np.sqrt(shared_sq + single_idf_sq * (total_sq - shared_sq)))
+        
+        similarities = []
+        for score, norm1, norm2 in zip(dot, norms[0], norms[1]):
+            if norm1 == 0 and norm2 == 0:
+                similarities.append(0.5)  # Same fallback as an empty-vocabulary error
+            elif norm1 == 0 or norm2 == 0:
+                similarities.append(0.0)
+            else:
+                similarities.append(float(score / (norm1 * norm2)))
+        return similarities
+
     def extract_entities(self, text):
         """Extract entities from text"""
         text = text.lower()
@@ -121,39 +171,159 @@ class BuildingCodeNLP:
         
         return entities
 
-def analyze_code_differences(code1, code2):
-    """Analyze differences between code sections"""
-    try:
-        nlp = BuildingCodeNLP()
-        
-        similarity = nlp.calculate_similarity(code1, code2)
-        entities1 = nlp.extract_entities(code1)
-        entities2 = nlp.extract_entities(code2)
-        
-        # Find changes in requirements
-        req_changes = {
-            'added': [],
-            'removed': [],
-            'modified': []
-        }
-        
-        # Compare requirements
-        for req2 in entities2['requirements']:
-            if not any(nlp.calculate_similarity(req2['text'], req1['text']) > 0.8 
-                      for req1 in entities1['requirements']):
-                req_changes['added'].append(req2)
-        
-        for req1 in entities1['requirements']:
-            if not any(nlp.calculate_similarity(req1['text'], req2['text']) > 0.8 
-                      for req2 in entities2['requirements']):
-                req_changes['removed'].append(req1)
-        
+    def extract_citations(self, text):
+        """Normalized targets of the section and external-standard references in a text.
+
+        Returns ``{'sections': ['1601.9', ...], 'standards': ['NFPA 13', ...]}`` in order of
+        first appearance. Generic ``code`` references name no specific target and are skipped.
+        """
+        sections = re.finditer(self.reference_patterns['section'], text, re.IGNORECASE)
+        standards = re.finditer(self.reference_patterns['external'], text, re.IGNORECASE)
         return {
-            'similarity_score': similarity,
-            'entities_code1': entities1,
-            'entities_code2': entities2,
-            'requirement_changes': req_changes
+            'sections': list(dict.fromkeys(
+                re.search(r'\d+(?:\.\d+)*', match.group()).group() for match in sections
+            )),
+            'standards': list(dict.fromkeys(' '.join(match.group().upper().split()) for match in standards))
+        }
+
+def content_hash(text):
+    """Stable hash identifying a code text"""
+    return hashlib.sha256((text or '').encode('utf-8')).hexdigest()
+
+class _BoundedCache:
+    """Thread-safe LRU mapping used for per-process analysis memoization"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        """Cached value for key; threads that miss together wait for one of them to compute it"""
+        while True:
+            with self._lock:
+                if key in self._data:
+                    self._data.move_to_end(key)
+                    return self._data[key]
+                pending = self._pending.get(key)
+                if pending is None:
+                    self._pending[key] = threading.Event()
+            if pending is None:
+                break
+            # If the computing thread fails, the next waiter through takes over
+            pending.wait()
+        try:
+            value = compute()
+            self.put(key, value)
+            return value
+        finally:
+            with self._lock:
+                self._pending.pop(key).set()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+_nlp = None
+_nlp_lock = threading.Lock()
+
+def get_nlp() -> BuildingCodeNLP:
+    """Process-wide BuildingCodeNLP, built on first use and shared by every session and worker"""
+    global _nlp
+    if _nlp is None:
+        with _nlp_lock:
+            if _nlp is None:
+                _nlp = BuildingCodeNLP()
+    return _nlp
+
+_entity_cache = _BoundedCache(maxsize=4096)
+_analysis_cache = _BoundedCache(maxsize=4096)
+
+@traced('nlp.extract_entities')
+def extract_entities_cached(text, text_hash=None):
+    """Extract entities once per distinct text, shared across every pair it appears in"""
+    return _entity_cache.get_or_compute(text_hash or content_hash(text), lambda: get_nlp().extract_entities(text))
+
+def _unmatched_requirements(requirements1, requirements2, similarities):
+    """Requirements on each side with no counterpart above the 0.8 similarity threshold"""
+    matched1 = [False] * len(requirements1)
+    matched2 = [False] * len(requirements2)
+    for k, score in enumerate(similarities):
+        if score > 0.8:
+            i, j = divmod(k, len(requirements2))
+            matched1[i] = matched2[j] = True
+    added = [req for req, matched in zip(requirements2, matched2) if not matched]
+    removed = [req for req, matched in zip(requirements1, matched1) if not matched]
+    return added, removed
+
+def _swap_analysis(analysis):
+    """Derive the (code2, code1) analysis from a memoized (code1, code2) one"""
+    return {
+        'similarity_score': analysis['similarity_score'],
+        'entities_code1': analysis['entities_code2'],
+        'entities_code2': analysis['entities_code1'],
+        'requirement_changes': {
+            'added': analysis['requirement_changes']['removed'],
+            'removed': analysis['requirement_changes']['added'],
+            'modified': analysis['requirement_changes']['modified']
         }
+    }
+
+def _analyze(code1, code2, hash1, hash2, similarity=None):
+    if similarity is None:
+        similarity = get_nlp().calculate_similarity(code1, code2)
+    entities1 = extract_entities_cached(code1, hash1)
+    entities2 = extract_entities_cached(code2, hash2)
+    
+    # Compare every requirement pair in a single vectorized similarity pass
+    requirements1 = entities1['requirements']
+    requirements2 = entities2['requirements']
+    similarities = get_nlp().calculate_similarities([
+        (req1['text'], req2['text'])
+        for req1 in requirements1
+        for req2 in requirements2
+    ])
+    added, removed = _unmatched_requirements(requirements1, requirements2, similarities)
+    
+    return {
+        'similarity_score': similarity,
+        'entities_code1': entities1,
+        'entities_code2': entities2,
+        'requirement_changes': {
+            'added': added,
+            'removed': removed,
+            'modified': []
+        }
+    }
+
+@traced('nlp.analyze_code_differences')
+def analyze_code_differences(code1, code2, similarity=None):
+    """Analyze differences between code sections, memoized by the content-hash pair.
+
+    Pass ``similarity`` when the pair was already scored, e.g. by the batched comparison service.
+    """
+    try:
+        hash1, hash2 = content_hash(code1), content_hash(code2)
+        cached = _analysis_cache.get((hash2, hash1))
+        if cached is not None:
+            return _swap_analysis(cached)
+        return _analysis_cache.get_or_compute(
+            (hash1, hash2), lambda: _analyze(code1, code2, hash1, hash2, similarity))
     except Exception as e:
         print(f"Error in code difference analysis: {e}")
         return {
@@ -0,0 +1,215 @@
+import argparse
+import os
+import smtplib
+from collections import defaultdict
+from contextlib import contextmanager
+from email.message import EmailMessage
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from utils.code_tracker import CodeTracker
+
+WILDCARD = None
+
+class SubscriptionIndex:
+    """In-memory index of subscribers keyed by (jurisdiction, category).
+
+    A ``None`` jurisdiction or category acts as a wildcard, so matching an update is at most
+    four dictionary lookups regardless of how many subscribers exist.
+    """
+
+    def __init__(self, subscriptions: Iterable[Dict] = ()):
+        self._index: Dict[Tuple[Optional[str], Optional[str]], Set[str]] = defaultdict(set)
+        for subscription in subscriptions:
+            self.add(subscription['user_email'], subscription['jurisdiction'], subscription['category'])
+
+    @staticmethod
+    def _key(value: Optional[str]) -> Optional[str]:
+        return value.strip().lower() if value else WILDCARD
+
+    def update_key(self, jurisdiction: str, category: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+        return self._key(jurisdiction), self._key(category)
+
+    def add(self, email: str, jurisdiction: Optional[str], category: Optional[str]):
+        self._index[(self._key(jurisdiction), self._key(category))].add(email)
+
+    def matching_keys(self, jurisdiction_key: Optional[str], category_key: Optional[str]) -> Set[Tuple]:
+        """Subscription keys, including wildcards, that cover an update key"""
+        candidates = {(jurisdiction_key, category_key), (jurisdiction_key, WILDCARD),
+                      (WILDCARD, category_key), (WILDCARD, WILDCARD)}
+        return {key for key in candidates if key in self._index}
+
+    def match(self, jurisdiction: str, category: Optional[str]) -> Set[str]:
+        recipients = set()
+        for key in self.matching_keys(*self.update_key(jurisdiction, category)):
+            recipients |= self._index[key]
+        return recipients
+
+    def subscribers(self, key: Tuple) -> Set[str]:
+        return self._index.get(key, set())
+
+    def __len__(self):
+        return sum(len(emails) for emails in self._index.values())
+
+class OutboxTransport:
+    """Local stand-in for SMTP that keeps sent messages in memory"""
+
+    def __init__(self):
+        self.sent: List[Tuple[EmailMessage, List[str]]] = []
+
+    @contextmanager
+    def session(self):
+        yield self
+
+    def send(self, message: EmailMessage, recipients: List[str]):
+        self.sent.append((message, list(recipients)))
+
+class SmtpTransport:
+    """Send digests over one SMTP connection per dispatch run"""
+
+    def __init__(self, host: Optional[str] = None, port: Optional[int] = None,
+                 username: Optional[str] = None, password: Optional[str] = None,
+                 use_tls: bool = True):
+        self.host = host or os.environ.get('SMTP_HOST', 'localhost')
+        self.port = port or int(os.environ.get('SMTP_PORT', 587))
+        self.username = username or os.environ.get('SMTP_USER')
+        self.password = password or os.environ.get('SMTP_PASSWORD')
+        self.use_tls = use_tls
+        self._smtp = None
+
+    @contextmanager
+    def session(self):
+        with smtplib.SMTP(self.host, self.port) as smtp:
+            if self.use_tls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            self._smtp = smtp
+            try:
+                yield self
+            finally:
+                self._smtp = None
+
+    def send(self, message: EmailMessage, recipients: List[str]):
+        # Recipients go in the envelope only, so identical digests share one message
+        self._smtp.send_message(message, to_addrs=recipients)
+
+def format_digest(updates: List[Dict], sender: str) -> EmailMessage:
+    """Build one digest message listing every matched update"""
+    message = EmailMessage()
+    message['From'] = sender
+    message['To'] = 'undisclosed-recipients:;'
+    message['Subject'] = f"Building code updates: {len(updates)} change(s)"
+
+    lines = ["The following building code updates match your subscriptions:", ""]
+    for update in updates:
+        lines.append(
+            f"- {update['jurisdiction']} - {update['category']} - Section {update['section']}: "
+            f"{update['change_type']} (version {update['version_number']}, {update['update_date']})"
+        )
+    message.set_content("\n".join(lines))
+    return message
+
+class NotificationDispatcher:
+    """Match new code updates against subscriptions and send per-user digests.
+
+    Update ids are assigned when a row is inserted, not when its transaction commits, so an
+    update can become visible after higher ids already have. Ids a run skips over are stored
+    as open gaps and looked up by id on later runs until they show up or ``gap_timeout``
+    seconds pass (the transaction rolled back), so no update is scanned twice. The watermark
+    and gaps are only stored after the digests have been sent. Subscribers whose
+    subscriptions matched the same updates share one rendered digest, sent to them in
+    envelope batches of ``recipients_per_message``.
+    """
+
+    def __init__(self, code_tracker: CodeTracker, transport=None,
+                 sender: Optional[str] = None, batch_size: int = 1000,
+                 recipients_per_message: int = 100,
+                 watermark_name: str = 'notification_digest', gap_timeout: float = 3600):
+        self.code_tracker = code_tracker
+        self.transport = transport or SmtpTransport()
+        self.sender = sender or os.environ.get('NOTIFICATION_SENDER', 'updates@localhost')
+        self.batch_size = batch_size
+        self.recipients_per_message = recipients_per_message
+        self.watermark_name = watermark_name
+        self.gap_timeout = gap_timeout
+
+    @staticmethod
+    def match_updates(index: SubscriptionIndex, updates: List[Dict]) -> Dict[Tuple, List[Dict]]:
+        """Map each subscription key to the updates it covers"""
+        matched = defaultdict(list)
+        for update in updates:
+            for key in index.matching_keys(*index.update_key(update['jurisdiction'], update['category'])):
+                matched[key].append(update)
+        return matched
+
+    @staticmethod
+    def build_digests(index: SubscriptionIndex, matched: Dict[Tuple, List[Dict]]) -> Dict[frozenset, List[str]]:
+        """Group subscribers by the exact set of subscription keys that matched for them"""
+        keys_by_email = defaultdict(set)
+        for key in matched:
+            for email in index.subscribers(key):
+                keys_by_email[email].add(key)
+
+        digests = defaultdict(list)
+        for email, keys in keys_by_email.items():
+            digests[frozenset(keys)].append(email)
+        return digests
+
+    def dispatch(self) -> Dict:
+        """Send one digest per subscriber for every update past the watermark"""
+        index = SubscriptionIndex(self.code_tracker.get_all_subscriptions())
+        watermark = self.code_tracker.get_watermark(self.watermark_name)
+        gaps = self.code_tracker.get_open_gaps(self.watermark_name)
+        # Skipped ids whose transactions have committed since an earlier run
+        pending = self.code_tracker.get_code_updates_by_ids(sorted(gaps)) if gaps else []
+        closed_gaps = [update['id'] for update in pending]
+        opened_gaps = []
+        position = watermark
+
+        while True:
+            updates = self.code_tracker.get_code_updates_after(position, self.batch_size)
+            for update in updates:
+                # Before the first run nothing was skipped, only history
+                if position:
+                    opened_gaps.extend(range(position + 1, update['id']))
+                position = update['id']
+            pending.extend(updates)
+            if len(updates) < self.batch_size:
+                break
+
+        matched = self.match_updates(index, pending)
+        digests = self.build_digests(index, matched)
+        if digests:
+            with self.transport.session() as transport:
+                for keys, recipients in digests.items():
+                    # Wildcard keys can cover the same update, so dedupe by id
+                    updates = sorted(
+                        {update['id']: update for key in keys for update in matched[key]}.values(),
+                        key=lambda update: update['id']
+                    )
+                    message = format_digest(updates, self.sender)
+                    for start in range(0, len(recipients), self.recipients_per_message):
+                        transport.send(message, recipients[start:start + self.recipients_per_message])
+        if pending or gaps:
+            self.code_tracker.set_watermark(self.watermark_name, position, opened_gaps, closed_gaps,
+                                            gap_timeout=self.gap_timeout)
+
+        return {
+            'updates': len(pending),
+            'recipients': sum(len(recipients) for recipients in digests.values()),
+            'digests': len(digests),
+            'watermark': position,
+            'open_gaps': len(gaps) - len(closed_gaps) + len(opened_gaps)
+        }
+
+if __name__ == '__main__':
+    from database import Database
+
+    parser = argparse.ArgumentParser(description="Send pending building code update digests")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--gap-timeout', type=float, default=3600,
+                        help="Seconds a skipped update id is waited for before it is treated as rolled back")
+    args = parser.parse_args()
+
+    dispatcher = NotificationDispatcher(CodeTracker(Database()), batch_size=args.batch_size,
+                                        gap_timeout=args.gap_timeout)
+    print(dispatcher.dispatch())
@@ -0,0 +1,285 @@
+import argparse
+import json
+import threading
+import weakref
+from collections import Counter, deque
+from typing import Dict, List, Optional
+from psycopg2.extras import execute_values
+from database import Database, corpus_fingerprint
+from utils.change_feed import notify_change
+from utils.instrumentation import traced
+from utils.nlp_processor import get_nlp
+
+def ensure_reference_storage(db: Database):
+    """Create the per-text citation table: one row per distinct text, its targets as arrays"""
+    with db.get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS code_references (
+                    content_hash TEXT PRIMARY KEY,
+                    sections TEXT[] NOT NULL,
+                    standards TEXT[] NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS code_references_standards_idx ON code_references USING gin (standards);
+            """)
+            conn.commit()
+
+def index_references(cur, contents: Dict[str, str]) -> int:
+    """Record the citations of newly stored texts; texts are content-addressed, so existing rows stand.
+
+    The change event is delivered when the caller commits, like the rows themselves.
+    """
+    nlp = get_nlp()
+    rows = []
+    for digest, text in contents.items():
+        citations = nlp.extract_citations(text)
+        rows.append((digest, citations['sections'], citations['standards']))
+    if rows:
+        execute_values(cur, """
+            INSERT INTO code_references (content_hash, sections, standards) VALUES %s
+            ON CONFLICT (content_hash) DO NOTHING
+        """, rows, page_size=1000)
+        notify_change(cur, 'code_references', op='INSERT')
+    return len(rows)
+
+@traced('references.backfill')
+def backfill_references(db: Database, batch_size: int = 2000) -> int:
+    """Index the citations of texts stored before reference tracking existed"""
+    db.require_content_storage()
+    ensure_reference_storage(db)
+    indexed = 0
+    with db.get_connection() as conn:
+        with conn.cursor() as cur:
+            while True:
+                cur.execute("""
+                    SELECT cc.content_hash, cc.content
+                    FROM code_contents cc
+                    WHERE NOT EXISTS (SELECT 1 FROM code_references cr WHERE cr.content_hash = cc.content_hash)
+                    LIMIT %s
+                """, (batch_size,))
+                rows = cur.fetchall()
+                if not rows:
+                    return indexed
+                indexed += index_references(cur, dict(rows))
+                conn.commit()
+
+class _JurisdictionGraph:
+    """One jurisdiction's nodes and edges; citations never leave their jurisdiction"""
+
+    def __init__(self, codes: List[Dict], references: Dict[str, Dict]):
+        self.fingerprint = corpus_fingerprint(codes)
+        self.codes = {code['id']: {key: code[key] for key in ('id', 'jurisdiction', 'category', 'section')}
+                      for code in codes}
+        self.by_section: Dict[tuple, List[int]] = {}
+        subsections: Dict[tuple, List[int]] = {}
+        for code in codes:
+            self.by_section.setdefault((code['jurisdiction'], code['section']), []).append(code['id'])
+            parts = (code['section'] or '').split('.')
+            for depth in range(1, len(parts)):
+                subsections.setdefault((code['jurisdiction'], '.'.join(parts[:depth])), []).append(code['id'])
+
+        self.cites: Dict[int, List[int]] = {}
+        self.cited_by: Dict[int, List[int]] = {}
+        self.standards: Dict[int, List[str]] = {}
+        for code in codes:
+            citations = references.get(code['content_hash'])
+            if not citations:
+                continue
+            targets = []
+            for section in citations['sections']:
+                key = (code['jurisdiction'], section)
+                targets.extend(self.by_section.get(key) or subsections.get(key, []))
+            targets = [target for target in dict.fromkeys(targets) if target != code['id']]
+            if targets:
+                self.cites[code['id']] = targets
+                for target in targets:
+                    self.cited_by.setdefault(target, []).append(code['id'])
+            if citations['standards']:
+                self.standards[code['id']] = list(citations['standards'])
+
+def group_by_jurisdiction(codes: List[Dict]) -> Dict[str, List[Dict]]:
+    grouped: Dict[str, List[Dict]] = {}
+    for code in codes:
+        grouped.setdefault(code['jurisdiction'], []).append(code)
+    return grouped
+
+class ReferenceGraph:
+    """Sections as nodes and citations as edges, held as adjacency lists in both directions.
+
+    A section citation resolves within the citing jurisdiction, to the section with that number
+    or, when only a parent number is cited, to its subsections. Standards are leaf nodes.
+    Since no edge crosses jurisdictions, the graph is assembled from per-jurisdiction parts and
+    ``updated`` rebuilds only the jurisdictions whose sections changed.
+    """
+
+    def __init__(self, codes: List[Dict], references: Dict[str, Dict],
+                 parts: Optional[Dict[str, _JurisdictionGraph]] = None):
+        self.fingerprint = corpus_fingerprint(codes)
+        reusable = parts or {}
+        self.parts: Dict[str, _JurisdictionGraph] = {}
+        for jurisdiction, jurisdiction_codes in group_by_jurisdiction(codes).items():
+            part = reusable.get(jurisdiction)
+            if part is None or part.fingerprint != corpus_fingerprint(jurisdiction_codes):
+                part = _JurisdictionGraph(jurisdiction_codes, references)
+            self.parts[jurisdiction] = part
+
+        self.codes: Dict[int, Dict] = {}
+        self.by_section: Dict[tuple, List[int]] = {}
+        self.cites: Dict[int, List[int]] = {}
+        self.cited_by: Dict[int, List[int]] = {}
+        self.standards: Dict[int, List[str]] = {}
+        self.citers_of_standard: Dict[str, List[int]] = {}
+        for part in self.parts.values():
+            self.codes.update(part.codes)
+            self.by_section.update(part.by_section)
+            self.cites.update(part.cites)
+            self.cited_by.update(part.cited_by)
+            self.standards.update(part.standards)
+            for code_id, standards in part.standards.items():
+                for standard in standards:
+                    self.citers_of_standard.setdefault(standard, []).append(code_id)
+
+    def changed_jurisdictions(self, codes: List[Dict]) -> List[str]:
+        """Jurisdictions of ``codes`` whose sections differ from the ones this graph was built from"""
+        return [jurisdiction for jurisdiction, jurisdiction_codes in group_by_jurisdiction(codes).items()
+                if jurisdiction not in self.parts
+                or self.parts[jurisdiction].fingerprint != corpus_fingerprint(jurisdiction_codes)]
+
+    def updated(self, codes: List[Dict], references: Dict[str, Dict]) -> 'ReferenceGraph':
+        """A new graph for ``codes`` that reuses this one's unchanged jurisdictions.
+
+        ``references`` only needs the citations of the changed jurisdictions' texts. This graph is
+        left as it is, so threads already walking it never see a partial update.
+        """
+        return type(self)(codes, references, self.parts)
+
+    def stats(self) -> Dict:
+        return {
+            'sections': len(self.codes),
+            'section_edges': sum(len(targets) for targets in self.cites.values()),
+            'standard_edges': sum(len(standards) for standards in self.standards.values()),
+            'standards': len(self.citers_of_standard)
+        }
+
+    def _walk(self, start: Dict[int, int], adjacency: Dict[int, List[int]],
+              max_depth: Optional[int]) -> Dict[int, int]:
+        """Breadth-first depths of every node reachable from ``start`` (node -> starting depth)"""
+        depths = dict(start)
+        queue = deque(start)
+        while queue:
+            node = queue.popleft()
+            if max_depth is not None and depths[node] >= max_depth:
+                continue
+            for neighbour in adjacency.get(node, ()):
+                if neighbour not in depths:
+                    depths[neighbour] = depths[node] + 1
+                    queue.append(neighbour)
+        return depths
+
+    def _rows(self, depths: Dict[int, int], jurisdiction: Optional[str] = None) -> List[Dict]:
+        rows = [dict(self.codes[code_id], depth=depth) for code_id, depth in depths.items()
+                if jurisdiction is None or self.codes[code_id]['jurisdiction'] == jurisdiction]
+        return sorted(rows, key=lambda row: (row['depth'], row['jurisdiction'], row['section'] or ''))
+
+    def match_standards(self, standard: str) -> List[str]:
+        """Standards named by ``standard``: one designation ("NFPA 13") or a whole body ("NFPA")"""
+        standard = ' '.join(standard.upper().split())
+        return sorted(name for name in self.citers_of_standard
+                      if name == standard or name.startswith(standard + ' '))
+
+    @traced('references.dependents_of_standard')
+    def dependents_of_standard(self, standard: str, jurisdiction: Optional[str] = None,
+                               max_depth: Optional[int] = None) -> List[Dict]:
+        """Sections citing a standard directly (depth 1) or through the sections that do"""
+        start = {code_id: 1 for name in self.match_standards(standard) for code_id in self.citers_of_standard[name]}
+        return self._rows(self._walk(start, self.cited_by, max_depth), jurisdiction)
+
+    @traced('references.impact_radius')
+    def impact_radius(self, jurisdiction: str, section: str, max_depth: Optional[int] = None) -> List[Dict]:
+        """Sections that depend on a section, directly or transitively, so amending it may affect them"""
+        start = {code_id: 0 for code_id in self.by_section.get((jurisdiction, section), [])}
+        depths = self._walk(start, self.cited_by, max_depth)
+        return self._rows({code_id: depth for code_id, depth in depths.items() if code_id not in start})
+
+    @traced('references.dependencies')
+    def dependencies(self, jurisdiction: str, section: str, max_depth: Optional[int] = None) -> Dict:
+        """Sections a section relies on, transitively, and every standard they cite"""
+        start = {code_id: 0 for code_id in self.by_section.get((jurisdiction, section), [])}
+        depths = self._walk(start, self.cites, max_depth)
+        standards = sorted({name for code_id in depths for name in self.standards.get(code_id, [])})
+        return {
+            'sections': self._rows({code_id: depth for code_id, depth in depths.items() if code_id not in start}),
+            'standards': standards
+        }
+
+    def top_standards(self, jurisdiction: Optional[str] = None, limit: int = 10) -> Dict[str, List]:
+        """Most-cited external standards per jurisdiction, counted by citing sections"""
+        counts: Dict[str, Counter] = {}
+        for name, citers in self.citers_of_standard.items():
+            for code_id in citers:
+                code_jurisdiction = self.codes[code_id]['jurisdiction']
+                if jurisdiction is None or code_jurisdiction == jurisdiction:
+                    counts.setdefault(code_jurisdiction, Counter())[name] += 1
+        return {name: counter.most_common(limit) for name, counter in sorted(counts.items())}
+
+def load_references(db: Database, codes: List[Dict]) -> Dict[str, Dict]:
+    """Stored citations of ``codes``' texts by content hash; texts not yet indexed are extracted in memory"""
+    hashes = sorted({code['content_hash'] for code in codes if code['content_hash']})
+    references = {row['content_hash']: row for row in db.backend.load_references(hashes)}
+    missing = {code['content_hash'] for code in codes} - references.keys()
+    if missing:
+        nlp = get_nlp()
+        for digest, text in db.get_contents(missing).items():
+            references[digest] = nlp.extract_citations(text)
+    return references
+
+_graphs = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+@traced('references.get_graph')
+def get_reference_graph(db: Database) -> ReferenceGraph:
+    """Process-wide graph for ``db``'s corpus; only jurisdictions whose sections changed are rebuilt"""
+    codes = db.get_building_codes()
+    fingerprint = corpus_fingerprint(codes)
+    with _lock:
+        graph = _graphs.get(db)
+        if graph is None:
+            graph = ReferenceGraph(codes, load_references(db, codes))
+        elif graph.fingerprint != fingerprint:
+            changed = set(graph.changed_jurisdictions(codes))
+            graph = graph.updated(codes, load_references(db, [code for code in codes
+                                                             if code['jurisdiction'] in changed]))
+        _graphs[db] = graph
+        return graph
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Query the cross-reference graph of building code citations")
+    parser.add_argument('--snapshot', help="Read a SQLite snapshot instead of Postgres")
+    parser.add_argument('--backfill', action='store_true', help="Index citations of texts stored before tracking")
+    parser.add_argument('--standard', help="Sections depending on a standard, e.g. 'NFPA 13' or 'NFPA'")
+    parser.add_argument('--impact', nargs=2, metavar=('JURISDICTION', 'SECTION'),
+                        help="Sections affected by amending a section")
+    parser.add_argument('--top', action='store_true', help="Most-cited standards per jurisdiction")
+    parser.add_argument('--jurisdiction', help="Limit --standard and --top to one jurisdiction")
+    parser.add_argument('--max-depth', type=int, help="Stop following citations after this many hops")
+    args = parser.parse_args()
+
+    if args.snapshot:
+        from utils.sqlite_backend import open_snapshot
+        db = open_snapshot(args.snapshot)
+    else:
+        db = Database()
+    if args.backfill:
+        print(f"Indexed citations of {backfill_references(db)} texts")
+    graph = get_reference_graph(db)
+    print(json.dumps(graph.stats()))
+    if args.standard:
+        rows = graph.dependents_of_standard(args.standard, args.jurisdiction, args.max_depth)
+        for row in rows:
+            print(f"{row['depth']}  {row['jurisdiction']} - {row['category']} - Section {row['section']}")
+    if args.impact:
+        for row in graph.impact_radius(args.impact[0], args.impact[1], args.max_depth):
+            print(f"{row['depth']}  {row['jurisdiction']} - {row['category']} - Section {row['section']}")
+    if args.top:
+        for jurisdiction, standards in graph.top_standards(args.jurisdiction).items():
+            print(f"{jurisdiction}: " + ', '.join(f"{name} ({count})" for name, count in standards))
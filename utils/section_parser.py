@@ -0,0 +1,178 @@
+import io
+import re
+from collections import Counter
+from html.parser import HTMLParser
+from typing import Dict, Iterator, Optional, TextIO, Union
+from utils.nlp_processor import get_nlp
+
+# "Section 1011.2 Title", "SEC. R301.2", "§ 903.3.1" or a bare dotted number such as "1011.2.1 Title"
+HEADING = re.compile(
+    r'^\s*(?:(?:section|sec\.|§)\s*(?P<explicit>[A-Z]?\d+[A-Za-z]?(?:\.\d+[A-Za-z]?)*)'
+    r'|(?P<bare>[A-Z]?\d+(?:\.\d+[A-Za-z]?)+))\b[\s.:-]*(?P<title>.*)$',
+    re.IGNORECASE
+)
+BLOCK_TAGS = {'p', 'div', 'br', 'li', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'section', 'article'}
+
+# One alternation over every technical term, so tagging a section is a single regex pass
+_TERM_CATEGORY = {
+    term: category
+    for category, terms in get_nlp().technical_terms.items()
+    for term in terms
+}
+_TERM_PATTERN = re.compile(
+    r'\b(' + '|'.join(map(re.escape, sorted(_TERM_CATEGORY, key=len, reverse=True))) + r')s?\b',
+    re.IGNORECASE
+)
+
+class _TextExtractor(HTMLParser):
+    """Incrementally flatten HTML to text, keeping block boundaries as line breaks"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('script', 'style'):
+            self._skip += 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in ('script', 'style'):
+            self._skip = max(0, self._skip - 1)
+        elif tag in BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+    def take(self) -> str:
+        text = ''.join(self.parts)
+        self.parts = []
+        return text
+
+def html_to_text(html: str) -> str:
+    return '\n'.join(iter_text_lines(io.StringIO(html), html=True))
+
+def iter_text_lines(stream: Union[str, TextIO], chunk_size: int = 1 << 16,
+                    html: Optional[bool] = None) -> Iterator[str]:
+    """Yield text lines from a plain-text or HTML document, reading ``chunk_size`` characters at a time"""
+    if isinstance(stream, str):
+        with open(stream, encoding='utf-8', errors='replace') as f:
+            yield from iter_text_lines(f, chunk_size, html)
+        return
+
+    extractor = None
+    pending = ''
+    # Read enough up front to sniff for HTML even with tiny chunk sizes
+    chunk = stream.read(max(chunk_size, 4096))
+    while True:
+        eof = not chunk
+        if html is None:
+            html = bool(re.search(r'<\s*(?:html|body|div|p|h\d)\b', chunk, re.IGNORECASE))
+        if html:
+            extractor = extractor or _TextExtractor()
+            if eof:
+                extractor.close()
+            else:
+                extractor.feed(chunk)
+            chunk = extractor.take()
+
+        pending += chunk
+        lines = pending.split('\n')
+        # The last piece may be a partial line; keep it until more text arrives
+        pending = '' if eof else lines.pop()
+        for line in lines:
+            yield line
+        if eof:
+            return
+        chunk = stream.read(chunk_size)
+
+def categorize(text: str, default: Optional[str] = None) -> Optional[str]:
+    """Tag text with the technical_terms category it mentions most"""
+    counts = Counter(_TERM_CATEGORY[term.lower()] for term in _TERM_PATTERN.findall(text))
+    if not counts:
+        return default
+    return counts.most_common(1)[0][0].title()
+
+def _heading(line: str) -> Optional[Dict]:
+    match = HEADING.match(line)
+    if not match:
+        return None
+    title = match.group('title').strip()
+    if match.group('bare') and not (title[:1].isalpha() and title[:1].isupper()):
+        # Bare numbers are only headings when followed by a title, not "2.5 inches"
+        return None
+    number = match.group('explicit') or match.group('bare')
+    return {'section': number, 'title': title}
+
+def iter_sections(stream: Union[str, TextIO], jurisdiction: Optional[str] = None,
+                  category: Optional[str] = None, chunk_size: int = 1 << 16, html: Optional[bool] = None) -> Iterator[Dict]:
+    """Stream section and subsection records out of a long code document.
+
+    Only the section being read is held in memory. Each record carries its dotted ``section``
+    number, ``parent`` and ``level`` (1 for "1011", 3 for "1011.2.3"), and the given ``category``;
+    without one it is None and ingest classifies the sections a batch at a time.
+    """
+    current, lines = None, []
+
+    def flush():
+        content = ' '.join(' '.join(lines).split())
+        if not content:
+            return None
+        number = current['section']
+        parts = number.split('.')
+        return {
+            'jurisdiction': jurisdiction,
+            'category': category,
+            'section': number,
+            'parent': '.'.join(parts[:-1]) or None,
+            'level': len(parts),
+            'title': current['title'],
+            'content': content
+        }
+
+    for line in iter_text_lines(stream, chunk_size, html):
+        heading = _heading(line)
+        if heading:
+            if current:
+                record = flush()
+                if record:
+                    yield record
+            current, lines = heading, [heading['title']]
+        elif current:
+            lines.append(line)
+
+    if current:
+        record = flush()
+        if record:
+            yield record
+
+def load_document(path: str, jurisdiction: str, code_tracker, category: Optional[str] = None,
+                  batch_size: int = 1000) -> int:
+    """Stream a whole code document into building_codes in fixed-size batches"""
+    loaded, batch = 0, []
+    for record in iter_sections(path, jurisdiction, category):
+        batch.append(record)
+        if len(batch) >= batch_size:
+            code_tracker.bulk_upsert_codes(batch)
+            loaded += len(batch)
+            batch = []
+    if batch:
+        code_tracker.bulk_upsert_codes(batch)
+        loaded += len(batch)
+    return loaded
+
+if __name__ == '__main__':
+    import argparse
+    from database import Database
+    from utils.code_tracker import CodeTracker
+
+    parser = argparse.ArgumentParser(description="Load a full code document section by section")
+    parser.add_argument('path', help="Text or HTML code document")
+    parser.add_argument('--jurisdiction', required=True)
+    parser.add_argument('--category', help="Category for every section (default: classified at ingest)")
+    args = parser.parse_args()
+    print(load_document(args.path, args.jurisdiction, CodeTracker(Database()), args.category))
@@ -0,0 +1,271 @@
+import os
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+import joblib
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import TruncatedSVD
+from sklearn.feature_extraction.text import TfidfVectorizer
+from database import corpus_fingerprint
+from utils.instrumentation import traced
+
+DEFAULT_INDEX_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache', 'semantic_index.joblib'
+)
+# LSA dimensions; enough to separate sections while keeping the vectors small
+DIMENSIONS = 128
+# Below this many distinct texts a brute-force scan beats probing clusters
+EXACT_SEARCH_LIMIT = 2000
+# Clusters searched per query; more is slower but misses fewer neighbours
+DEFAULT_NPROBE = 8
+# New texts beyond this share of the corpus trigger a full refit instead of a projection
+REFIT_SHARE = 0.1
+# Cosine similarity from which two sections count as the same provision
+MIN_ALIGNMENT_SCORE = 0.6
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+class SemanticIndex:
+    """LSA vectors for every distinct section text, with an inverted-file nearest-neighbour index.
+
+    Texts shared by several sections are embedded once. Vectors are grouped into k-means
+    clusters; a query scores the ``nprobe`` closest clusters exactly, so it touches a small
+    fraction of the corpus.
+    """
+
+    def __init__(self, vectorizer: TfidfVectorizer, svd: TruncatedSVD, hashes: List[str],
+                 vectors: np.ndarray, codes: List[Dict], centroids: Optional[np.ndarray] = None):
+        self.vectorizer = vectorizer
+        self.svd = svd
+        self.hashes = list(hashes)
+        self.vectors = vectors
+        self.row_of = {digest: row for row, digest in enumerate(self.hashes)}
+        self.centroids = centroids
+        self._assign_lists()
+        self.set_codes(codes)
+
+    @classmethod
+    @traced('semantic.build_index')
+    def build(cls, codes: List[Dict], contents: Dict[str, str], dimensions: int = DIMENSIONS) -> 'SemanticIndex':
+        hashes = sorted({code['content_hash'] for code in codes if code['content_hash'] in contents})
+        texts = [contents[digest] for digest in hashes]
+        vectorizer = TfidfVectorizer(stop_words='english', sublinear_tf=True, ngram_range=(1, 2),
+                                     max_features=50000, dtype=np.float32)
+        tfidf = vectorizer.fit_transform(texts)
+        components = max(1, min(dimensions, tfidf.shape[0] - 1, tfidf.shape[1] - 1))
+        svd = TruncatedSVD(n_components=components, random_state=0)
+        vectors = _normalize(svd.fit_transform(tfidf))
+        centroids = None
+        if len(hashes) > EXACT_SEARCH_LIMIT:
+            kmeans = MiniBatchKMeans(n_clusters=int(np.sqrt(len(hashes))), random_state=0, n_init=3,
+                                     batch_size=4096)
+            kmeans.fit(vectors)
+            centroids = _normalize(kmeans.cluster_centers_)
+        return cls(vectorizer, svd, hashes, vectors, codes, centroids)
+
+    def _assign_lists(self):
+        """Sort rows by their nearest centroid so each cluster is one contiguous slice"""
+        if self.centroids is None:
+            self.list_rows, self.list_offsets = None, None
+            return
+        assignments = np.argmax(self.vectors @ self.centroids.T, axis=1)
+        self.list_rows = np.argsort(assignments, kind='stable')
+        self.list_offsets = np.searchsorted(assignments[self.list_rows], np.arange(len(self.centroids) + 1))
+
+    def set_codes(self, codes: List[Dict]):
+        """Map sections onto vector rows; cheap, so renames and moves don't need re-embedding"""
+        self.codes = [
+            {key: code[key] for key in ('id', 'jurisdiction', 'category', 'section', 'content_hash')}
+            for code in codes if code['content_hash'] in self.row_of
+        ]
+        self.fingerprint = corpus_fingerprint(codes)
+        self.codes_by_row: Dict[int, List[int]] = {}
+        self.code_rows = np.empty(len(self.codes), dtype=np.int64)
+        self.codes_by_jurisdiction: Dict[str, List[int]] = {}
+        for position, code in enumerate(self.codes):
+            row = self.row_of[code['content_hash']]
+            self.code_rows[position] = row
+            self.codes_by_row.setdefault(row, []).append(position)
+            self.codes_by_jurisdiction.setdefault(code['jurisdiction'], []).append(position)
+
+    def with_texts(self, contents: Dict[str, str], codes: List[Dict]) -> 'SemanticIndex':
+        """A new index that adds texts projected with the fitted model and maps ``codes`` onto it.
+
+        This index is left as it is, so threads already searching it never see a partial update.
+        """
+        new = [digest for digest in contents if digest not in self.row_of]
+        vectors = self.vectors
+        if new:
+            vectors = np.vstack([self.vectors, self.embed([contents[digest] for digest in new])])
+        return type(self)(self.vectorizer, self.svd, self.hashes + new, vectors, codes, self.centroids)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return _normalize(self.svd.transform(self.vectorizer.transform(texts)))
+
+    def _candidate_rows(self, vector: np.ndarray, nprobe: int) -> Optional[np.ndarray]:
+        if self.centroids is None:
+            return None
+        nearest = np.argsort(-(self.centroids @ vector))[:nprobe]
+        return np.concatenate([self.list_rows[self.list_offsets[c]:self.list_offsets[c + 1]] for c in nearest])
+
+    @traced('semantic.search')
+    def search(self, vector: np.ndarray, k: int = 10, nprobe: int = DEFAULT_NPROBE,
+               accept: Optional[Callable[[Dict], bool]] = None) -> List[Tuple[Dict, float]]:
+        """Sections whose text is closest to ``vector``, best first, optionally filtered by ``accept``"""
+        rows = self._candidate_rows(vector, nprobe)
+        scores = (self.vectors if rows is None else self.vectors[rows]) @ vector
+        order = np.argsort(-scores)
+        results = []
+        for index in order:
+            row = int(index if rows is None else rows[index])
+            for position in self.codes_by_row.get(row, []):
+                code = self.codes[position]
+                if accept is None or accept(code):
+                    results.append((code, float(scores[index])))
+                    if len(results) >= k:
+                        return results
+        return results
+
+    def more_like_this(self, content_hash: str, k: int = 10, exclude_jurisdiction: Optional[str] = None,
+                       nprobe: int = DEFAULT_NPROBE) -> List[Tuple[Dict, float]]:
+        """Sections similar to a stored text, excluding exact copies of it"""
+        row = self.row_of.get(content_hash)
+        if row is None:
+            return []
+        return self.search(self.vectors[row], k, nprobe, accept=lambda code: (
+            code['content_hash'] != content_hash and code['jurisdiction'] != exclude_jurisdiction
+        ))
+
+    def counterpart(self, content_hash: str, jurisdiction: str, category: Optional[str] = None,
+                    min_score: float = MIN_ALIGNMENT_SCORE) -> Optional[Tuple[Dict, float]]:
+        """The section of ``jurisdiction`` closest in content to a stored text, if close enough"""
+        row = self.row_of.get(content_hash)
+        positions = [p for p in self.codes_by_jurisdiction.get(jurisdiction, [])
+                     if category is None or (self.codes[p]['category'] or '').lower() == category.lower()]
+        if row is None or not positions:
+            return None
+        scores = self.vectors[self.code_rows[positions]] @ self.vectors[row]
+        best = int(np.argmax(scores))
+        if scores[best] < min_score:
+            return None
+        return self.codes[positions[best]], float(scores[best])
+
+    @traced('semantic.align_sections')
+    def align_sections(self, jurisdiction1: str, jurisdiction2: str, category: Optional[str] = None,
+                       min_score: float = MIN_ALIGNMENT_SCORE) -> List[Dict]:
+        """Pair each section of one jurisdiction with its counterpart in another by content.
+
+        Pairs are taken greedily from the highest similarity down, one partner per section, so a
+        renumbered section still finds its equivalent. Sections sharing a number and category
+        are paired first when they clear the threshold.
+        """
+        def positions(jurisdiction):
+            return [p for p in self.codes_by_jurisdiction.get(jurisdiction, [])
+                    if category is None or (self.codes[p]['category'] or '').lower() == category.lower()]
+        left, right = positions(jurisdiction1), positions(jurisdiction2)
+        if not left or not right:
+            return []
+        scores = self.vectors[self.code_rows[left]] @ self.vectors[self.code_rows[right]].T
+
+        # Favour same-numbered sections so an unchanged numbering is never shuffled
+        same = np.array([[self.codes[a]['section'] == self.codes[b]['section']
+                          and (self.codes[a]['category'] or '').lower() == (self.codes[b]['category'] or '').lower()
+                          for b in right] for a in left])
+        ranked = np.where(same & (scores >= min_score), scores + 1.0, scores)
+        pairs, used_left, used_right = [], set(), set()
+        for flat in np.argsort(-ranked, axis=None):
+            i, j = divmod(int(flat), len(right))
+            if scores[i, j] < min_score:
+                break
+            if i in used_left or j in used_right:
+                continue
+            used_left.add(i)
+            used_right.add(j)
+            code1, code2 = self.codes[left[i]], self.codes[right[j]]
+            pairs.append({
+                'category1': code1['category'], 'section1': code1['section'], 'id1': code1['id'],
+                'category2': code2['category'], 'section2': code2['section'], 'id2': code2['id'],
+                'score': float(scores[i, j]),
+                'renumbered': code1['section'] != code2['section']
+            })
+        return sorted(pairs, key=lambda pair: ((pair['category1'] or '').lower(), pair['section1']))
+
+    def section_aliases(self, jurisdictions: List[str], min_score: float = MIN_ALIGNMENT_SCORE) -> Dict[tuple, str]:
+        """Map renumbered sections to the section number they correspond to in the first jurisdiction.
+
+        Keys are (jurisdiction, category, section). A section is only mapped within its category,
+        and only when neither jurisdiction already uses the other's number.
+        """
+        def sections(jurisdiction):
+            return {((self.codes[p]['category'] or '').lower(), self.codes[p]['section'])
+                    for p in self.codes_by_jurisdiction.get(jurisdiction, [])}
+        if len(jurisdictions) < 2:
+            return {}
+        reference = jurisdictions[0]
+        reference_sections = sections(reference)
+        aliases = {}
+        for jurisdiction in jurisdictions[1:]:
+            own_sections = sections(jurisdiction)
+            for pair in self.align_sections(reference, jurisdiction, min_score=min_score):
+                category = (pair['category2'] or '').lower()
+                if (pair['renumbered'] and category == (pair['category1'] or '').lower()
+                        and (category, pair['section2']) not in reference_sections
+                        and (category, pair['section1']) not in own_sections):
+                    aliases[(jurisdiction, pair['category2'], pair['section2'])] = pair['section1']
+        return aliases
+
+    def save(self, path: str = DEFAULT_INDEX_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        partial = path + '.partial'
+        joblib.dump({
+            'vectorizer': self.vectorizer, 'svd': self.svd, 'hashes': self.hashes,
+            'vectors': self.vectors, 'centroids': self.centroids, 'codes': self.codes
+        }, partial)
+        os.replace(partial, path)
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_INDEX_PATH) -> 'SemanticIndex':
+        state = joblib.load(path)
+        return cls(state['vectorizer'], state['svd'], state['hashes'], state['vectors'], state['codes'],
+                   state['centroids'])
+
+_indexes: Dict[str, SemanticIndex] = {}
+_lock = threading.Lock()
+
+def index_path_for(db) -> str:
+    """Snapshots keep their index beside the snapshot file; Postgres uses the shared cache path"""
+    snapshot = getattr(db.backend, 'path', None)
+    return f"{snapshot}.semantic.joblib" if snapshot else DEFAULT_INDEX_PATH
+
+def get_semantic_index(db, path: Optional[str] = None) -> SemanticIndex:
+    """Process-wide index for the current corpus, reloaded from disk or refreshed as codes change.
+
+    A published index is never modified: refreshes build a new one and swap it in under the lock.
+    """
+    path = path or index_path_for(db)
+    codes = db.get_building_codes()
+    fingerprint = corpus_fingerprint(codes)
+    with _lock:
+        index = _indexes.get(path)
+        if index is not None and index.fingerprint == fingerprint:
+            return index
+        if index is None and os.path.exists(path):
+            try:
+                index = SemanticIndex.load(path)
+            except Exception as e:
+                print(f"Error loading semantic index, rebuilding: {e}")
+        if index is not None and index.fingerprint != fingerprint:
+            missing = {code['content_hash'] for code in codes} - index.row_of.keys()
+            if len(missing) > REFIT_SHARE * max(len(index.hashes), 1):
+                index = None
+            else:
+                index = index.with_texts(db.get_contents(missing), codes)
+                index.save(path)
+        if index is None:
+            index = SemanticIndex.build(codes, db.get_contents(code['content_hash'] for code in codes))
+            index.save(path)
+        _indexes[path] = index
+        return index
@@ -0,0 +1,407 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from database import Database, StorageBackend, content_hash
+
+DEFAULT_SNAPSHOT_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache', 'snapshot.sqlite3'
+)
+
+# Declared column types drive conversion back to the Python types psycopg2 returns
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_converter('DATE', lambda value: date.fromisoformat(value.decode()))
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter('JSON', lambda value: json.loads(value))
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS code_contents (
+        content_hash TEXT PRIMARY KEY,
+        content TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS building_codes (
+        id INTEGER PRIMARY KEY,
+        jurisdiction TEXT NOT NULL,
+        category TEXT,
+        section TEXT,
+        content_hash TEXT,
+        created_at TIMESTAMP,
+        last_updated TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS code_versions (
+        id INTEGER PRIMARY KEY,
+        jurisdiction TEXT NOT NULL,
+        version_number TEXT NOT NULL,
+        effective_date DATE,
+        created_at TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS code_updates (
+        id INTEGER PRIMARY KEY,
+        code_version_id INTEGER NOT NULL,
+        section TEXT,
+        category TEXT,
+        previous_content TEXT,
+        new_content TEXT,
+        change_type TEXT,
+        update_date TIMESTAMP,
+        diff JSON,
+        content_hash TEXT
+    );
+    CREATE TABLE IF NOT EXISTS section_history (
+        id INTEGER PRIMARY KEY,
+        jurisdiction TEXT NOT NULL,
+        category TEXT NOT NULL,
+        section TEXT NOT NULL,
+        content_hash TEXT NOT NULL,
+        valid_from DATE,
+        valid_to DATE
+    );
+    CREATE TABLE IF NOT EXISTS code_references (
+        content_hash TEXT PRIMARY KEY,
+        sections JSON NOT NULL,
+        standards JSON NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS code_measurements (
+        content_hash TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        quantity TEXT NOT NULL,
+        value REAL NOT NULL,
+        bound TEXT NOT NULL,
+        attribute TEXT,
+        subject TEXT,
+        modal TEXT,
+        raw TEXT NOT NULL,
+        PRIMARY KEY (content_hash, position)
+    );
+    CREATE TABLE IF NOT EXISTS measured_texts (
+        content_hash TEXT PRIMARY KEY
+    );
+    CREATE TABLE IF NOT EXISTS code_categories (
+        content_hash TEXT PRIMARY KEY,
+        model_version TEXT NOT NULL,
+        category TEXT NOT NULL,
+        confidence REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS snapshot_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+"""
+
+# Built after the bulk load, which is much faster than maintaining them row by row
+INDEXES = """
+    CREATE INDEX IF NOT EXISTS building_codes_jurisdiction_idx ON building_codes (jurisdiction, category, section);
+    CREATE INDEX IF NOT EXISTS code_versions_jurisdiction_idx ON code_versions (jurisdiction, effective_date);
+    CREATE INDEX IF NOT EXISTS code_updates_version_idx ON code_updates (code_version_id, change_type);
+    CREATE INDEX IF NOT EXISTS code_updates_section_idx ON code_updates (category, section, id);
+    CREATE INDEX IF NOT EXISTS code_updates_date_idx ON code_updates (update_date, id);
+    CREATE INDEX IF NOT EXISTS section_history_jurisdiction_idx ON section_history (jurisdiction, valid_from, valid_to);
+    CREATE INDEX IF NOT EXISTS code_measurements_value_idx ON code_measurements (quantity, attribute, value);
+"""
+
+TABLE_COLUMNS = {
+    'code_contents': ['content_hash', 'content'],
+    'building_codes': ['id', 'jurisdiction', 'category', 'section', 'content_hash', 'created_at', 'last_updated'],
+    'code_versions': ['id', 'jurisdiction', 'version_number', 'effective_date', 'created_at'],
+    'code_updates': ['id', 'code_version_id', 'section', 'category', 'previous_content', 'new_content',
+                     'change_type', 'update_date', 'diff', 'content_hash'],
+    'section_history': ['id', 'jurisdiction', 'category', 'section', 'content_hash', 'valid_from', 'valid_to'],
+    'code_references': ['content_hash', 'sections', 'standards'],
+    'code_measurements': ['content_hash', 'position', 'quantity', 'value', 'bound', 'attribute', 'subject',
+                          'modal', 'raw'],
+    'measured_texts': ['content_hash'],
+    'code_categories': ['content_hash', 'model_version', 'category', 'confidence']
+}
+
+def _dict_row(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+def _initcap(value):
+    return value.title() if value is not None else None
+
+def _table_rows(table: str, rows: Iterable[Dict]) -> Iterator[tuple]:
+    """Tuples in TABLE_COLUMNS order, reshaping Postgres-only types on the way"""
+    columns = TABLE_COLUMNS[table]
+    for row in rows:
+        if table == 'section_history' and 'validity' in row:
+            validity = row['validity']
+            if validity.isempty:
+                # Contains no date, and NULL bounds here would mean unbounded
+                continue
+            row = dict(row, valid_from=validity.lower, valid_to=validity.upper)
+        if table == 'code_updates' and row.get('diff') is not None and not isinstance(row['diff'], str):
+            row = dict(row, diff=json.dumps(row['diff']))
+        if table == 'code_references' and not isinstance(row['sections'], str):
+            row = dict(row, sections=json.dumps(row['sections']), standards=json.dumps(row['standards']))
+        yield tuple(row.get(column) for column in columns)
+
+class SQLiteBackend(StorageBackend):
+    """Read-only corpus snapshot in an embedded SQLite file, queried in-process.
+
+    Runs the same reads as PostgresBackend without a server, so batch analysis and local
+    testing can work offline from a copy taken with ``create_snapshot``.
+    """
+
+    immutable = True
+
+    def __init__(self, path: str = DEFAULT_SNAPSHOT_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def connection(self) -> sqlite3.Connection:
+        """One connection per thread, kept open; the file never changes while in use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES)
+            conn.row_factory = _dict_row
+            conn.create_function('INITCAP', 1, _initcap, deterministic=True)
+            conn.execute("PRAGMA query_only = ON")
+            conn.execute("PRAGMA cache_size = -65536")
+            self._local.conn = conn
+        return conn
+
+    def _query(self, sql: str, params=()) -> List[Dict]:
+        return self.connection().execute(sql, params).fetchall()
+
+    def frame(self, sql: str, params=()):
+        """Run any read query and return a pandas DataFrame, for column-wise analysis"""
+        import pandas as pd
+        # pandas reads tuples, so this uses a connection without the dict row factory
+        conn = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES)
+        try:
+            conn.create_function('INITCAP', 1, _initcap, deterministic=True)
+            return pd.read_sql_query(sql, conn, params=params)
+        finally:
+            conn.close()
+
+    def meta(self) -> Dict[str, str]:
+        return {row['key']: row['value'] for row in self._query("SELECT key, value FROM snapshot_meta")}
+
+    def load_building_codes(self, jurisdiction=None):
+        return self._query("""
+            SELECT DISTINCT id, jurisdiction, INITCAP(category) AS category, section, content_hash,
+                   last_updated, created_at
+            FROM building_codes
+            WHERE (jurisdiction = ? OR ? IS NULL)
+            ORDER BY LOWER(category), section
+        """, (jurisdiction, jurisdiction))
+
+    def load_jurisdictions(self):
+        return [row['jurisdiction'] for row in
+                self._query("SELECT DISTINCT jurisdiction FROM building_codes ORDER BY jurisdiction")]
+
+    def load_categories(self):
+        return [row['category'] for row in self._query("""
+            SELECT DISTINCT INITCAP(category) AS category, LOWER(category) AS sort_category
+            FROM building_codes
+            ORDER BY sort_category
+        """)]
+
+    def fetch_contents(self, hashes):
+        contents = {}
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(hashes), 900):
+            batch = hashes[start:start + 900]
+            rows = self.connection().execute(
+                f"SELECT content_hash, content FROM code_contents WHERE content_hash IN ({','.join('?' * len(batch))})",
+                batch
+            )
+            contents.update((row['content_hash'], row['content']) for row in rows)
+        return contents
+
+    def load_references(self, hashes=None):
+        # Snapshots taken before citations were indexed don't have the table
+        if not self._query("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'code_references'"):
+            return []
+        if hashes is None:
+            return self._query("SELECT content_hash, sections, standards FROM code_references")
+        hashes, rows = list(hashes), []
+        for start in range(0, len(hashes), 900):
+            batch = hashes[start:start + 900]
+            rows.extend(self._query(
+                f"SELECT content_hash, sections, standards FROM code_references "
+                f"WHERE content_hash IN ({','.join('?' * len(batch))})", batch
+            ))
+        return rows
+
+    def load_measurements(self):
+        if not self._query("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'code_measurements'"):
+            return []
+        return self._query("SELECT * FROM code_measurements ORDER BY content_hash, position")
+
+    def load_measured_texts(self):
+        if not self._query("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'measured_texts'"):
+            return set()
+        return {row['content_hash'] for row in self._query("SELECT content_hash FROM measured_texts")}
+
+    def _update_filters(self, jurisdiction, category, from_date):
+        clause, params = " WHERE 1=1", []
+        if jurisdiction:
+            clause += " AND cv.jurisdiction = ?"
+            params.append(jurisdiction)
+        if category:
+            clause += " AND cu.category = ?"
+            params.append(category)
+        if from_date:
+            clause += " AND cu.update_date >= ?"
+            params.append(from_date)
+        return clause, params
+
+    def code_updates(self, jurisdiction, category, from_date, limit, offset):
+        clause, params = self._update_filters(jurisdiction, category, from_date)
+        return self._query("""
+            SELECT cu.*, cv.jurisdiction, cv.version_number, cv.effective_date
+            FROM code_updates cu
+            JOIN code_versions cv ON cu.code_version_id = cv.id
+        """ + clause + " ORDER BY cu.update_date DESC, cu.id DESC LIMIT ? OFFSET ?", params + [limit, offset])
+
+    def count_code_updates(self, jurisdiction, category, from_date):
+        clause, params = self._update_filters(jurisdiction, category, from_date)
+        return self.connection().execute("""
+            SELECT COUNT(*) AS count
+            FROM code_updates cu
+            JOIN code_versions cv ON cu.code_version_id = cv.id
+        """ + clause, params).fetchone()['count']
+
+    def version_history(self, jurisdiction=None):
+        query = """
+            SELECT cv.*, COUNT(cu.id) AS update_count,
+                   COUNT(cu.id) FILTER (WHERE cu.change_type = 'ADD') AS added_count,
+                   COUNT(cu.id) FILTER (WHERE cu.change_type = 'MODIFY') AS modified_count,
+                   COUNT(cu.id) FILTER (WHERE cu.change_type = 'DELETE') AS deleted_count
+            FROM code_versions cv
+            LEFT JOIN code_updates cu ON cv.id = cu.code_version_id
+            WHERE (cv.jurisdiction = ? OR ? IS NULL)
+            GROUP BY cv.id ORDER BY cv.effective_date DESC
+        """
+        return self._query(query, (jurisdiction, jurisdiction))
+
+    def codes_as_of(self, jurisdiction, as_of):
+        # NULL bounds are open ends, as in an unbounded Postgres daterange
+        return self._query("""
+            SELECT sh.id, sh.jurisdiction, INITCAP(sh.category) AS category, sh.section,
+                   sh.content_hash, cc.content, sh.valid_from, sh.valid_to
+            FROM section_history sh
+            JOIN code_contents cc ON cc.content_hash = sh.content_hash
+            WHERE sh.jurisdiction = ?
+            AND (sh.valid_from IS NULL OR sh.valid_from <= ?) AND (sh.valid_to IS NULL OR sh.valid_to > ?)
+            ORDER BY LOWER(sh.category), sh.section
+        """, (jurisdiction, as_of, as_of))
+
+    def section_updates(self, update):
+        later_updates = self._query("""
+            SELECT cu.id, cu.change_type, cu.diff, cu.previous_content, cu.new_content
+            FROM code_updates cu
+            JOIN code_versions cv ON cu.code_version_id = cv.id
+            WHERE cv.jurisdiction = ? AND LOWER(cu.category) = LOWER(?)
+            AND cu.section = ? AND cu.id >= ?
+            ORDER BY cu.id DESC
+        """, (update['jurisdiction'], update['category'], update['section'], update['id']))
+        rows = self._query("""
+            SELECT cc.content
+            FROM building_codes bc JOIN code_contents cc ON cc.content_hash = bc.content_hash
+            WHERE bc.jurisdiction = ? AND LOWER(bc.category) = LOWER(?) AND bc.section = ?
+            LIMIT 1
+        """, (update['jurisdiction'], update['category'], update['section']))
+        return later_updates, rows[0]['content'] if rows else None
+
+    def export_tables(self):
+        tables = {row['name'] for row in self._query("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for table, columns in TABLE_COLUMNS.items():
+            if table not in tables:
+                continue
+            yield table, iter(self.connection().execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY 1"))
+
+def load_tables(path: str, tables: Iterable[Tuple[str, Iterable[Dict]]], source: str = '') -> Dict[str, int]:
+    """Write a fresh snapshot file from (table, rows) pairs, such as another backend's export_tables"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    partial = path + '.partial'
+    if os.path.exists(partial):
+        os.remove(partial)
+    counts = {}
+    conn = sqlite3.connect(partial)
+    try:
+        conn.executescript("PRAGMA journal_mode = OFF; PRAGMA synchronous = OFF;" + SCHEMA)
+        for table, rows in tables:
+            columns = TABLE_COLUMNS[table]
+            insert = (f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) "
+                      f"VALUES ({', '.join('?' * len(columns))})")
+            before = conn.total_changes
+            conn.executemany(insert, _table_rows(table, rows))
+            counts[table] = counts.get(table, 0) + conn.total_changes - before
+        conn.executescript(INDEXES)
+        conn.executemany("INSERT OR REPLACE INTO snapshot_meta (key, value) VALUES (?, ?)", [
+            ('created_at', datetime.now().isoformat(timespec='seconds')),
+            ('source', source),
+            ('row_counts', json.dumps(counts))
+        ])
+        conn.commit()
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+    # Swap in the finished file so readers never see a half-loaded snapshot
+    os.replace(partial, path)
+    return counts
+
+def create_snapshot(db: Database, path: str = DEFAULT_SNAPSHOT_PATH) -> Dict[str, int]:
+    """Copy the corpus from ``db``'s backend (normally Postgres) into a snapshot file"""
+    return load_tables(path, db.backend.export_tables(), source=type(db.backend).__name__)
+
+def corpus_tables(corpus: Dict[str, List[Dict]]) -> Iterator[Tuple[str, Iterable[Dict]]]:
+    """Snapshot tables for a synthetic corpus from benchmarks.corpus, texts interned by hash"""
+    codes = corpus['codes']
+    updates = corpus['updates']
+    # History refers to every text a section has had, not only the current ones
+    texts = [code['content'] for code in codes] + [update['new_content'] for update in updates
+                                                   if update['new_content'] is not None]
+    yield 'code_contents', ({'content_hash': content_hash(text), 'content': text} for text in texts)
+    yield 'building_codes', (dict(code, content_hash=code.get('content_hash') or content_hash(code['content']))
+                             for code in codes)
+    yield 'code_versions', corpus['versions']
+    yield 'code_updates', (dict(update, update_date=datetime.combine(update['update_date'], datetime.min.time()))
+                           for update in updates)
+    # Each update closes the section's open interval and opens the next one
+    history, open_rows = [], {}
+    for update in sorted(updates, key=lambda update: update['id']):
+        key = (update['jurisdiction'], update['category'], update['section'])
+        if key in open_rows:
+            open_rows.pop(key)['valid_to'] = update['update_date']
+        if update['new_content'] is not None:
+            open_rows[key] = {'id': len(history) + 1, 'jurisdiction': update['jurisdiction'],
+                              'category': update['category'], 'section': update['section'],
+                              'content_hash': content_hash(update['new_content']),
+                              'valid_from': update['update_date'],
+                              'valid_to': None}
+            history.append(open_rows[key])
+    yield 'section_history', history
+
+def open_snapshot(path: str = DEFAULT_SNAPSHOT_PATH) -> Database:
+    """A Database reading from a snapshot file; pass it to CodeTracker as usual"""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No snapshot at {path}; create one with python -m utils.sqlite_backend")
+    return Database(backend=SQLiteBackend(path))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Create an embedded SQLite snapshot of the code corpus")
+    parser.add_argument('--output', default=DEFAULT_SNAPSHOT_PATH, help="Snapshot file to write")
+    parser.add_argument('--corpus', action='store_true',
+                        help="Load a synthetic corpus instead of copying Postgres (no server needed)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--jurisdictions', type=int, default=109)
+    parser.add_argument('--sections', type=int, default=10, help="Sections per category for --corpus")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.corpus:
+        from benchmarks.corpus import generate_corpus
+        corpus = generate_corpus(args.seed, args.jurisdictions, args.sections)
+        counts = load_tables(args.output, corpus_tables(corpus), source=f"synthetic corpus (seed {args.seed})")
+    else:
+        counts = create_snapshot(Database(), args.output)
+    print(f"Wrote {args.output} in {time.perf_counter() - start:.1f}s: "
+          + ', '.join(f"{table} {count}" for table, count in counts.items()))
@@ -0,0 +1,208 @@
+import re
+from bisect import bisect_left
+from math import isqrt
+from typing import List, Optional, Tuple
+from utils.instrumentation import traced
+
+# Words and the whitespace between them, so joining tokens reproduces the text exactly
+TOKEN = re.compile(r'\s+|\S+')
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN.findall(text or '')
+
+def _middle_snake(a: List[int], alo: int, ahi: int, b: List[int], blo: int, bhi: int,
+                  max_cost: int) -> Tuple[int, int, int, int]:
+    """Myers' linear-space middle snake splitting a[alo:ahi] and b[blo:bhi].
+
+    Returns (x, y, length) of the matching run plus the number of edit steps searched.
+
+    Searches from both ends at once, keeping only one furthest-reaching x per diagonal. Past
+    ``max_cost`` edits it gives up on a minimal diff and splits at the furthest point reached.
+    """
+    n, m = ahi - alo, bhi - blo
+    delta = n - m
+    odd = delta & 1
+    offset = n + m + 1
+    forward = [0] * (2 * offset + 1)
+    backward = [0] * (2 * offset + 1)
+
+    for d in range((n + m + 1) // 2 + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forward[offset + k - 1] < forward[offset + k + 1]):
+                x = forward[offset + k + 1]
+            else:
+                x = forward[offset + k - 1] + 1
+            y = x - k
+            start = x
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            forward[offset + k] = x
+            if odd and -(d - 1) <= delta - k <= d - 1 and x + backward[offset + delta - k] >= n:
+                return alo + start, blo + start - k, x - start, d
+
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and backward[offset + k - 1] < backward[offset + k + 1]):
+                x = backward[offset + k + 1]
+            else:
+                x = backward[offset + k - 1] + 1
+            y = x - k
+            start = x
+            while x < n and y < m and a[ahi - 1 - x] == b[bhi - 1 - y]:
+                x += 1
+                y += 1
+            backward[offset + k] = x
+            if not odd and -d <= delta - k <= d and x + forward[offset + delta - k] >= n:
+                return ahi - x, bhi - (x - k), x - start, d
+
+        if d >= max_cost:
+            # Too expensive to stay minimal: split where either search got furthest
+            best_x, best_y, best = 0, 0, -1
+            for k in range(-d, d + 1, 2):
+                x = forward[offset + k]
+                if 0 <= x - k <= m and x <= n and 2 * x - k > best:
+                    best, best_x, best_y = 2 * x - k, x, x - k
+                x = backward[offset + k]
+                if 0 <= x - k <= m and x <= n and 2 * x - k > best:
+                    best, best_x, best_y = 2 * x - k, n - x, m - (x - k)
+            return alo + best_x, blo + best_y, 0, d
+    raise AssertionError("middle snake not found")
+
+def _unique_anchors(a: List[int], b: List[int]) -> List[Tuple[int, int]]:
+    """Tokens occurring exactly once on each side, kept in the longest run that is in order on both"""
+    counts = {}
+    for i, token in enumerate(a):
+        counts[token] = (counts[token][0] + 1, i) if token in counts else (1, i)
+    in_b = {}
+    for j, token in enumerate(b):
+        if counts.get(token, (0,))[0] == 1:
+            in_b[token] = None if token in in_b else j
+    pairs = sorted((counts[token][1], j) for token, j in in_b.items() if j is not None)
+
+    # Patience sorting: longest increasing subsequence of b positions, ordered by a position
+    tails, tail_index, previous = [], [], [None] * len(pairs)
+    for index, (_, j) in enumerate(pairs):
+        position = bisect_left(tails, j)
+        if position == len(tails):
+            tails.append(j)
+            tail_index.append(index)
+        else:
+            tails[position] = j
+            tail_index[position] = index
+        previous[index] = tail_index[position - 1] if position else None
+    anchors = []
+    index = tail_index[-1] if tail_index else None
+    while index is not None:
+        anchors.append(pairs[index])
+        index = previous[index]
+    return anchors[::-1]
+
+def matching_blocks(a: List, b: List, max_cost: Optional[int] = None,
+                    max_work: int = 1000000) -> List[Tuple[int, int, int]]:
+    """Matching runs (i, j, length) of a token-level diff of ``a`` against ``b``, in order.
+
+    Tokens unique to both sides anchor the alignment first, as in patience diff, so each Myers
+    search only spans the text between two anchors. Common prefixes and suffixes are stripped
+    before each search, so small edits to long texts cost little more than a scan, and memory
+    stays linear in the input length. Once the searches have visited about ``max_work``
+    diagonals, the remaining gaps are reported as plain replacements.
+    """
+    codes = {}
+    a = [codes.setdefault(token, len(codes)) for token in a]
+    b = [codes.setdefault(token, len(codes)) for token in b]
+    if max_cost is None:
+        max_cost = max(64, isqrt(len(a) + len(b)))
+
+    stack = []
+    i = j = 0
+    for anchor_i, anchor_j in _unique_anchors(a, b):
+        stack.append(('range', i, anchor_i, j, anchor_j))
+        stack.append(('match', anchor_i, anchor_j, 1))
+        i, j = anchor_i + 1, anchor_j + 1
+    stack.append(('range', i, len(a), j, len(b)))
+    stack.reverse()
+
+    blocks = []
+    while stack:
+        item = stack.pop()
+        if item[0] == 'match':
+            if not item[3]:
+                continue
+            last = blocks[-1] if blocks else None
+            if last and last[0] + last[2] == item[1] and last[1] + last[2] == item[2]:
+                blocks[-1] = (last[0], last[1], last[2] + item[3])
+            else:
+                blocks.append(item[1:])
+            continue
+        _, alo, ahi, blo, bhi = item
+        prefix = 0
+        while alo + prefix < ahi and blo + prefix < bhi and a[alo + prefix] == b[blo + prefix]:
+            prefix += 1
+        suffix = 0
+        while (ahi - suffix > alo + prefix and bhi - suffix > blo + prefix
+               and a[ahi - 1 - suffix] == b[bhi - 1 - suffix]):
+            suffix += 1
+
+        stack.append(('match', ahi - suffix, bhi - suffix, suffix))
+        inner_alo, inner_ahi = alo + prefix, ahi - suffix
+        inner_blo, inner_bhi = blo + prefix, bhi - suffix
+        if inner_alo < inner_ahi and inner_blo < inner_bhi and max_work > 0:
+            x, y, length, cost = _middle_snake(a, inner_alo, inner_ahi, b, inner_blo, inner_bhi, max_cost)
+            max_work -= (cost + 1) ** 2
+            stack.append(('range', x + length, inner_ahi, y + length, inner_bhi))
+            stack.append(('match', x, y, length))
+            stack.append(('range', inner_alo, x, inner_blo, y))
+        stack.append(('match', alo, blo, prefix))
+    return blocks
+
+@traced('diff.word_diff')
+def word_diff(old: str, new: str) -> List[list]:
+    """Compact word-level diff: ['=', n_chars], ['-', deleted_text], ['+', inserted_text]"""
+    if old == new:
+        return [['=', len(old)]] if old else []
+    old_tokens, new_tokens = tokenize(old), tokenize(new)
+    ops = []
+    i = j = 0
+    for block_i, block_j, length in matching_blocks(old_tokens, new_tokens) + [(len(old_tokens), len(new_tokens), 0)]:
+        if block_i > i:
+            ops.append(['-', ''.join(old_tokens[i:block_i])])
+        if block_j > j:
+            ops.append(['+', ''.join(new_tokens[j:block_j])])
+        if length:
+            size = sum(len(token) for token in old_tokens[block_i:block_i + length])
+            if ops and ops[-1][0] == '=':
+                ops[-1][1] += size
+            else:
+                ops.append(['=', size])
+        i, j = block_i + length, block_j + length
+    return ops
+
+def apply_diff(old: str, ops: List[list]) -> str:
+    """Rebuild the new text from the old text and a word_diff"""
+    parts, pos = [], 0
+    for op, value in ops:
+        if op == '=':
+            parts.append(old[pos:pos + value])
+            pos += value
+        elif op == '-':
+            pos += len(value)
+        else:
+            parts.append(value)
+    return ''.join(parts)
+
+def revert_diff(new: str, ops: List[list]) -> str:
+    """Rebuild the old text from the new text and a word_diff"""
+    parts, pos = [], 0
+    for op, value in ops:
+        if op == '=':
+            parts.append(new[pos:pos + value])
+            pos += value
+        elif op == '+':
+            pos += len(value)
+        else:
+            parts.append(value)
+    return ''.join(parts)
+
+def diff_size(ops: Optional[List[list]]) -> int:
+    """Characters stored by a diff, for comparing against full-text storage"""
+    return sum(len(value) for op, value in ops or [] if op != '=')